@@ -0,0 +1,112 @@
+"""
+Ingest-time text analysis.
+
+Each message is split into sentences, tokenized, stop-word filtered and
+stemmed once, when it is written. The result is stored as a packed term
+vector in `message_terms` and the chat's vocabulary (term, id, document
+frequency) in `vocab`, so the TF-IDF backend assembles its sentence-term
+matrix from stored vectors instead of re-parsing text on every summary.
+
+Term ids are a stable hash of the stemmed term, so vectors computed on the
+fly for messages that have none (older rows, the in-memory hot tier) line
+up with stored ones.
+
+Existing messages can be analyzed after the fact:
+
+    python analysis.py backfill [messages.db]
+"""
+import argparse
+import re
+import sys
+import zlib
+from array import array
+from collections import Counter
+from functools import lru_cache
+
+# Compiled once: word tokens and sentence boundaries inside a message
+TOKEN_RE = re.compile(r"[^\W_][\w']+", re.UNICODE)
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+STOP_WORDS = frozenset("""
+a about above after again against all am an and any are as at be because been before being
+below between both but by can could did do does doing down during each few for from further
+had has have having he her here hers herself him himself his how i if in into is it its itself
+just me more most my myself no nor not now of off on once only or other our ours ourselves out
+over own same she should so some such than that the their theirs them themselves then there
+these they this those through to too under until up very was we were what when where which
+while who whom why will with would you your yours yourself yourselves im its dont ok okay yes
+yeah lol also get got like one know think want going go
+""".split())
+
+# Sentences and counts are packed as uint16
+MAX_SENTENCES = 0xFFFF
+
+def split_sentences(text):
+    """Non-empty sentences of a message, in order"""
+    return [sentence for sentence in SENTENCE_RE.split(text.strip()) if sentence]
+
+def term_id(term):
+    """Stable 31-bit id of a (stemmed) term"""
+    return zlib.crc32(term.encode("utf-8")) & 0x7FFFFFFF
+
+class Analyzer:
+    """Tokenizer + stop words + Snowball stemmer, with the stemmer memoized per term"""
+    def __init__(self):
+        from sumy.nlp.stemmers import Stemmer
+        self._stem = lru_cache(maxsize=200000)(Stemmer("english"))
+
+    def sentence_terms(self, text):
+        """Stemmed content terms of each sentence of text"""
+        findall = TOKEN_RE.findall
+        stem = self._stem
+        return [
+            [stem(token) for token in findall(sentence.lower()) if token not in STOP_WORDS]
+            for sentence in split_sentences(text)
+        ]
+
+    def analyze(self, text):
+        """(packed vector, Counter of terms) of a message.
+        The vector holds uint32 term ids followed by (sentence, count) uint16 pairs."""
+        ids = array("I")
+        meta = array("H")
+        terms = Counter()
+        for index, sentence in enumerate(self.sentence_terms(text)[:MAX_SENTENCES]):
+            for term, count in Counter(sentence).items():
+                ids.append(term_id(term))
+                meta.append(index)
+                meta.append(min(count, 0xFFFF))
+                terms[term] += 1
+        return ids.tobytes() + meta.tobytes(), terms
+
+def unpack_vector(vector):
+    """(term ids, sentence indices, counts) lists of a packed vector"""
+    ids = array("I")
+    meta = array("H")
+    size = len(vector) // 8
+    ids.frombytes(vector[:size * 4])
+    meta.frombytes(vector[size * 4:])
+    return ids, meta[0::2], meta[1::2]
+
+def backfill(db_path, batch_size=5000):
+    """Analyze every message that has no stored vector yet"""
+    from database import MessageDB
+    db = MessageDB(db_path, analyze=True)
+    total = 0
+    while True:
+        done = db.analyze_pending(batch_size)
+        if not done:
+            break
+        total += done
+        print(f"\ranalyzed {total} messages", end="", file=sys.stderr)
+    print(f"\nAnalyzed {total} messages")
+    db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("backfill",))
+    parser.add_argument("db_path", nargs="?", default="messages.db")
+    args = parser.parse_args()
+    backfill(args.db_path)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import asyncio
+import functools
+import logging
+import queue
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from database import MessageDB
+import tracing
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+def _timed_call(db, method, args):
+    """Call a MessageDB method, recording its duration per method name"""
+    start = time.perf_counter()
+    try:
+        return getattr(db, method)(*args)
+    finally:
+        DB_SECONDS.observe(method, time.perf_counter() - start)
+
+class AsyncMessageDB:
+    """
+    Async counterpart of MessageDB for use inside handlers.
+    All writes go through one writer connection on a single thread, reads are
+    served by a pool of read-only WAL connections so they run in parallel and
+    never block the event loop.
+    """
+    def __init__(self, db_path='messages.db', readers=4, message_codec=None, analyze=False):
+        self.db_path = db_path
+        # The writer owns schema setup/migrations, so it must exist before any reader
+        self.writer = MessageDB(db_path, message_codec=message_codec, analyze=analyze)
+        self._writer_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="db-writer")
+
+        self._all_readers = [
+            MessageDB(db_path, read_only=True, analyze=analyze) for _ in range(max(1, readers))
+        ]
+        self._readers = queue.Queue()
+        for reader in self._all_readers:
+            self._readers.put(reader)
+        self._reader_executor = ThreadPoolExecutor(max_workers=max(1, readers), thread_name_prefix="db-reader")
+        logger.info(f"✅ Async database ready: 1 writer, {max(1, readers)} readers")
+
+    async def _write(self, method, *args):
+        """Run a MessageDB write method on the writer thread"""
+        loop = asyncio.get_running_loop()
+        with tracing.span(f"db.{method}"):
+            return await loop.run_in_executor(self._writer_executor, _timed_call, self.writer, method, args)
+
+    def _call_reader(self, method, args):
+        """Check out a reader connection, run the method, hand it back"""
+        reader = self._readers.get()
+        try:
+            return _timed_call(reader, method, args)
+        finally:
+            self._readers.put(reader)
+
+    async def _read(self, method, *args):
+        """Run a MessageDB read method on a pooled reader connection"""
+        loop = asyncio.get_running_loop()
+        with tracing.span(f"db.{method}"):
+            return await loop.run_in_executor(self._reader_executor, self._call_reader, method, args)
+
+    async def run_sync(self, func, *args):
+        """Run any blocking callable (e.g. an ingest flush) on the writer thread"""
+        loop = asyncio.get_running_loop()
+        with tracing.span(f"db.{getattr(func, '__name__', 'run_sync')}"):
+            return await loop.run_in_executor(self._writer_executor, functools.partial(func, *args))
+
+    async def add_message(self, chat_id, user_id, user_name, username, message_text):
+        return await self._write("add_message", chat_id, user_id, user_name, username, message_text)
+
+    async def add_messages(self, rows):
+        return await self._write("add_messages", rows)
+
+    async def get_messages_today(self, chat_id):
+        return await self._read("get_messages_today", chat_id)
+
+    async def get_messages_last_hours(self, chat_id, hours):
+        return await self._read("get_messages_last_hours", chat_id, hours)
+
+    async def get_messages_between(self, chat_id, start, end):
+        return await self._read("get_messages_between", chat_id, start, end)
+
+    async def iter_message_batches(self, chat_id, start, end, batch_size=500):
+        """Async generator of message batches, paged by (ts, id) so no reader connection
+        or read snapshot is held while the consumer works on a batch"""
+        after = None
+        while True:
+            batch, after = await self._read("get_messages_page", chat_id, start, end, after, batch_size)
+            if batch:
+                yield batch
+            if after is None:
+                return
+
+    async def count_messages(self, chat_id, hours=None):
+        return await self._read("count_messages", chat_id, hours)
+
+    async def count_messages_between(self, chat_id, start, end, limit=None):
+        return await self._read("count_messages_between", chat_id, start, end, limit)
+
+    async def get_segment_counts(self, chat_id, start, end, segment_seconds):
+        return await self._read("get_segment_counts", chat_id, start, end, segment_seconds)
+
+    async def get_segments(self, chat_id, start, end):
+        return await self._read("get_segments", chat_id, start, end)
+
+    async def save_segment(self, chat_id, seg_start, seg_end, message_count, representatives):
+        return await self._write("save_segment", chat_id, seg_start, seg_end, message_count, representatives)
+
+    async def get_messages_by_person(self, chat_id, person_names, hours=None):
+        return await self._read("get_messages_by_person", chat_id, person_names, hours)
+
+    async def get_chat_state(self, chat_id):
+        return await self._read("get_chat_state", chat_id)
+
+    async def get_participants(self, chat_id, hours=None):
+        return await self._read("get_participants", chat_id, hours)
+
+    async def search_messages(self, chat_id, match, start=0, end=None, limit=10):
+        return await self._read("search_messages", chat_id, match, start, end, limit)
+
+    async def save_digest(self, chat_id, kind, summary, participants, message_count, chat_message_count):
+        return await self._write(
+            "save_digest", chat_id, kind, summary, participants, message_count, chat_message_count
+        )
+
+    async def get_digest(self, chat_id, kind):
+        return await self._read("get_digest", chat_id, kind)
+
+    async def get_active_chats(self, since_ts):
+        return await self._read("get_active_chats", since_ts)
+
+    async def get_oldest_ts(self, chat_id, before_ts):
+        return await self._read("get_oldest_ts", chat_id, before_ts)
+
+    async def get_archive_rows(self, chat_id, start, end):
+        return await self._read("get_archive_rows", chat_id, start, end)
+
+    async def save_archive(self, chat_id, day, rows, summary, keep_payload=True):
+        return await self._write("save_archive", chat_id, day, rows, summary, keep_payload)
+
+    async def delete_messages(self, ids, batch_size=500):
+        return await self._write("delete_messages", ids, batch_size)
+
+    async def delete_segments_before(self, chat_id, before_ts):
+        return await self._write("delete_segments_before", chat_id, before_ts)
+
+    async def compact(self, max_pages=2000):
+        return await self._write("compact", max_pages)
+
+    async def get_archive(self, chat_id, day):
+        return await self._read("get_archive", chat_id, day)
+
+    async def get_archived_messages(self, chat_id, day):
+        return await self._read("get_archived_messages", chat_id, day)
+
+    async def train_codec_dictionary(self):
+        return await self._write("train_codec_dictionary")
+
+    async def codec_dictionary_age(self):
+        return await self._write("codec_dictionary_age")
+
+    def get_codec_stats(self):
+        """Compression ratio and decode cost summed over every connection, for /health"""
+        connections = [self.writer, *self._all_readers]
+        totals = {}
+        for connection in connections:
+            for key, value in connection.codec.stats.items():
+                totals[key] = totals.get(key, 0) + value
+        totals["codec"] = self.writer.codec.codec
+        totals["saved_bytes"] = totals["bytes_in"] - totals["bytes_out"]
+        totals["decode_us_per_message"] = (
+            round(totals["decode_seconds"] * 1e6 / totals["decoded"], 2) if totals["decoded"] else 0.0
+        )
+        totals["decode_seconds"] = round(totals["decode_seconds"], 3)
+        return totals
+
+    def close(self):
+        """Stop the executors and close every connection"""
+        self._reader_executor.shutdown(wait=True)
+        self._writer_executor.shutdown(wait=True)
+        while not self._readers.empty():
+            self._readers.get_nowait().close()
+        self.writer.close()
@@ -0,0 +1,55 @@
+"""
+Compare the Luhn (sumy) and TF-IDF summarizer backends on synthetic chats.
+
+    python benchmarks/bench_backends.py [--sizes 100,1000,10000] [--repeat 3]
+
+Prints latency per backend and how much the two summaries overlap
+(Jaccard similarity of their content words).
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summarizer import Summarizer
+from tfidf_summarizer import STOP_WORDS, TOKEN_RE
+from synthetic import summarizer_messages
+
+def content_words(text):
+    return {t for t in TOKEN_RE.findall(text.lower()) if t not in STOP_WORDS}
+
+def bench(sizes, repeat):
+    backends = {name: Summarizer(name) for name in ("luhn", "tfidf")}
+    for summarizer in backends.values():
+        summarizer.warm_up()
+
+    results = []
+    for size in sizes:
+        messages = summarizer_messages(size, users=8)
+        row = {"messages": size}
+        outputs = {}
+        for name, summarizer in backends.items():
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                outputs[name] = summarizer.summarize(messages)
+                timings.append((time.perf_counter() - start) * 1000)
+            row[f"{name}_ms"] = round(min(timings), 2)
+        a, b = content_words(outputs["luhn"]), content_words(outputs["tfidf"])
+        row["overlap"] = round(len(a & b) / max(1, len(a | b)), 3)
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+    bench([int(s) for s in args.sizes.split(",")], args.repeat)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+"""
+MessageDB benchmarks: ingest throughput and the latency of every read query.
+
+Databases for the query benchmark are generated once per size (and
+generator settings) under --data-dir and reused by later runs for a few
+hours, after which they are rebuilt so time-relative queries still hit data.
+"""
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import MessageDB
+from search import match_query
+from synthetic import ChatGenerator
+
+# Generated databases older than this are rebuilt
+MAX_AGE_SECONDS = 6 * 3600
+
+def bench_add_message(count=2000):
+    """One add_message call (one transaction) per message, as the bot did before the ingest queue"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = MessageDB(os.path.join(tmp, "ingest.db"))
+        rows = list(ChatGenerator(seed=1).rows(count))
+        start = time.perf_counter()
+        for chat_id, user_id, user_name, username, text, _, _ in rows:
+            db.add_message(chat_id, user_id, user_name, username, text)
+        elapsed = time.perf_counter() - start
+        db.close()
+    return {"messages": count, "ops_per_s": round(count / elapsed, 1)}
+
+def bench_add_messages(count=50000, batch_size=200):
+    """add_messages in ingest-queue sized batches"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db = MessageDB(os.path.join(tmp, "ingest.db"))
+        batches = list(ChatGenerator(seed=2).batches(count, batch_size))
+        start = time.perf_counter()
+        for batch in batches:
+            db.add_messages(batch)
+        elapsed = time.perf_counter() - start
+        db.close()
+    return {"messages": count, "batch_size": batch_size, "ops_per_s": round(count / elapsed, 1)}
+
+def build_database(data_dir, rows, generator_args):
+    """Path of a database holding `rows` generated messages, building it if needed"""
+    key = "-".join(f"{k}{v}" for k, v in sorted(generator_args.items()))
+    path = os.path.join(data_dir, f"bench-{rows}-{key}.db")
+    marker = path + ".json"
+    if os.path.exists(path) and os.path.exists(marker):
+        with open(marker) as f:
+            info = json.load(f)
+        # "today" and "last N hours" queries need the data to end near now
+        if time.time() - info["end_ts"] < MAX_AGE_SECONDS:
+            return path, info
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    db = MessageDB(path)
+    db.conn.execute("PRAGMA synchronous = OFF")
+    db.drop_message_indexes()
+    start = time.perf_counter()
+    generator = ChatGenerator(**generator_args)
+    done = 0
+    for batch in generator.batches(rows):
+        db.add_messages(batch)
+        done += len(batch)
+        print(f"\r  building {path}: {done}/{rows} rows", end="", file=sys.stderr)
+    db.create_message_indexes()
+    elapsed = time.perf_counter() - start
+    db.close()
+    print(file=sys.stderr)
+    info = {"rows": rows, "build_seconds": round(elapsed, 1), "rows_per_s": round(rows / elapsed, 1),
+            "busiest_chat": generator.chat_ids[0], "end_ts": generator.end_ts}
+    with open(marker, "w") as f:
+        json.dump(info, f)
+    return path, info
+
+def query_cases(chat_id, end_ts):
+    """(name, method, args) for every read query the bot issues"""
+    day_start = end_ts - 86400 * 2
+    return [
+        ("get_messages_today", "get_messages_today", (chat_id,)),
+        ("get_messages_last_hours", "get_messages_last_hours", (chat_id, 6)),
+        ("get_messages_between", "get_messages_between", (chat_id, day_start, day_start + 86400)),
+        ("get_messages_by_person", "get_messages_by_person", (chat_id, ["User1"], 24)),
+        ("get_participants", "get_participants", (chat_id, 24)),
+        ("get_chat_state", "get_chat_state", (chat_id,)),
+        ("get_active_chats", "get_active_chats", (end_ts - 86400,)),
+        ("get_recent_rows", "get_recent_rows", (chat_id, end_ts - 6 * 3600, 2000)),
+        ("get_segment_counts", "get_segment_counts", (chat_id, end_ts - 86400, end_ts, 1800)),
+        ("get_oldest_ts", "get_oldest_ts", (chat_id, end_ts)),
+        ("count_messages", "count_messages", (chat_id, 24)),
+        ("search_messages", "search_messages", (chat_id, match_query(chat_id, ["deploy"]), 0, None, 10)),
+        ("get_vocabulary", "get_vocabulary", (chat_id, 50)),
+    ]
+
+def bench_queries(path, info, repeat=20):
+    """p50/p95 latency of each query on a read-only connection, like the bot's readers"""
+    db = MessageDB(path, read_only=True)
+    results = {}
+    for name, method, args in query_cases(info["busiest_chat"], info["end_ts"]):
+        call = getattr(db, method)
+        result = call(*args)  # Warm the page cache
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            call(*args)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = {
+            "p50_ms": round(statistics.median(timings), 3),
+            "p95_ms": round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 3),
+            "rows": len(result) if isinstance(result, list) else None,
+        }
+    db.close()
+    return results
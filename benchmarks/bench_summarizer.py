@@ -0,0 +1,47 @@
+"""
+Summarizer benchmarks: latency, peak memory and per-stage time of
+Summarizer.summarize for each backend and chat size.
+"""
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from summarizer import BACKENDS, Summarizer
+from synthetic import summarizer_messages
+
+def bench_summarize(sizes, repeat=3, backends=BACKENDS, seed=42):
+    results = {}
+    for backend in backends:
+        summarizer = Summarizer(backend)
+        summarizer.warm_up()
+        for size in sizes:
+            messages = summarizer_messages(size, seed=seed)
+            timings = []
+            stages = {}
+            for _ in range(repeat):
+                start = time.perf_counter()
+                summarizer.summarize(messages)
+                timings.append((time.perf_counter() - start) * 1000)
+                for stage, seconds in summarizer.take_timings().items():
+                    stages.setdefault(stage, []).append(seconds * 1000)
+
+            # Separate run: tracemalloc slows allocation-heavy code down
+            tracemalloc.start()
+            summarizer.summarize(messages)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            summarizer.take_timings()
+
+            results[f"{backend}.{size}"] = {
+                "median_ms": round(statistics.median(timings), 2),
+                "min_ms": round(min(timings), 2),
+                "peak_mb": round(peak / 1024 / 1024, 2),
+                "stages_ms": {stage: round(statistics.median(values), 2) for stage, values in stages.items()},
+            }
+            print(f"  summarizer {backend} {size}: {results[f'{backend}.{size}']['median_ms']} ms",
+                  file=sys.stderr)
+    return results
@@ -0,0 +1,155 @@
+"""
+Benchmark suite: ingest throughput, query latency by database size and
+summarizer latency/memory by chat size, on synthetic chats (fully offline).
+
+    python benchmarks/run.py [--profile quick|full] [--suites ingest,queries,summarizer]
+                             [--out results.json] [--baseline baseline.json]
+                             [--save-baseline baseline.json] [--fail-on-regression]
+
+Results are written as JSON keyed by "<suite>.<case>". With --baseline each
+metric is compared to the saved run: *_ms and *_mb are better lower,
+ops_per_s and rows_per_s better higher, and a change past --tolerance in
+the wrong direction is reported as a regression.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import bench_db
+import bench_summarizer
+
+PROFILES = {
+    "quick": {"db_sizes": [1000, 100000], "summary_sizes": [10, 100, 1000, 5000], "repeat": 3},
+    "full": {"db_sizes": [1000, 100000, 10000000], "summary_sizes": [10, 100, 1000, 10000, 50000], "repeat": 5},
+}
+SUITES = ("ingest", "queries", "summarizer")
+LOWER_IS_BETTER = ("_ms", "_mb")
+HIGHER_IS_BETTER = ("ops_per_s", "rows_per_s")
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+def run(suites, profile, data_dir, generator_args):
+    settings = PROFILES[profile]
+    results = {}
+    if "ingest" in suites:
+        print("ingest...", file=sys.stderr)
+        results["ingest.add_message"] = bench_db.bench_add_message()
+        results["ingest.add_messages"] = bench_db.bench_add_messages()
+    if "queries" in suites:
+        for rows in settings["db_sizes"]:
+            print(f"queries at {rows} rows...", file=sys.stderr)
+            path, info = bench_db.build_database(data_dir, rows, generator_args)
+            results[f"ingest.bulk_build.{rows}"] = {"rows_per_s": info["rows_per_s"]}
+            for name, metrics in bench_db.bench_queries(path, info).items():
+                results[f"queries.{rows}.{name}"] = metrics
+    if "summarizer" in suites:
+        print("summarizer...", file=sys.stderr)
+        for name, metrics in bench_summarizer.bench_summarize(
+            settings["summary_sizes"], settings["repeat"], seed=generator_args["seed"]
+        ).items():
+            results[f"summarizer.{name}"] = metrics
+    return results
+
+def compare(results, baseline, tolerance):
+    """Per-metric change against a baseline run, flagging regressions"""
+    comparison = {}
+    for key, metrics in results.items():
+        before = baseline.get(key)
+        if not before:
+            continue
+        for metric, value in metrics.items():
+            old = before.get(metric)
+            if not isinstance(value, (int, float)) or not isinstance(old, (int, float)) or not old:
+                continue
+            if metric.endswith(LOWER_IS_BETTER):
+                worse = value > old * (1 + tolerance)
+            elif metric in HIGHER_IS_BETTER:
+                worse = value < old * (1 - tolerance)
+            else:
+                continue
+            comparison[f"{key}.{metric}"] = {
+                "baseline": old,
+                "current": value,
+                "change": round((value - old) / old, 4),
+                "regression": worse,
+            }
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--profile", choices=PROFILES, default="quick")
+    parser.add_argument("--suites", default=",".join(SUITES))
+    parser.add_argument("--out", default="benchmark-results.json")
+    parser.add_argument("--baseline", help="compare against this results file")
+    parser.add_argument("--save-baseline", help="also write the results here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.10, help="relative change treated as noise")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--data-dir", default=os.path.join(tempfile.gettempdir(), "summarizer-bench"))
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--chats", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--days", type=int, default=30)
+    parser.add_argument("--words-median", type=int, default=9)
+    parser.add_argument("--burstiness", type=float, default=0.7)
+    args = parser.parse_args()
+
+    suites = [suite for suite in args.suites.split(",") if suite]
+    unknown = set(suites) - set(SUITES)
+    if unknown:
+        parser.error(f"unknown suites: {', '.join(sorted(unknown))}")
+    os.makedirs(args.data_dir, exist_ok=True)
+    generator_args = {"chats": args.chats, "users": args.users, "days": args.days,
+                      "words_median": args.words_median, "burstiness": args.burstiness, "seed": args.seed}
+
+    started = time.time()
+    results = run(suites, args.profile, args.data_dir, generator_args)
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": round(started, 1),
+            "seconds": round(time.time() - started, 1),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "profile": args.profile,
+            "generator": generator_args,
+        },
+        "results": results,
+    }
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report["baseline_commit"] = baseline.get("meta", {}).get("commit")
+        report["comparison"] = compare(results, baseline.get("results", {}), args.tolerance)
+        for name, change in report["comparison"].items():
+            marker = "REGRESSION" if change["regression"] else ""
+            print(f"{name:60} {change['baseline']:>12} -> {change['current']:>12} "
+                  f"({change['change']:+.1%}) {marker}")
+            if change["regression"]:
+                regressions.append(name)
+
+    for path in filter(None, (args.out, args.save_baseline)):
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {path}", file=sys.stderr)
+
+    if regressions:
+        print(f"{len(regressions)} metrics regressed beyond {args.tolerance:.0%}", file=sys.stderr)
+        if args.fail_on_regression:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Deterministic synthetic group chats for the benchmarks.
+
+Messages are spread over `days` days ending now, so "today" and "last N
+hours" queries find data. Shape knobs:
+
+- chats / users: message share per chat and per user follows a Zipf-like
+  curve (one busy group, a few chatty members)
+- words_median / words_sigma: log-normal words per message
+- burstiness: share of messages that arrive seconds after the previous one
+  (a conversation) rather than after a long quiet gap
+- topics drift over time, mixed with filler and a long tail of rare words
+
+Everything comes from one seeded random.Random, so a given set of
+parameters always produces the same chat, offline.
+"""
+import math
+import random
+import time
+from itertools import accumulate
+
+TOPICS = {
+    "deploy": "deploy release server rollback staging production build pipeline config".split(),
+    "lunch": "lunch pizza coffee break restaurant order delivery hungry".split(),
+    "bug": "bug crash error stacktrace fix patch logs reproduce issue".split(),
+    "meeting": "meeting agenda tomorrow calendar slides notes review schedule".split(),
+    "travel": "flight hotel airport train booking passport weekend trip".split(),
+    "game": "match score team goal season player league tonight".split(),
+}
+FILLER = "the a we it is to and so then maybe really just i you that this for on".split()
+SYLLABLES = "ka lo mi ne ru sa ti vo ze ba do fu gi ha ji".split()
+
+def rare_words(count, rng):
+    """Made-up words standing in for names, jargon and typos"""
+    return ["".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(count)]
+
+def zipf_weights(count, exponent=1.1):
+    """Cumulative Zipf-like weights for random.choices(cum_weights=...)"""
+    return list(accumulate(1.0 / (rank + 1) ** exponent for rank in range(count)))
+
+class ChatGenerator:
+    """Yields MessageDB rows (chat_id, user_id, user_name, username, text, ts, tg_message_id)"""
+    def __init__(self, chats=4, users=50, days=30, words_median=9, words_sigma=0.8,
+                 burstiness=0.7, end_ts=None, seed=42):
+        self.rng = random.Random(seed)
+        self.chat_ids = [-1001000000000 - i for i in range(chats)]
+        self.chat_weights = zipf_weights(chats)
+        self.users = range(users)
+        self.user_weights = zipf_weights(users)
+        self.days = days
+        self.words_mu = math.log(words_median)
+        self.words_sigma = words_sigma
+        self.burstiness = burstiness
+        self.end_ts = int(end_ts if end_ts is not None else time.time())
+        self.rare = rare_words(5000, self.rng)
+
+    def _text(self, topic):
+        rng = self.rng
+        count = max(1, min(200, int(rng.lognormvariate(self.words_mu, self.words_sigma))))
+        words = []
+        for i in range(count):
+            roll = rng.random()
+            if roll < 0.5:
+                words.append(rng.choice(TOPICS[topic]))
+            elif roll < 0.9:
+                words.append(rng.choice(FILLER))
+            else:
+                words.append(rng.choice(self.rare))
+            if i % 12 == 11 and i + 1 < count:
+                words[-1] += "."
+        return " ".join(words) + rng.choice((".", "!", "?", ""))
+
+    def rows(self, total):
+        """`total` rows in time order, ending at end_ts"""
+        rng = self.rng
+        span = self.days * 86400
+        mean_gap = span / max(1, total)
+        # Bursty gaps average 5% of the mean; quiet gaps make up the rest of the span
+        burst_gap = mean_gap * 0.05
+        quiet_gap = mean_gap * (1 - self.burstiness * 0.05) / max(1e-9, 1 - self.burstiness)
+        topics = list(TOPICS)
+        topic = rng.choice(topics)
+        next_ids = {chat_id: 1 for chat_id in self.chat_ids}
+        ts = float(self.end_ts - span)
+        for _ in range(total):
+            bursty = rng.random() < self.burstiness
+            ts = min(ts + rng.expovariate(1 / (burst_gap if bursty else quiet_gap)), self.end_ts)
+            if not bursty and rng.random() < 0.3:
+                topic = rng.choice(topics)
+            chat_id = rng.choices(self.chat_ids, cum_weights=self.chat_weights)[0]
+            user = rng.choices(self.users, cum_weights=self.user_weights)[0]
+            message_id = next_ids[chat_id]
+            next_ids[chat_id] += 1
+            yield (chat_id, 1000 + user, f"User{user}", f"user{user}", self._text(topic), int(ts), message_id)
+
+    def batches(self, total, batch_size=20000):
+        batch = []
+        for row in self.rows(total):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+def summarizer_messages(count, seed=42, **kwargs):
+    """`count` messages of one chat as Summarizer input: (user_name, text, ts, username)"""
+    generator = ChatGenerator(chats=1, seed=seed, **kwargs)
+    return [(name, text, ts, username) for _, _, name, username, text, ts, _ in generator.rows(count)]
@@ -1,296 +1,780 @@
-from telegram import Update, BotCommand
-from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from telegram.error import Conflict, NetworkError, TimedOut
-from database import MessageDB
-from summarizer import Summarizer
-from config import TELEGRAM_TOKEN
-from keep_alive import keep_alive, set_bot_status
-import logging
-import signal
-import sys
-import time
-from datetime import datetime, timedelta
-
-# Enable logging
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# Suppress noisy httpx logs
-logging.getLogger("httpx").setLevel(logging.WARNING)
-
-# Initialize
-db = MessageDB()
-summarizer = Summarizer()
-
-# Track startup time for conflict grace period
-STARTUP_TIME = datetime.now()
-CONFLICT_GRACE_PERIOD = timedelta(seconds=90)  # Suppress conflict errors for 90 seconds after start
-
-def signal_handler(signum, frame):
-    """Handle shutdown signals gracefully"""
-    signal_name = signal.Signals(signum).name
-    logger.info(f"🛑 Received {signal_name}, shutting down...")
-    set_bot_status(False)
-    sys.exit(0)
-
-# Register signal handlers
-signal.signal(signal.SIGTERM, signal_handler)
-signal.signal(signal.SIGINT, signal_handler)
-
-def is_group_chat(update: Update) -> bool:
-    """Check if message is from a group chat"""
-    return update.effective_chat.type in ['group', 'supergroup']
-
-async def private_chat_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Response for private chats"""
-    await update.message.reply_text(
-        "🚫 I only work in groups!\n\n"
-        "Add me to a group and make me admin to use my features."
-    )
-
-async def save_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Save all group messages to database with full user info"""
-    if not is_group_chat(update):
-        return
-    
-    if update.message and update.message.text:
-        chat_id = update.effective_chat.id
-        user = update.effective_user
-        
-        user_id = user.id
-        user_name = user.first_name or "Unknown"
-        username = user.username
-        message_text = update.message.text
-        
-        if not message_text.startswith('/'):
-            db.add_message(chat_id, user_id, user_name, username, message_text)
-            display = f"@{username}" if username else user_name
-            logger.info(f"💾 Saved: {display}: {message_text[:30]}...")
-
-async def catchup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Generate summary of all messages"""
-    if not is_group_chat(update):
-        await private_chat_response(update, context)
-        return
-    
-    chat_id = update.effective_chat.id
-    
-    if context.args and context.args[0].isdigit():
-        hours = int(context.args[0])
-        messages = db.get_messages_last_hours(chat_id, hours)
-        time_label = f"last {hours} hours"
-    else:
-        messages = db.get_messages_today(chat_id)
-        time_label = "today"
-    
-    if not messages or len(messages) == 0:
-        await update.message.reply_text(
-            "📭 No messages to catch up on!\n"
-            "Messages are saved from when I started running."
-        )
-        return
-    
-    summary = summarizer.summarize(messages)
-    
-    participants_set = set()
-    for msg in messages:
-        name = msg[0]
-        username = msg[3] if len(msg) > 3 else None
-        if username:
-            participants_set.add(f"{name} (@{username})")
-        else:
-            participants_set.add(name)
-    
-    participants_text = ", ".join(sorted(participants_set))
-    
-    response = (
-        f"📝 *Catch Up Summary ({time_label})*\n\n"
-        f"{summary}\n\n"
-        f"👥 _Participants: {participants_text}_\n"
-        f"💬 _{len(messages)} messages_"
-    )
-    
-    await update.message.reply_text(response, parse_mode='Markdown')
-
-async def who_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Show who's been active today with usernames"""
-    if not is_group_chat(update):
-        await private_chat_response(update, context)
-        return
-    
-    chat_id = update.effective_chat.id
-    participants = db.get_participants(chat_id)
-    
-    if not participants:
-        await update.message.reply_text("No one has sent messages today yet!")
-        return
-    
-    lines = []
-    for name, username in participants:
-        if username:
-            lines.append(f"• {name} (@{username})")
-        else:
-            lines.append(f"• {name}")
-    
-    response = "👥 *Active Today:*\n\n" + "\n".join(lines)
-    await update.message.reply_text(response, parse_mode='Markdown')
-
-async def person_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Get messages from specific person(s) - supports @username format"""
-    if not is_group_chat(update):
-        await private_chat_response(update, context)
-        return
-    
-    if not context.args:
-        await update.message.reply_text(
-            "❓ *How to use:*\n\n"
-            "`/person @username` - What @username said today\n"
-            "`/person John` - What John said today\n"
-            "`/person John @sarah` - What both said\n"
-            "`/person @user 3` - Last 3 hours\n\n"
-            "Use `/who` to see who's active today",
-            parse_mode='Markdown'
-        )
-        return
-    
-    chat_id = update.effective_chat.id
-    args = context.args
-    hours = None
-    names = []
-    
-    if args[-1].isdigit():
-        hours = int(args[-1])
-        raw_names = args[:-1]
-        time_label = f"last {hours} hours"
-    else:
-        raw_names = args
-        time_label = "today"
-    
-    for name in raw_names:
-        names.append(name.lstrip('@'))
-    
-    if not names:
-        await update.message.reply_text("Please specify at least one name or @username!")
-        return
-    
-    messages = db.get_messages_by_person(chat_id, names, hours)
-    
-    if not messages:
-        names_text = " & ".join(names)
-        await update.message.reply_text(
-            f"📭 No messages from {names_text} {time_label}.\n\n"
-            f"Tip: Use `/who` to see who's active."
-        )
-        return
-    
-    summary = summarizer.summarize(messages)
-    names_text = " & ".join(names)
-    
-    response = (
-        f"📝 *What {names_text} said ({time_label})*\n\n"
-        f"{summary}\n\n"
-        f"💬 _{len(messages)} messages_"
-    )
-    
-    await update.message.reply_text(response, parse_mode='Markdown')
-
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Start command"""
-    if not is_group_chat(update):
-        await update.message.reply_text(
-            "🚫 I only work in groups!\n\n"
-            "To use me:\n"
-            "1️⃣ Add me to your group\n"
-            "2️⃣ Make me admin\n"
-            "3️⃣ Use /catchup to summarize messages"
-        )
-        return
-    
-    await update.message.reply_text(
-        "👋 Hi! I'm your chat summarizer.\n\n"
-        "✅ I'm now saving all messages!\n\n"
-        "Type / to see all available commands.",
-        parse_mode='Markdown'
-    )
-
-async def post_init(application: Application):
-    """Set up the bot commands menu and clear any existing webhooks"""
-    await application.bot.delete_webhook(drop_pending_updates=True)
-    logger.info("🔄 Cleared webhooks and pending updates")
-    
-    commands = [
-        BotCommand("start", "Start the bot and see info"),
-        BotCommand("catchup", "Get summary of today's chat"),
-        BotCommand("person", "Get what someone said (@user or name)"),
-        BotCommand("who", "See who's been active today"),
-    ]
-    await application.bot.set_my_commands(commands)
-    logger.info("✅ Command menu ready")
-
-async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
-    """Handle errors - suppress expected conflicts during startup"""
-    if isinstance(context.error, Conflict):
-        # During deployment, conflicts are expected - only log after grace period
-        if datetime.now() - STARTUP_TIME < CONFLICT_GRACE_PERIOD:
-            return  # Silently ignore during grace period
-        logger.warning("⚠️ Conflict detected - this usually resolves automatically")
-    elif isinstance(context.error, (NetworkError, TimedOut)):
-        logger.debug("Network hiccup - retrying automatically")
-    else:
-        logger.error(f"❌ Error: {context.error}")
-
-def main():
-    """Main function"""
-    logger.info("🤖 Starting Telegram Summarizer Bot...")
-    
-    # Start keep_alive server
-    keep_alive()
-    set_bot_status(True)
-    
-    # Wait for any old instances to fully shut down
-    logger.info("⏳ Waiting 5 seconds for old instances to terminate...")
-    time.sleep(5)
-    
-    # Build application
-    application = (
-        Application.builder()
-        .token(TELEGRAM_TOKEN)
-        .post_init(post_init)
-        .connect_timeout(30.0)
-        .read_timeout(30.0)
-        .write_timeout(30.0)
-        .build()
-    )
-    
-    # Add handlers
-    application.add_handler(CommandHandler("start", start))
-    application.add_handler(CommandHandler("catchup", catchup_command))
-    application.add_handler(CommandHandler("person", person_command))
-    application.add_handler(CommandHandler("who", who_command))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, save_message))
-    application.add_error_handler(error_handler)
-    
-    logger.info("🚀 Bot is running!")
-    
-    try:
-        application.run_polling(
-            allowed_updates=Update.ALL_TYPES,
-            drop_pending_updates=True,
-            poll_interval=2.0,  # Slower polling = less chance of conflict
-            timeout=30
-        )
-    except Conflict:
-        logger.info("Instance conflict detected, exiting gracefully...")
-        sys.exit(0)
-    except Exception as e:
-        logger.error(f"Fatal error: {e}")
-        raise
-    finally:
-        set_bot_status(False)
-        db.close()
-
-if __name__ == '__main__':
-    main()
+# First, so the startup clock also covers the imports below
+from handover import Lease, startup
+from telegram import Update, BotCommand
+from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+from telegram.error import Conflict, NetworkError, TimedOut
+from telegram.helpers import escape_markdown
+from async_database import AsyncMessageDB
+from ingest import IngestQueue
+from summary_pool import SummaryPool, SummarizerBusy
+from summary_cache import SummaryCache
+from segments import SegmentSummaries
+from streaming import ChunkedSummarizer
+from hot_tier import HotTier
+from retention import RetentionJob
+from digests import DigestScheduler, parse_hours, parse_windows
+from outbound import OutboundQueue
+from sharding import owner
+from metrics import monitor_loop_lag, register_database, register_ingest, register_startup, timed
+import tracing
+from search import make_snippet, match_query, query_terms
+from timeutils import day_bounds, local_datetime, local_day, local_time, window_bounds
+from config import (
+    TELEGRAM_TOKEN, DB_READERS, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL, INGEST_MAX_PENDING,
+    SUMMARY_BACKEND, SUMMARY_WORKERS, SUMMARY_TIMEOUT, SUMMARY_MAX_PENDING,
+    SUMMARY_CACHE_MAX_BYTES, SUMMARY_CACHE_TTL, SEGMENT_MINUTES, SEGMENT_MIN_COUNT,
+    STREAM_THRESHOLD, STREAM_CHUNK_SIZE, HOT_TIER_PER_CHAT, HOT_TIER_MAX_MESSAGES, HOT_TIER_HOURS,
+    RETENTION_DAYS, RETENTION_MODE, RETENTION_DAYS_PER_RUN, MAINTENANCE_INTERVAL_MINUTES,
+    MESSAGE_CODEC, CODEC_RETRAIN_HOURS, SEARCH_RESULTS, TOPIC_MAX_MESSAGES, TERM_VECTORS,
+    DIGEST_WINDOWS, DIGEST_REFRESH_MESSAGES, DIGEST_MAX_AGE_HOURS, DIGEST_OFFPEAK,
+    DIGEST_INTERVAL_MINUTES, DIGEST_CONCURRENCY, DIGEST_AUTOPOST, DIGEST_POST_TIME, DIGEST_POST_HOURS,
+    TELEGRAM_BASE_URL, OUTBOUND_GLOBAL_PER_SECOND, OUTBOUND_CHAT_PER_MINUTE, OUTBOUND_CHAT_BURST,
+    OUTBOUND_MAX_PENDING, BOT_MODE, PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, CONCURRENT_UPDATES, TRACE_SLOW_MS, TRACE_LOG_FILE, TRACE_FOOTER_USERS,
+    DB_PATH, WORKERS, WORKER_INDEX, SHARD_DB, HANDOVER_LOCK, HANDOVER_TIMEOUT
+)
+from keep_alive import keep_alive, stop_keep_alive, set_bot_status, set_readiness, register_health_provider
+import asyncio
+import logging
+import os
+import signal
+import sqlite3
+import sys
+import time
+from datetime import date
+
+# Set by the dispatcher for the worker processes of multi-worker mode (see sharding.py)
+IS_WORKER = WORKER_INDEX >= 0
+
+# Enable logging
+logging.basicConfig(
+    format=('%(asctime)s - ' + (f'worker {WORKER_INDEX} - ' if IS_WORKER else '') +
+            '%(name)s - %(levelname)s - %(message)s'),
+    level=logging.INFO
+)
+logger = logging.getLogger(__name__)
+
+# Suppress noisy httpx logs
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def owns_chat(chat_id):
+    """Multi-worker mode: whether the dispatcher routes `chat_id` to this worker"""
+    return owner(chat_id, WORKERS) == WORKER_INDEX
+
+# Initialize. What opens the database is built by setup() in main(), so importing
+# this module stays cheap and the dispatcher of multi-worker mode never opens it.
+db = None
+ingest_queue = None
+segment_summaries = None
+retention_job = None
+digest_scheduler = None
+summary_pool = SummaryPool(
+    workers=SUMMARY_WORKERS,
+    timeout=SUMMARY_TIMEOUT,
+    max_pending=SUMMARY_MAX_PENDING,
+    backend=SUMMARY_BACKEND
+)
+summary_cache = SummaryCache(max_bytes=SUMMARY_CACHE_MAX_BYTES, ttl=SUMMARY_CACHE_TTL)
+hot_tier = HotTier(max_per_chat=HOT_TIER_PER_CHAT, max_messages=HOT_TIER_MAX_MESSAGES)
+chunked_summarizer = ChunkedSummarizer(summary_pool, chunk_size=STREAM_CHUNK_SIZE)
+outbound = OutboundQueue(
+    # The per-bot limit is shared by all workers
+    global_rate=OUTBOUND_GLOBAL_PER_SECOND / WORKERS if IS_WORKER else OUTBOUND_GLOBAL_PER_SECOND,
+    chat_rate=OUTBOUND_CHAT_PER_MINUTE / 60,
+    chat_burst=OUTBOUND_CHAT_BURST,
+    max_pending=OUTBOUND_MAX_PENDING
+)
+# Only one instance takes updates; a new one takes over once warmed up (see handover.py)
+lease = Lease(HANDOVER_LOCK)
+# Ends webhook.serve when a new instance takes over
+webhook_stop = asyncio.Event()
+
+background_tasks = []
+register_startup(startup)
+
+BUSY_TEXT = "⏳ I'm busy summarizing for other groups right now, please try again in a moment."
+
+def setup():
+    """Open the database, build what uses it and warm up the summarizer and hot tier.
+    All of it happens before this instance asks for the lease, while the old one still serves."""
+    global db, ingest_queue, segment_summaries, retention_job, digest_scheduler
+    # Here rather than at import: summarizer workers import this module too
+    tracing.configure(slow_ms=TRACE_SLOW_MS, log_path=TRACE_LOG_FILE or None)
+    db = AsyncMessageDB(DB_PATH, readers=DB_READERS, message_codec=MESSAGE_CODEC or None, analyze=TERM_VECTORS)
+    ingest_queue = IngestQueue(
+        db.writer,
+        batch_size=INGEST_BATCH_SIZE,
+        flush_interval=INGEST_FLUSH_INTERVAL,
+        max_pending=INGEST_MAX_PENDING
+    )
+    segment_summaries = SegmentSummaries(
+        db,
+        summary_pool,
+        segment_seconds=SEGMENT_MINUTES * 60,
+        min_segments=SEGMENT_MIN_COUNT,
+        fetch=fetch_window
+    )
+    retention_job = RetentionJob(
+        db,
+        summary_pool,
+        retention_days=RETENTION_DAYS,
+        mode=RETENTION_MODE,
+        days_per_run=RETENTION_DAYS_PER_RUN
+    )
+    digest_scheduler = DigestScheduler(
+        db,
+        lambda chat_id, hours: build_catchup(chat_id, hours),
+        windows=parse_windows(DIGEST_WINDOWS),
+        refresh_messages=DIGEST_REFRESH_MESSAGES,
+        max_age=DIGEST_MAX_AGE_HOURS * 3600,
+        concurrency=DIGEST_CONCURRENCY,
+        offpeak=parse_hours(DIGEST_OFFPEAK),
+        owns=owns_chat if IS_WORKER else None
+    )
+    register_database(db.db_path)
+    register_ingest(ingest_queue)
+
+    register_health_provider("startup", startup.get_stats)
+    register_health_provider("ingest", ingest_queue.get_stats)
+    register_health_provider("summarizer", summary_pool.get_stats)
+    register_health_provider("summary_cache", summary_cache.get_stats)
+    register_health_provider("segments", segment_summaries.get_stats)
+    register_health_provider("streaming", chunked_summarizer.get_stats)
+    register_health_provider("hot_tier", hot_tier.get_stats)
+    register_health_provider("retention", retention_job.get_stats)
+    register_health_provider("codec", db.get_codec_stats)
+    register_health_provider("digests", digest_scheduler.get_stats)
+    register_health_provider("outbound", outbound.get_stats)
+    if not IS_WORKER:
+        register_health_provider("handover", lease.get_stats)
+    startup.mark("database")
+
+    ingest_queue.start()
+    summary_pool.start()
+    if not summary_pool.wait_ready():
+        logger.warning("⚠️ Summarizer workers still warming up, starting anyway")
+    startup.mark("summarizer")
+    hot_tier.warm(db.writer, HOT_TIER_HOURS, owns=owns_chat if IS_WORKER else None)
+    startup.mark("hot_tier")
+
+def signal_handler(signum, frame):
+    """Handle shutdown signals gracefully"""
+    signal_name = signal.Signals(signum).name
+    logger.info(f"🛑 Received {signal_name}, shutting down...")
+    set_bot_status(False)
+    if ingest_queue is not None:
+        ingest_queue.close()
+    sys.exit(0)
+
+async def reply(update: Update, text, parse_mode=None):
+    """Queue a reply to the command message; the outbound scheduler paces the actual send"""
+    return outbound.submit(
+        update.effective_chat.id, text, parse_mode=parse_mode, reply_to=update.message.message_id
+    )
+
+async def reply_traced(update: Update, text, parse_mode=None):
+    """Final reply of a traced command: stage footer for admins, and the send timed as a stage
+    in the background so the handler slot is free while the reply waits for its rate limit"""
+    trace = tracing.current()
+    if trace is not None and update.effective_user and update.effective_user.id in TRACE_FOOTER_USERS:
+        text += "\n\n🔬 " + trace.footer()
+    sent = await reply(update, text, parse_mode=parse_mode)
+    if sent is not None:
+        tracing.follow(sent, "telegram.send")
+
+def is_group_chat(update: Update) -> bool:
+    """Check if message is from a group chat"""
+    return update.effective_chat.type in ['group', 'supergroup']
+
+async def private_chat_response(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Response for private chats"""
+    await reply(
+        update,
+        "🚫 I only work in groups!\n\n"
+        "Add me to a group and make me admin to use my features."
+    )
+
+@timed("save_message")
+async def save_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Save all group messages to database with full user info"""
+    if not is_group_chat(update):
+        return
+    
+    if update.message and update.message.text:
+        chat_id = update.effective_chat.id
+        user = update.effective_user
+        
+        user_id = user.id
+        user_name = user.first_name or "Unknown"
+        username = user.username
+        message_text = update.message.text
+        sent_at = int(update.message.date.timestamp())
+        
+        if not message_text.startswith('/'):
+            if not ingest_queue.put(
+                chat_id, user_id, user_name, username, message_text, sent_at, update.message.message_id
+            ):
+                return  # Queue full: counted and logged by the ingest queue
+            hot_tier.put(chat_id, user_name, username, message_text, sent_at, update.message.message_id)
+            display = f"@{username}" if username else user_name
+            logger.info(f"💾 Queued: {display}: {message_text[:30]}...")
+
+def window_key(hours):
+    """Cache key part for a /catchup or /person window"""
+    return f"{hours}h" if hours else f"day:{local_day().isoformat()}"
+
+async def high_water_mark(chat_id):
+    """Newest message id of a chat; cached summaries are only reused while it is unchanged"""
+    state = await db.get_chat_state(chat_id)
+    return state[0] if state else None
+
+async def fetch_window(chat_id, start, end):
+    """Messages of [start, end): the recent part from the hot tier, only older ones from SQLite"""
+    messages, db_end = hot_tier.split(chat_id, start, end)
+    if db_end > start:
+        older = await db.get_messages_between(chat_id, start, db_end)
+        messages = older + messages
+    return messages
+
+async def build_catchup(chat_id, hours):
+    """Summarize a chat window: (summary, participants, message count), or None if it is empty"""
+    # Long windows merge stored segment representatives instead of re-reading every message
+    start, end = window_bounds(hours)
+    composed = await segment_summaries.collect(chat_id, start, end)
+    if composed is not None:
+        messages, message_count = composed
+    elif await db.count_messages_between(chat_id, start, end, limit=STREAM_THRESHOLD + 1) > STREAM_THRESHOLD:
+        # Huge window: stream it in keyset-paged chunks instead of loading every row
+        streamed = await chunked_summarizer.summarize(
+            db.iter_message_batches(chat_id, start, end, batch_size=500)
+        )
+        if streamed is None:
+            return None
+        summary, message_count = streamed
+        participants = await db.get_participants(chat_id, hours)
+        return summary, participants, message_count
+    else:
+        messages = await fetch_window(chat_id, start, end)
+        message_count = len(messages)
+    
+    if not messages:
+        return None
+    
+    summary = await summary_pool.summarize(messages)
+    participants = await db.get_participants(chat_id, hours)
+    return summary, participants, message_count
+
+async def serve_catchup(chat_id, hours):
+    """A fresh precomputed digest of the window if there is one, otherwise build_catchup"""
+    digest = await digest_scheduler.lookup(chat_id, hours)
+    if digest is not None:
+        return digest
+    return await build_catchup(chat_id, hours)
+
+async def build_topic_catchup(chat_id, terms, hours):
+    """Summarize the messages of a window that match search terms, boosting the terms:
+    (summary, participants, message count), or None if nothing matches"""
+    start, end = window_bounds(hours)
+    hits = await db.search_messages(chat_id, match_query(chat_id, terms), start, end, TOPIC_MAX_MESSAGES)
+    if not hits:
+        return None
+    hits.sort(key=lambda hit: hit[2])  # Best matches, told in chat order
+    messages = [(name, text, None, username) for name, text, ts, username in hits]
+    summary = await summary_pool.summarize(messages, terms)
+    participants = list(dict.fromkeys((name, username) for name, _, _, username in hits))
+    return summary, participants, len(hits)
+
+async def build_person_summary(chat_id, names, hours):
+    """Summarize what some people said: (summary, message count), or None if they said nothing"""
+    messages = await db.get_messages_by_person(chat_id, names, hours)
+    if not messages:
+        return None
+    summary = await summary_pool.summarize(messages)
+    return summary, len(messages)
+
+@timed("catchup_command")
+@tracing.traced("catchup")
+async def catchup_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Generate summary of all messages"""
+    if not is_group_chat(update):
+        await private_chat_response(update, context)
+        return
+    
+    chat_id = update.effective_chat.id
+    await db.run_sync(ingest_queue.flush)  # Make queued messages visible to the query
+    
+    args = list(context.args or [])
+    terms = ()
+    if args and args[0].lower() == "about":
+        # /catchup about <terms> [hours]
+        args.pop(0)
+        hours = int(args.pop()) if len(args) > 1 and args[-1].isdigit() else None
+        terms = tuple(query_terms(" ".join(args)))
+        if not terms:
+            await reply(update, "❓ Usage: `/catchup about deployment [hours]`", parse_mode='Markdown')
+            return
+    elif args and args[0].isdigit():
+        hours = int(args[0])
+    else:
+        hours = None
+    time_label = f"last {hours} hours" if hours else "today"
+    if terms:
+        time_label += f", about {' '.join(terms)}"
+    
+    if terms:
+        build = lambda: build_topic_catchup(chat_id, terms, hours)
+    else:
+        build = lambda: serve_catchup(chat_id, hours)
+    try:
+        result = await summary_cache.get_or_compute(
+            (chat_id, "catchup", window_key(hours), terms),
+            await high_water_mark(chat_id),
+            build
+        )
+    except SummarizerBusy:
+        await reply(update, BUSY_TEXT)
+        return
+    
+    if result is None:
+        await reply(
+            update,
+            "📭 No messages to catch up on!\n"
+            "Messages are saved from when I started running "
+            "(older history can be imported from a Telegram export)."
+        )
+        return
+    
+    tracing.annotate(messages=result[2])
+    await reply_traced(update, format_catchup(result, time_label), parse_mode='Markdown')
+
+def format_catchup(result, time_label):
+    """Reply text for a (summary, participants, message count) catchup result"""
+    summary, participants, message_count = result
+    participants_text = ", ".join(
+        f"{name} (@{username})" if username else name
+        for name, username in participants
+    )
+    
+    return (
+        f"📝 *Catch Up Summary ({time_label})*\n\n"
+        f"{summary}\n\n"
+        f"👥 _Participants: {participants_text}_\n"
+        f"💬 _{message_count} messages_"
+    )
+
+@timed("who_command")
+async def who_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Show who's been active today with usernames"""
+    if not is_group_chat(update):
+        await private_chat_response(update, context)
+        return
+    
+    chat_id = update.effective_chat.id
+    await db.run_sync(ingest_queue.flush)
+    participants = await db.get_participants(chat_id)
+    
+    if not participants:
+        await reply(update, "No one has sent messages today yet!")
+        return
+    
+    lines = []
+    for name, username in participants:
+        if username:
+            lines.append(f"• {name} (@{username})")
+        else:
+            lines.append(f"• {name}")
+    
+    response = "👥 *Active Today:*\n\n" + "\n".join(lines)
+    await reply(update, response, parse_mode='Markdown')
+
+@timed("person_command")
+@tracing.traced("person")
+async def person_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Get messages from specific person(s) - supports @username format"""
+    if not is_group_chat(update):
+        await private_chat_response(update, context)
+        return
+    
+    if not context.args:
+        await reply(
+            update,
+            "❓ *How to use:*\n\n"
+            "`/person @username` - What @username said today\n"
+            "`/person John` - What John said today\n"
+            "`/person John @sarah` - What both said\n"
+            "`/person @user 3` - Last 3 hours\n\n"
+            "Use `/who` to see who's active today",
+            parse_mode='Markdown'
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    args = context.args
+    hours = None
+    names = []
+    
+    if args[-1].isdigit():
+        hours = int(args[-1])
+        raw_names = args[:-1]
+        time_label = f"last {hours} hours"
+    else:
+        raw_names = args
+        time_label = "today"
+    
+    for name in raw_names:
+        names.append(name.lstrip('@'))
+    
+    if not names:
+        await reply(update, "Please specify at least one name or @username!")
+        return
+    
+    await db.run_sync(ingest_queue.flush)
+    persons = tuple(sorted({name.lower() for name in names}))
+    
+    try:
+        result = await summary_cache.get_or_compute(
+            (chat_id, "person", window_key(hours), persons),
+            await high_water_mark(chat_id),
+            lambda: build_person_summary(chat_id, names, hours)
+        )
+    except SummarizerBusy:
+        await reply(update, BUSY_TEXT)
+        return
+    
+    names_text = " & ".join(names)
+    
+    if result is None:
+        await reply(
+            update,
+            f"📭 No messages from {names_text} {time_label}.\n\n"
+            f"Tip: Use `/who` to see who's active."
+        )
+        return
+    
+    summary, message_count = result
+    tracing.annotate(messages=message_count)
+    
+    response = (
+        f"📝 *What {names_text} said ({time_label})*\n\n"
+        f"{summary}\n\n"
+        f"💬 _{message_count} messages_"
+    )
+    
+    await reply_traced(update, response, parse_mode='Markdown')
+
+@timed("search_command")
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Full-text search of the chat history, best matches first"""
+    if not is_group_chat(update):
+        await private_chat_response(update, context)
+        return
+    
+    args = list(context.args or [])
+    hours = int(args.pop()) if len(args) > 1 and args[-1].isdigit() else None
+    terms = query_terms(" ".join(args))
+    if not terms:
+        await reply(
+            update,
+            "❓ *How to use:*\n\n"
+            "`/search deploy` - Best matches in the whole history\n"
+            "`/search deploy friday 24` - Only the last 24 hours",
+            parse_mode='Markdown'
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    await db.run_sync(ingest_queue.flush)
+    start = window_bounds(hours)[0] if hours else 0
+    started = time.perf_counter()
+    hits = await db.search_messages(chat_id, match_query(chat_id, terms), start, None, SEARCH_RESULTS)
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    
+    if not hits:
+        await reply(update, f"🔍 No messages match \"{' '.join(terms)}\".")
+        return
+    
+    lines = []
+    for i, (name, text, ts, username) in enumerate(hits, 1):
+        before, match, after = make_snippet(text, terms)
+        snippet = escape_markdown(before) + (f"*{escape_markdown(match)}*" if match else "") + escape_markdown(after)
+        when = local_datetime(ts).strftime("%b %d %H:%M")
+        lines.append(f"{i}. *{escape_markdown(name or 'Unknown')}* ({when}): {snippet}")
+    
+    response = (
+        f"🔍 *Results for \"{escape_markdown(' '.join(terms))}\"*\n\n"
+        + "\n".join(lines)
+        + f"\n\n_{len(hits)} results in {elapsed_ms:.0f} ms_"
+    )
+    await reply(update, response, parse_mode='Markdown')
+
+@timed("day_command")
+async def day_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Summary of one calendar day, including days already archived by retention"""
+    if not is_group_chat(update):
+        await private_chat_response(update, context)
+        return
+    
+    try:
+        day = date.fromisoformat(context.args[0]) if context.args else None
+    except ValueError:
+        day = None
+    if day is None:
+        await reply(
+            update,
+            "❓ *How to use:*\n\n`/day 2024-05-31` - Summary of that day",
+            parse_mode='Markdown'
+        )
+        return
+    
+    chat_id = update.effective_chat.id
+    archived = await db.get_archive(chat_id, day.isoformat())
+    if archived is not None:
+        message_count, summary = archived
+    else:
+        messages = await db.get_messages_between(chat_id, *day_bounds(day))
+        if not messages:
+            await reply(update, f"📭 No messages on {day.isoformat()}.")
+            return
+        try:
+            summary = await summary_pool.summarize(messages)
+        except SummarizerBusy:
+            await reply(update, BUSY_TEXT)
+            return
+        message_count = len(messages)
+    
+    await reply(
+        update,
+        f"📅 *Summary of {day.isoformat()}*\n\n{summary}\n\n💬 _{message_count} messages_",
+        parse_mode='Markdown'
+    )
+
+async def maintenance_job(context: ContextTypes.DEFAULT_TYPE):
+    """Scheduled retention, incremental vacuum, WAL checkpoint and codec dictionary retraining"""
+    try:
+        if MESSAGE_CODEC:
+            age = await db.codec_dictionary_age()
+            if age is None or age > CODEC_RETRAIN_HOURS * 3600:
+                await db.train_codec_dictionary()
+        await retention_job.run()
+    except (sqlite3.Error, SummarizerBusy) as e:
+        logger.warning(f"⚠️ Maintenance run stopped early: {e}")
+
+async def digest_job(context: ContextTypes.DEFAULT_TYPE):
+    """Off-peak batch that precomputes the digests of every active chat"""
+    try:
+        await digest_scheduler.run()
+    except sqlite3.Error as e:
+        logger.warning(f"⚠️ Digest run stopped early: {e}")
+
+async def digest_post_job(context: ContextTypes.DEFAULT_TYPE):
+    """Daily auto-post of each active chat's digest"""
+    await db.run_sync(ingest_queue.flush)
+    for chat_id in await digest_scheduler.active_chats():
+        try:
+            result = await digest_scheduler.get(chat_id, DIGEST_POST_HOURS)
+            if result is None:
+                continue
+            outbound.submit(
+                chat_id, format_catchup(result, f"last {DIGEST_POST_HOURS} hours"), parse_mode='Markdown'
+            )
+        except SummarizerBusy:
+            logger.warning(f"⚠️ Summarizer busy, digest for chat {chat_id} not posted")
+
+@timed("start")
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Start command"""
+    if not is_group_chat(update):
+        await reply(
+            update,
+            "🚫 I only work in groups!\n\n"
+            "To use me:\n"
+            "1️⃣ Add me to your group\n"
+            "2️⃣ Make me admin\n"
+            "3️⃣ Use /catchup to summarize messages"
+        )
+        return
+    
+    await reply(
+        update,
+        "👋 Hi! I'm your chat summarizer.\n\n"
+        "✅ I'm now saving all messages!\n\n"
+        "Type / to see all available commands.",
+        parse_mode='Markdown'
+    )
+
+def step_down(application: Application):
+    """A new instance asked for the lease: stop taking updates. The usual shutdown then
+    finishes the handlers, and post_stop hands over before sending the last replies."""
+    set_readiness("stopping")
+    if BOT_MODE == "webhook":
+        webhook_stop.set()
+    else:
+        application.stop_running()
+
+async def post_init(application: Application):
+    """Take over updates from any running instance, register (webhook mode) or clear the
+    webhook, and set up the bot commands menu"""
+    startup.mark("telegram")
+    if not IS_WORKER:
+        # Warm from here on; the old instance keeps serving until we ask for the lease
+        await lease.acquire(HANDOVER_TIMEOUT)
+        startup.mark("handover")
+        await lease.serve(lambda: step_down(application))
+        # Port freed by the old instance before it released the lease
+        if BOT_MODE != "webhook":
+            keep_alive(PORT)
+    # Messages the old instance stored while we were warming up
+    hot_tier.catch_up(db.writer, owns=owns_chat if IS_WORKER else None)
+
+    # Pending updates are kept: the old instance confirmed what it handled, the rest is ours
+    if BOT_MODE == "webhook":
+        if WEBHOOK_URL:
+            await application.bot.set_webhook(
+                WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                secret_token=WEBHOOK_SECRET or None,
+                allowed_updates=Update.ALL_TYPES,
+                max_connections=WEBHOOK_MAX_CONNECTIONS
+            )
+            logger.info("🔗 Webhook registered")
+        else:
+            logger.info(f"🔗 WEBHOOK_URL not set, only taking updates POSTed to {WEBHOOK_PATH}")
+    else:
+        await application.bot.delete_webhook()
+        logger.info("🔄 Cleared webhooks")
+    
+    # In multi-worker mode worker 0 sets the menu for all of them
+    if WORKER_INDEX <= 0:
+        commands = [
+            BotCommand("start", "Start the bot and see info"),
+            BotCommand("catchup", "Get summary of today's chat"),
+            BotCommand("person", "Get what someone said (@user or name)"),
+            BotCommand("who", "See who's been active today"),
+            BotCommand("day", "Get the summary of a past day"),
+            BotCommand("search", "Search the chat history"),
+        ]
+        await application.bot.set_my_commands(commands)
+        logger.info("✅ Command menu ready")
+    outbound.start(application.bot)
+    # Not application.create_task: stop() would wait on this endless task
+    background_tasks.append(asyncio.get_running_loop().create_task(monitor_loop_lag()))
+    startup.mark("takeover")
+    # Polling (or the webhook server) starts right after post_init returns
+    set_readiness("ready")
+    startup.ready()
+
+def release_lease():
+    """Write out what the next instance reads at takeover, free the port, then the lease.
+    Blocking; the lease server must already be closed on the loop."""
+    ingest_queue.close()
+    stop_keep_alive()
+    lease.release()
+
+async def post_stop(application: Application):
+    """Stop background tasks and let queued replies go out while the bot can still send them"""
+    for task in background_tasks:
+        task.cancel()
+    await lease.close_server()
+    if lease.stats["handover_requested"]:
+        # The next instance can take updates while our last replies wait for their rate limit
+        await asyncio.get_running_loop().run_in_executor(None, release_lease)
+    await outbound.close()
+
+async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE):
+    """Handle errors"""
+    if isinstance(context.error, Conflict):
+        # Instances on this machine hand over through the lease; this is one elsewhere
+        logger.warning("⚠️ Conflict: another instance is polling with this token")
+    elif isinstance(context.error, (NetworkError, TimedOut)):
+        logger.debug("Network hiccup - retrying automatically")
+    else:
+        logger.error(f"❌ Error: {context.error}")
+
+def main():
+    """Main function"""
+    if WORKERS > 1 and not IS_WORKER:
+        # Multi-worker mode: this process becomes the dispatcher, starting workers that run this file
+        logger.info(f"🔀 Starting dispatcher for {WORKERS} workers...")
+        dispatcher = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sharding.py")
+        os.execv(sys.executable, [sys.executable, dispatcher])
+    
+    logger.info("🤖 Starting Telegram Summarizer Bot...")
+    signal.signal(signal.SIGTERM, signal_handler)
+    signal.signal(signal.SIGINT, signal_handler)
+    startup.mark("imports")
+    
+    # The keep_alive server starts in post_init, once the old instance freed the port
+    set_bot_status(True)
+    setup()
+    
+    # Build application
+    builder = (
+        Application.builder()
+        .token(TELEGRAM_TOKEN)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .concurrent_updates(CONCURRENT_UPDATES)
+        .connect_timeout(30.0)
+        .read_timeout(30.0)
+        .write_timeout(30.0)
+    )
+    if TELEGRAM_BASE_URL:
+        builder = builder.base_url(TELEGRAM_BASE_URL)
+    application = builder.build()
+    
+    # Add handlers
+    application.add_handler(CommandHandler("start", start))
+    application.add_handler(CommandHandler("catchup", catchup_command))
+    application.add_handler(CommandHandler("person", person_command))
+    application.add_handler(CommandHandler("who", who_command))
+    application.add_handler(CommandHandler("day", day_command))
+    application.add_handler(CommandHandler("search", search_command))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, save_message))
+    application.add_error_handler(error_handler)
+    
+    if application.job_queue is not None:
+        # Workers sharing one database leave retention and compaction to worker 0
+        if not IS_WORKER or SHARD_DB or WORKER_INDEX == 0:
+            application.job_queue.run_repeating(
+                maintenance_job, interval=MAINTENANCE_INTERVAL_MINUTES * 60, first=60
+            )
+        if digest_scheduler.windows:
+            application.job_queue.run_repeating(
+                digest_job, interval=DIGEST_INTERVAL_MINUTES * 60, first=120
+            )
+        if DIGEST_AUTOPOST:
+            application.job_queue.run_daily(digest_post_job, time=local_time(DIGEST_POST_TIME))
+    else:
+        logger.warning(
+            "⚠️ JobQueue unavailable (install python-telegram-bot[job-queue]), maintenance and digests disabled"
+        )
+    
+    logger.info("🚀 Bot is running!")
+    
+    try:
+        if BOT_MODE == "webhook":
+            import webhook
+            # Workers only take updates from the dispatcher on this machine
+            host = "127.0.0.1" if IS_WORKER else "0.0.0.0"
+            asyncio.run(webhook.serve(
+                application, PORT, WEBHOOK_PATH, WEBHOOK_SECRET or None, host=host, stop=webhook_stop
+            ))
+        else:
+            application.run_polling(
+                allowed_updates=Update.ALL_TYPES,
+                timeout=30
+            )
+    except Conflict:
+        logger.info("Instance conflict detected, exiting gracefully...")
+        sys.exit(0)
+    except Exception as e:
+        logger.error(f"Fatal error: {e}")
+        raise
+    finally:
+        set_bot_status(False)
+        set_readiness("stopping")
+        release_lease()
+        summary_pool.close()
+        db.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+"""
+Optional compression of messages.message_text.
+
+Compressed bodies are stored as BLOBs starting with a 3-byte header
+(codec, dictionary id); plain TEXT rows are left alone, so a database can
+hold both and every reader decodes transparently. Dictionaries are trained
+from the chat corpus and kept in the `codec_dicts` table: zstd dictionaries
+when the zstandard package is installed, otherwise a zlib preset dictionary
+built from the most frequent words and phrases.
+
+    python codec.py migrate [messages.db] [--codec zlib|zstd|none]
+    python codec.py report [messages.db]
+"""
+import argparse
+import logging
+import sqlite3
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+CODECS = ("zlib", "zstd")
+CODEC_IDS = {"zlib": 1, "zstd": 2}
+HEADER = struct.Struct(">BH")
+# Shorter bodies do not compress well enough to pay for the header
+MIN_LENGTH = 24
+DICT_SIZE = 16 * 1024
+TRAINING_SAMPLES = 5000
+
+def available_codec(name):
+    """The codec actually usable for `name` (zstd falls back to zlib without zstandard)"""
+    if name == "zstd" and zstandard is None:
+        logger.warning("⚠️ zstandard is not installed, compressing messages with zlib instead")
+        return "zlib"
+    return name
+
+def train_zlib_dictionary(samples, size=DICT_SIZE):
+    """Preset dictionary of frequent words and word pairs. zlib matches the end of the
+    dictionary most cheaply, so the most frequent phrases go last."""
+    counts = Counter()
+    for text in samples:
+        words = text.split()
+        counts.update(words)
+        counts.update(" ".join(pair) for pair in zip(words, words[1:]))
+    phrases = []
+    used = 0
+    for phrase, count in sorted(counts.items(), key=lambda item: item[1] * len(item[0]), reverse=True):
+        if count < 2:
+            break
+        encoded = phrase.encode("utf-8") + b" "
+        if used + len(encoded) > size:
+            break
+        phrases.append(encoded)
+        used += len(encoded)
+    return b"".join(reversed(phrases))
+
+def train_dictionary(codec, samples, size=DICT_SIZE):
+    """Dictionary bytes for codec trained from sample message texts"""
+    if codec == "zstd":
+        encoded = [text.encode("utf-8") for text in samples]
+        return zstandard.train_dictionary(size, encoded).as_bytes()
+    return train_zlib_dictionary(samples, size)
+
+class MessageCodec:
+    """
+    Encodes and decodes message bodies for one MessageDB connection.
+    Dictionaries are looked up by id through `load_dictionary`, so readers pick
+    up a newly trained one the first time they meet a row that uses it.
+    """
+    def __init__(self, codec=None, load_dictionary=None, level=6):
+        self.codec = available_codec(codec) if codec else None
+        self.level = level
+        self.load_dictionary = load_dictionary
+        self.dictionaries = {}  # dict_id -> (codec, bytes)
+        self.active_dict_id = 0
+        self._local = threading.local()
+        self.stats = {"encoded": 0, "bytes_in": 0, "bytes_out": 0, "decoded": 0, "decode_seconds": 0.0}
+
+    def use_dictionary(self, dict_id, codec, data):
+        """Register a dictionary; it becomes the one used for encoding if it matches our codec"""
+        self.dictionaries[dict_id] = (codec, data)
+        if codec == self.codec and dict_id > self.active_dict_id:
+            self.active_dict_id = dict_id
+
+    def _dictionary(self, dict_id):
+        if dict_id not in self.dictionaries and self.load_dictionary is not None:
+            found = self.load_dictionary(dict_id)
+            if found is not None:
+                self.dictionaries[dict_id] = found
+        return self.dictionaries[dict_id][1]
+
+    def _zstd(self, dict_id, decompress):
+        """zstd (de)compressors are not thread-safe; keep one per thread and dictionary"""
+        cache = getattr(self._local, "zstd", None)
+        if cache is None:
+            cache = self._local.zstd = {}
+        key = (dict_id, decompress)
+        if key not in cache:
+            params = {}
+            if dict_id:
+                params["dict_data"] = zstandard.ZstdCompressionDict(self._dictionary(dict_id))
+            if decompress:
+                cache[key] = zstandard.ZstdDecompressor(**params)
+            else:
+                cache[key] = zstandard.ZstdCompressor(level=self.level, **params)
+        return cache[key]
+
+    def encode(self, text):
+        """Value to store for text: a compressed BLOB, or the text itself if that is not smaller"""
+        if self.codec is None or text is None or len(text) < MIN_LENGTH:
+            return text
+        raw = text.encode("utf-8")
+        dict_id = self.active_dict_id
+        if self.codec == "zstd":
+            body = self._zstd(dict_id, False).compress(raw)
+        elif dict_id:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15, zdict=self._dictionary(dict_id))
+            body = compressor.compress(raw) + compressor.flush()
+        else:
+            compressor = zlib.compressobj(self.level, zlib.DEFLATED, -15)
+            body = compressor.compress(raw) + compressor.flush()
+        self.stats["encoded"] += 1
+        self.stats["bytes_in"] += len(raw)
+        if len(body) + HEADER.size >= len(raw):
+            self.stats["bytes_out"] += len(raw)
+            return text
+        self.stats["bytes_out"] += len(body) + HEADER.size
+        return HEADER.pack(CODEC_IDS[self.codec], dict_id) + body
+
+    def decode(self, value):
+        """Text of a stored message_text value (plain TEXT passes straight through)"""
+        if not isinstance(value, bytes):
+            return value
+        start = time.perf_counter()
+        codec_id, dict_id = HEADER.unpack_from(value)
+        body = value[HEADER.size:]
+        if codec_id == CODEC_IDS["zstd"]:
+            if zstandard is None:
+                raise RuntimeError("message was compressed with zstd but zstandard is not installed")
+            raw = self._zstd(dict_id, True).decompress(body)
+        elif dict_id:
+            raw = zlib.decompressobj(-15, zdict=self._dictionary(dict_id)).decompress(body)
+        else:
+            raw = zlib.decompress(body, -15)
+        self.stats["decoded"] += 1
+        self.stats["decode_seconds"] += time.perf_counter() - start
+        return raw.decode("utf-8")
+
+    def decode_rows(self, rows, index):
+        """Decode column `index` of every row; rows without BLOBs are returned as-is"""
+        if not any(isinstance(row[index], bytes) for row in rows):
+            return rows
+        return [row[:index] + (self.decode(row[index]),) + row[index + 1:] for row in rows]
+
+def _load_dictionary(conn):
+    def load(dict_id):
+        row = conn.execute("SELECT codec, data FROM codec_dicts WHERE dict_id = ?", (dict_id,)).fetchone()
+        return tuple(row) if row else None
+    return load
+
+def migrate(db_path, codec_name, batch_size=1000):
+    """Re-encode every message with codec_name ("none" decompresses everything back to TEXT)"""
+    from database import MessageDB
+    db = MessageDB(db_path, message_codec=None if codec_name == "none" else codec_name)
+    if codec_name != "none":
+        db.train_codec_dictionary()
+    decoder = MessageCodec(load_dictionary=_load_dictionary(db.conn))
+    target = "text" if codec_name == "none" else "blob"
+    last_id = 0
+    changed = 0
+    while True:
+        with db._lock:
+            rows = db.conn.execute('''
+                SELECT id, message_text FROM messages
+                WHERE id > ? AND typeof(message_text) IN ('text', 'blob')
+                ORDER BY id LIMIT ?
+            ''', (last_id, batch_size)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            updates = []
+            for message_id, value in rows:
+                text = decoder.decode(value)
+                stored = text if codec_name == "none" else db.codec.encode(text)
+                if stored != value:
+                    updates.append((stored, message_id))
+            db.conn.executemany("UPDATE messages SET message_text = ? WHERE id = ?", updates)
+            db.conn.commit()
+            changed += len(updates)
+    print(f"Re-encoded {changed} messages as {target}")
+    report(db_path)
+    db.close()
+
+def report(db_path, window_seconds=86400):
+    """Bytes saved by compression and the decode cost of a typical /catchup window"""
+    conn = sqlite3.connect(db_path)
+    try:
+        codec = MessageCodec(load_dictionary=_load_dictionary(conn))
+        stored = raw = compressed_rows = total_rows = 0
+        for (value,) in conn.execute("SELECT message_text FROM messages WHERE message_text IS NOT NULL"):
+            total_rows += 1
+            if isinstance(value, bytes):
+                compressed_rows += 1
+                stored += len(value)
+                raw += len(codec.decode(value).encode("utf-8"))
+            else:
+                size = len(value.encode("utf-8"))
+                stored += size
+                raw += size
+        print(f"Messages: {total_rows} ({compressed_rows} compressed)")
+        print(f"message_text bytes: {raw} raw, {stored} stored, {raw - stored} saved "
+              f"({(raw - stored) / raw:.1%})" if raw else "message_text bytes: 0")
+
+        # Decode cost of /catchup over the busiest chat's last day of messages
+        busiest = conn.execute('''
+            SELECT chat_id, MAX(ts) FROM messages GROUP BY chat_id ORDER BY COUNT(*) DESC LIMIT 1
+        ''').fetchone()
+        if busiest:
+            chat_id, last_ts = busiest
+            values = [row[0] for row in conn.execute(
+                "SELECT message_text FROM messages WHERE chat_id = ? AND ts >= ?",
+                (chat_id, last_ts - window_seconds)
+            )]
+            codec.stats["decode_seconds"] = 0.0
+            for value in values:
+                codec.decode(value)
+            print(f"Decode cost per /catchup (chat {chat_id}, {len(values)} messages in the last "
+                  f"{window_seconds // 3600}h): {codec.stats['decode_seconds'] * 1000:.2f} ms")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("migrate", "report"))
+    parser.add_argument("db_path", nargs="?", default="messages.db")
+    parser.add_argument("--codec", default="zlib", choices=CODECS + ("none",))
+    parser.add_argument("--batch-size", type=int, default=1000)
+    args = parser.parse_args()
+    if args.command == "migrate":
+        migrate(args.db_path, args.codec, args.batch_size)
+    else:
+        report(args.db_path)
+
+if __name__ == "__main__":
+    main()
@@ -1,195 +1,1308 @@
-import sqlite3
-from datetime import datetime, timedelta
-import logging
-import time
-
-class MessageDB:
-    def __init__(self, db_path='messages.db', max_retries=3):
-        self.db_path = db_path
-        self.max_retries = max_retries
-        self.conn = None
-        self._connect()
-        self._setup_database()
-    
-    def _connect(self):
-        """Establish database connection with retry logic"""
-        for attempt in range(self.max_retries):
-            try:
-                self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
-                self.conn.execute("PRAGMA journal_mode=WAL")
-                logging.info(f"✅ Database connected: {self.db_path}")
-                return
-            except sqlite3.Error as e:
-                logging.error(f"❌ Database connection attempt {attempt + 1} failed: {e}")
-                if attempt < self.max_retries - 1:
-                    time.sleep(1)
-                else:
-                    raise
-    
-    def _ensure_connection(self):
-        """Ensure database connection is alive"""
-        try:
-            self.conn.execute("SELECT 1")
-        except (sqlite3.Error, AttributeError):
-            logging.warning("⚠️ Database connection lost, reconnecting...")
-            self._connect()
-    
-    def _setup_database(self):
-        """Create table, migrate schema, then create indexes"""
-        self._ensure_connection()
-        cursor = self.conn.cursor()
-        
-        # Step 1: Create base table if not exists
-        cursor.execute('''
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                chat_id INTEGER,
-                user_name TEXT,
-                message_text TEXT,
-                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-            )
-        ''')
-        self.conn.commit()
-        
-        # Step 2: Migrate schema - add new columns if they don't exist
-        cursor.execute("PRAGMA table_info(messages)")
-        columns = [col[1] for col in cursor.fetchall()]
-        
-        if 'user_id' not in columns:
-            cursor.execute("ALTER TABLE messages ADD COLUMN user_id INTEGER")
-            logging.info("📦 Added user_id column")
-        
-        if 'username' not in columns:
-            cursor.execute("ALTER TABLE messages ADD COLUMN username TEXT")
-            logging.info("📦 Added username column")
-        
-        self.conn.commit()
-        
-        # Step 3: Create indexes (now columns exist)
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_chat_timestamp 
-            ON messages(chat_id, timestamp)
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_username 
-            ON messages(username)
-        ''')
-        cursor.execute('''
-            CREATE INDEX IF NOT EXISTS idx_user_id 
-            ON messages(user_id)
-        ''')
-        self.conn.commit()
-        logging.info("✅ Database schema ready")
-    
-    def add_message(self, chat_id, user_id, user_name, username, message_text):
-        """Save a message with full user info"""
-        self._ensure_connection()
-        try:
-            cursor = self.conn.cursor()
-            cursor.execute('''
-                INSERT INTO messages (chat_id, user_id, user_name, username, message_text)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (chat_id, user_id, user_name, username, message_text))
-            self.conn.commit()
-        except sqlite3.Error as e:
-            logging.error(f"❌ Failed to save message: {e}")
-            self._connect()
-    
-    def get_messages_today(self, chat_id):
-        self._ensure_connection()
-        try:
-            cursor = self.conn.cursor()
-            today = datetime.now().date()
-            cursor.execute('''
-                SELECT user_name, message_text, timestamp, username
-                FROM messages
-                WHERE chat_id = ? AND DATE(timestamp) = ?
-                ORDER BY timestamp
-            ''', (chat_id, today))
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            logging.error(f"❌ Failed to fetch messages: {e}")
-            return []
-    
-    def get_messages_last_hours(self, chat_id, hours):
-        self._ensure_connection()
-        try:
-            cursor = self.conn.cursor()
-            time_ago = datetime.now() - timedelta(hours=hours)
-            cursor.execute('''
-                SELECT user_name, message_text, timestamp, username
-                FROM messages
-                WHERE chat_id = ? AND timestamp >= ?
-                ORDER BY timestamp
-            ''', (chat_id, time_ago))
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            logging.error(f"❌ Failed to fetch messages: {e}")
-            return []
-    
-    def get_messages_by_person(self, chat_id, person_names, hours=None):
-        """Get messages from specific person(s) - searches by name OR username (partial, case-insensitive)"""
-        self._ensure_connection()
-        try:
-            cursor = self.conn.cursor()
-            
-            # Build conditions for each name using LIKE for partial matching
-            # This allows "YisakValhalla" to match both username "YisakValhalla" AND first name "Yisak"
-            conditions = []
-            params = [chat_id]
-            
-            for name in person_names:
-                name_pattern = f"%{name.lower()}%"
-                # Match if user_name contains the search term OR username contains it
-                conditions.append("(LOWER(user_name) LIKE ? OR LOWER(COALESCE(username, '')) LIKE ?)")
-                params.extend([name_pattern, name_pattern])
-            
-            name_condition = " OR ".join(conditions)
-            
-            if hours:
-                time_ago = datetime.now() - timedelta(hours=hours)
-                query = f'''
-                    SELECT user_name, message_text, timestamp, username
-                    FROM messages
-                    WHERE chat_id = ? AND ({name_condition}) AND timestamp >= ?
-                    ORDER BY timestamp
-                '''
-                params.append(time_ago)
-            else:
-                today = datetime.now().date()
-                query = f'''
-                    SELECT user_name, message_text, timestamp, username
-                    FROM messages
-                    WHERE chat_id = ? AND ({name_condition}) AND DATE(timestamp) = ?
-                    ORDER BY timestamp
-                '''
-                params.append(today)
-            
-            cursor.execute(query, params)
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            logging.error(f"❌ Failed to fetch messages by person: {e}")
-            return []
-    
-    def get_participants(self, chat_id):
-        """Get list of all participants who sent messages today with their usernames"""
-        self._ensure_connection()
-        try:
-            cursor = self.conn.cursor()
-            today = datetime.now().date()
-            cursor.execute('''
-                SELECT DISTINCT user_name, username
-                FROM messages
-                WHERE chat_id = ? AND DATE(timestamp) = ?
-                ORDER BY user_name
-            ''', (chat_id, today))
-            return cursor.fetchall()
-        except sqlite3.Error as e:
-            logging.error(f"❌ Failed to fetch participants: {e}")
-            return []
-    
-    def close(self):
-        """Close database connection"""
-        if self.conn:
-            self.conn.close()
-            logging.info("📁 Database connection closed")
+import sqlite3
+import json
+import zlib
+import logging
+import threading
+import time
+from collections import Counter
+
+from analysis import Analyzer, term_id
+from codec import TRAINING_SAMPLES, MessageCodec, train_dictionary
+from search import chat_token
+from timeutils import END_OF_TIME, day_bounds, hours_ago_ts, local_day, now_ts, window_bounds
+
+# sqlite3 errors that mean the connection itself is unusable (vs. a bad query or a busy lock)
+CONNECTION_ERRORS = (
+    "closed database",
+    "disk i/o error",
+    "unable to open database",
+    "database disk image is malformed",
+)
+
+# Every message read returns (user_name, message_text, timestamp, username).
+# Names live in `users`; the per-row copies are only kept for rows without a user_id.
+MESSAGE_SELECT = '''
+    SELECT COALESCE(u.user_name, m.user_name), m.message_text, m.timestamp,
+           COALESCE(u.username, m.username)
+    FROM messages m LEFT JOIN users u ON u.user_id = m.user_id
+'''
+# Same, plus the packed term vector stored at ingest (see analysis.py) as a fifth column
+MESSAGE_SELECT_WITH_TERMS = '''
+    SELECT COALESCE(u.user_name, m.user_name), m.message_text, m.timestamp,
+           COALESCE(u.username, m.username), t.vector
+    FROM messages m LEFT JOIN users u ON u.user_id = m.user_id
+    LEFT JOIN message_terms t ON t.message_id = m.id
+'''
+
+# Max users of a chat a single /person name may resolve to
+MAX_NAME_MATCHES = 50
+# Largest SQLite rowid, the "no limit" bound for id filters
+MAX_ROWID = 2 ** 63 - 1
+
+def day_key(ts):
+    """Local day bucket ('YYYY-MM-DD') used by daily_stats"""
+    return local_day(ts).isoformat()
+
+def normalize_name(name):
+    """Lowercased form used for name/username lookups (Unicode-aware, unlike SQL LOWER)"""
+    return name.lower() if name else None
+
+def is_connection_error(error):
+    """True if a sqlite3 error means we should reconnect"""
+    if isinstance(error, sqlite3.ProgrammingError):
+        return "closed" in str(error).lower()
+    return any(marker in str(error).lower() for marker in CONNECTION_ERRORS)
+
+class MessageDB:
+    def __init__(self, db_path='messages.db', max_retries=3, read_only=False, message_codec=None,
+                 analyze=False):
+        self.db_path = db_path
+        self.max_retries = max_retries
+        self.read_only = read_only
+        self.conn = None
+        self._has_user_fts = None
+        self._has_message_fts = None
+        # Serializes access to the shared connection between the event loop
+        # and the ingest flusher thread
+        self._lock = threading.RLock()
+        # Readers only decode; they fetch dictionaries by id when they first meet one
+        self.codec = MessageCodec(
+            None if read_only else message_codec, load_dictionary=self._load_codec_dictionary
+        )
+        # With analyze, the writer stores term vectors and every read returns them
+        self.analyzer = Analyzer() if analyze and not read_only else None
+        self.message_select = MESSAGE_SELECT_WITH_TERMS if analyze else MESSAGE_SELECT
+        self._connect()
+        if not read_only:
+            self._setup_database()
+            self._load_codec_dictionaries()
+    
+    def _connect(self):
+        """Establish database connection with retry logic"""
+        for attempt in range(self.max_retries):
+            try:
+                if self.read_only:
+                    # Readers share the WAL with the writer and never block it
+                    self.conn = sqlite3.connect(
+                        f"file:{self.db_path}?mode=ro", uri=True, check_same_thread=False
+                    )
+                else:
+                    self.conn = sqlite3.connect(self.db_path, check_same_thread=False)
+                    # Must precede WAL setup to apply to a new file; existing databases
+                    # only switch after a VACUUM (see retention.py --convert)
+                    self.conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    self.conn.execute("PRAGMA journal_mode=WAL")
+                logging.info(f"✅ Database connected: {self.db_path}{' (read-only)' if self.read_only else ''}")
+                return
+            except sqlite3.Error as e:
+                logging.error(f"❌ Database connection attempt {attempt + 1} failed: {e}")
+                if attempt < self.max_retries - 1:
+                    time.sleep(1)
+                else:
+                    raise
+    
+    def _ensure_connection(self):
+        """Open the connection if it was never opened or has been closed.
+        Dead connections are detected by the errors they raise, not by probing."""
+        if self.conn is None:
+            self._connect()
+    
+    def _reconnect_on(self, error):
+        """Reconnect if `error` means the connection is gone. Returns True if it did."""
+        if not is_connection_error(error):
+            return False
+        logging.warning(f"⚠️ Database connection lost ({error}), reconnecting...")
+        try:
+            self.conn.close()
+        except sqlite3.Error:
+            pass
+        self._connect()
+        return True
+    
+    def _fetchall(self, query, params=()):
+        """Run a read query, retrying once on a fresh connection if the old one died"""
+        try:
+            return self.conn.execute(query, params).fetchall()
+        except sqlite3.Error as e:
+            if not self._reconnect_on(e):
+                raise
+        return self.conn.execute(query, params).fetchall()
+    
+    def create_message_indexes(self):
+        """Create the query indexes on messages (no-op if they exist)"""
+        with self._lock:
+            self._ensure_connection()
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_ts 
+                ON messages(chat_id, ts, user_id)
+            ''')
+            # Person lookups go through users -> (chat_id, user_id, ts)
+            self.conn.execute('''
+                CREATE INDEX IF NOT EXISTS idx_chat_user_ts 
+                ON messages(chat_id, user_id, ts)
+            ''')
+            self.conn.commit()
+    
+    def drop_message_indexes(self):
+        """Drop the query indexes for a bulk load; create_message_indexes (or the next
+        start-up) builds them again in one sorted pass"""
+        with self._lock:
+            self._ensure_connection()
+            self.conn.execute("DROP INDEX IF EXISTS idx_chat_ts")
+            self.conn.execute("DROP INDEX IF EXISTS idx_chat_user_ts")
+            self.conn.commit()
+    
+    def _fetch_messages(self, query, params=()):
+        """_fetchall for MESSAGE_SELECT queries, with message_text decoded"""
+        return self.codec.decode_rows(self._fetchall(query, params), 1)
+    
+    def _setup_database(self):
+        """Create table, migrate schema, then create indexes"""
+        self._ensure_connection()
+        cursor = self.conn.cursor()
+        
+        # Step 1: Create base table if not exists
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                chat_id INTEGER,
+                user_name TEXT,
+                message_text TEXT,
+                timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        self.conn.commit()
+        
+        # Step 2: Migrate schema - add new columns if they don't exist
+        cursor.execute("PRAGMA table_info(messages)")
+        columns = [col[1] for col in cursor.fetchall()]
+        
+        if 'user_id' not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN user_id INTEGER")
+            logging.info("📦 Added user_id column")
+        
+        if 'username' not in columns:
+            cursor.execute("ALTER TABLE messages ADD COLUMN username TEXT")
+            logging.info("📦 Added username column")
+        
+        if 'ts' not in columns:
+            # Integer UTC epoch seconds: range predicates on it can use an index,
+            # unlike DATE(timestamp) = ?
+            cursor.execute("ALTER TABLE messages ADD COLUMN ts INTEGER")
+            logging.info("📦 Added ts column")
+        
+        if 'tg_message_id' not in columns:
+            # Telegram's message id; (chat_id, tg_message_id) dedupes imports and redelivered updates
+            cursor.execute("ALTER TABLE messages ADD COLUMN tg_message_id INTEGER")
+            logging.info("📦 Added tg_message_id column")
+        
+        self.conn.commit()
+        
+        # Backfill ts from the UTC CURRENT_TIMESTAMP text of older rows
+        cursor.execute('''
+            UPDATE messages SET ts = CAST(strftime('%s', timestamp) AS INTEGER)
+            WHERE ts IS NULL
+        ''')
+        if cursor.rowcount > 0:
+            logging.info(f"📦 Backfilled ts for {cursor.rowcount} messages")
+        self.conn.commit()
+        
+        # Step 3: Create indexes (now columns exist)
+        # idx_chat_ts replaces idx_chat_timestamp; nothing filters on the text column anymore
+        cursor.execute("DROP INDEX IF EXISTS idx_chat_timestamp")
+        cursor.execute("DROP INDEX IF EXISTS idx_username")
+        cursor.execute("DROP INDEX IF EXISTS idx_user_id")
+        cursor.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_chat_tg_message
+            ON messages(chat_id, tg_message_id) WHERE tg_message_id IS NOT NULL
+        ''')
+        self.conn.commit()
+        self.create_message_indexes()
+        
+        # Step 4: Users dimension table
+        self._setup_users(cursor)
+        
+        # Step 5: Per-chat daily activity aggregates
+        self._setup_daily_stats(cursor)
+        
+        # Step 6: Per-chat high-water mark used to validate cached summaries
+        self._setup_chat_state(cursor)
+        
+        # Step 7: Stored summaries of closed time segments
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS segments (
+                chat_id INTEGER NOT NULL,
+                seg_start INTEGER NOT NULL,
+                seg_end INTEGER NOT NULL,
+                message_count INTEGER NOT NULL,
+                representatives TEXT NOT NULL,
+                dirty INTEGER NOT NULL DEFAULT 0,
+                computed_ts INTEGER,
+                PRIMARY KEY (chat_id, seg_start)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Step 8: Per-chat, per-day archives of messages removed by retention
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS archives (
+                chat_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                first_ts INTEGER,
+                last_ts INTEGER,
+                summary TEXT,
+                payload BLOB,
+                archived_ts INTEGER,
+                PRIMARY KEY (chat_id, day)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Step 9: Resume points of bulk imports (see import_history.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS import_progress (
+                source TEXT NOT NULL,
+                chat_id INTEGER NOT NULL,
+                last_tg_message_id INTEGER NOT NULL,
+                imported INTEGER NOT NULL DEFAULT 0,
+                updated_ts INTEGER,
+                PRIMARY KEY (source, chat_id)
+            )
+        ''')
+        
+        # Step 10: Dictionaries for compressed message_text (see codec.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS codec_dicts (
+                dict_id INTEGER PRIMARY KEY,
+                codec TEXT NOT NULL,
+                data BLOB NOT NULL,
+                created_ts INTEGER NOT NULL
+            )
+        ''')
+        self.conn.commit()
+        
+        # Step 11: Full-text index of message bodies
+        self._setup_message_fts(cursor)
+        
+        # Step 12: Term vectors and per-chat vocabulary from ingest-time analysis
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS message_terms (
+                message_id INTEGER PRIMARY KEY,
+                vector BLOB NOT NULL
+            )
+        ''')
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS vocab (
+                chat_id INTEGER NOT NULL,
+                term_id INTEGER NOT NULL,
+                term TEXT NOT NULL,
+                df INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, term_id)
+            ) WITHOUT ROWID
+        ''')
+        
+        # Step 13: Precomputed /catchup digests (see digests.py)
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS digests (
+                chat_id INTEGER NOT NULL,
+                kind TEXT NOT NULL,
+                summary TEXT NOT NULL,
+                participants TEXT NOT NULL,
+                message_count INTEGER NOT NULL,
+                chat_message_count INTEGER NOT NULL,
+                built_ts INTEGER NOT NULL,
+                PRIMARY KEY (chat_id, kind)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+        logging.info("✅ Database schema ready")
+    
+    def _setup_users(self, cursor):
+        """Create the users table, its name indexes and backfill it from messages"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                user_name TEXT,
+                username TEXT,
+                name_lower TEXT,
+                username_lower TEXT,
+                updated_ts INTEGER
+            )
+        ''')
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name_lower)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users(username_lower)")
+        
+        # Trigram index for substring matches; needs SQLite >= 3.34 built with FTS5
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE IF NOT EXISTS users_fts USING fts5(
+                    name_lower, username_lower,
+                    content='users', content_rowid='user_id', tokenize='trigram'
+                )
+            ''')
+            cursor.executescript('''
+                CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+                    INSERT INTO users_fts(rowid, name_lower, username_lower)
+                    VALUES (new.user_id, new.name_lower, new.username_lower);
+                END;
+                CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+                    INSERT INTO users_fts(users_fts, rowid, name_lower, username_lower)
+                    VALUES ('delete', old.user_id, old.name_lower, old.username_lower);
+                END;
+                CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE ON users BEGIN
+                    INSERT INTO users_fts(users_fts, rowid, name_lower, username_lower)
+                    VALUES ('delete', old.user_id, old.name_lower, old.username_lower);
+                    INSERT INTO users_fts(rowid, name_lower, username_lower)
+                    VALUES (new.user_id, new.name_lower, new.username_lower);
+                END;
+            ''')
+        except sqlite3.OperationalError as e:
+            logging.warning(f"⚠️ Trigram index unavailable, /person falls back to prefix matching: {e}")
+        self.conn.commit()
+        
+        cursor.execute("SELECT 1 FROM users LIMIT 1")
+        if cursor.fetchone() is None:
+            # Latest name/username per user from existing history
+            self.conn.create_function("py_lower", 1, normalize_name, deterministic=True)
+            cursor.execute('''
+                INSERT INTO users (user_id, user_name, username, name_lower, username_lower, updated_ts)
+                SELECT user_id, user_name, username, py_lower(user_name), py_lower(username), ts
+                FROM messages
+                WHERE id IN (
+                    SELECT MAX(id) FROM messages WHERE user_id IS NOT NULL GROUP BY user_id
+                )
+            ''')
+            if cursor.rowcount > 0:
+                logging.info(f"📦 Backfilled {cursor.rowcount} users")
+            self.conn.commit()
+    
+    def _setup_message_fts(self, cursor):
+        """Create the contentless FTS5 index over message bodies and backfill it.
+        Bodies may be stored compressed, so the index is fed by add_messages with the
+        plain text instead of by triggers; deletes must pass the same values back."""
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+        ).fetchone()
+        if exists:
+            return
+        try:
+            cursor.execute('''
+                CREATE VIRTUAL TABLE messages_fts USING fts5(
+                    body, chat, content='', tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+                )
+            ''')
+        except sqlite3.OperationalError as e:
+            logging.warning(f"⚠️ FTS5 unavailable, /search is disabled: {e}")
+            return
+        
+        last_id = 0
+        indexed = 0
+        while True:
+            rows = cursor.execute('''
+                SELECT id, chat_id, message_text FROM messages
+                WHERE id > ? AND message_text IS NOT NULL ORDER BY id LIMIT 5000
+            ''', (last_id,)).fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+            rows = self.codec.decode_rows(rows, 2)
+            cursor.executemany(
+                "INSERT INTO messages_fts(rowid, body, chat) VALUES (?, ?, ?)",
+                [(message_id, text, chat_token(chat_id)) for message_id, chat_id, text in rows]
+            )
+            indexed += len(rows)
+        self.conn.commit()
+        if indexed:
+            logging.info(f"📦 Indexed {indexed} messages for full-text search")
+    
+    def _setup_daily_stats(self, cursor):
+        """Create daily_stats (chat, day, user -> count, first/last seen) and backfill it"""
+        # `day` is the local day in BOT_TIMEZONE at the time the row was written
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS daily_stats (
+                chat_id INTEGER NOT NULL,
+                day TEXT NOT NULL,
+                user_id INTEGER NOT NULL,
+                message_count INTEGER NOT NULL DEFAULT 0,
+                first_ts INTEGER,
+                last_ts INTEGER,
+                PRIMARY KEY (chat_id, day, user_id)
+            ) WITHOUT ROWID
+        ''')
+        self.conn.commit()
+
+        cursor.execute("SELECT 1 FROM daily_stats LIMIT 1")
+        if cursor.fetchone() is None:
+            self.conn.create_function("day_key", 1, day_key, deterministic=True)
+            cursor.execute('''
+                INSERT INTO daily_stats (chat_id, day, user_id, message_count, first_ts, last_ts)
+                SELECT chat_id, day_key(ts), user_id, COUNT(*), MIN(ts), MAX(ts)
+                FROM messages
+                WHERE user_id IS NOT NULL AND ts IS NOT NULL
+                GROUP BY chat_id, day_key(ts), user_id
+            ''')
+            if cursor.rowcount > 0:
+                logging.info(f"📦 Backfilled {cursor.rowcount} daily stats rows")
+            self.conn.commit()
+
+    def _setup_chat_state(self, cursor):
+        """Create chat_state (chat -> last message id, message count, last activity) and backfill it"""
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS chat_state (
+                chat_id INTEGER PRIMARY KEY,
+                last_message_id INTEGER NOT NULL,
+                message_count INTEGER NOT NULL,
+                last_ts INTEGER
+            )
+        ''')
+        cursor.execute("SELECT 1 FROM chat_state LIMIT 1")
+        if cursor.fetchone() is None:
+            cursor.execute('''
+                INSERT INTO chat_state (chat_id, last_message_id, message_count, last_ts)
+                SELECT chat_id, MAX(id), COUNT(*), MAX(ts) FROM messages GROUP BY chat_id
+            ''')
+        self.conn.commit()
+
+    def _load_codec_dictionary(self, dict_id):
+        row = self.conn.execute("SELECT codec, data FROM codec_dicts WHERE dict_id = ?", (dict_id,)).fetchone()
+        return tuple(row) if row else None
+    
+    def _load_codec_dictionaries(self):
+        for dict_id, codec, data in self.conn.execute("SELECT dict_id, codec, data FROM codec_dicts"):
+            self.codec.use_dictionary(dict_id, codec, data)
+    
+    def codec_dictionary_age(self):
+        """Seconds since the newest dictionary for our codec was trained, or None if there is none"""
+        with self._lock:
+            self._ensure_connection()
+            row = self.conn.execute(
+                "SELECT MAX(created_ts) FROM codec_dicts WHERE codec = ?", (self.codec.codec,)
+            ).fetchone()
+            return None if row[0] is None else now_ts() - row[0]
+    
+    def train_codec_dictionary(self, samples=TRAINING_SAMPLES):
+        """Train a dictionary from recent messages and encode new messages with it.
+        Returns its id, or None if compression is off or there is too little text."""
+        if self.codec.codec is None:
+            return None
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT message_text FROM messages
+                    WHERE message_text IS NOT NULL ORDER BY id DESC LIMIT ?
+                ''', (samples,))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to sample messages for the codec dictionary: {e}")
+                return None
+            texts = [self.codec.decode(row[0]) for row in rows]
+            if len(texts) < 100:
+                return None
+            try:
+                data = train_dictionary(self.codec.codec, texts)
+            except Exception as e:
+                logging.error(f"❌ Failed to train {self.codec.codec} dictionary: {e}")
+                return None
+            try:
+                cursor = self.conn.execute(
+                    "INSERT INTO codec_dicts (codec, data, created_ts) VALUES (?, ?, ?)",
+                    (self.codec.codec, data, now_ts())
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to store codec dictionary: {e}")
+                self._reconnect_on(e)
+                return None
+            self.codec.use_dictionary(cursor.lastrowid, self.codec.codec, data)
+            logging.info(f"📚 Trained {self.codec.codec} dictionary {cursor.lastrowid} ({len(data)} bytes)")
+            return cursor.lastrowid
+    
+    def add_message(self, chat_id, user_id, user_name, username, message_text):
+        """Save a message with full user info"""
+        try:
+            self.add_messages([(chat_id, user_id, user_name, username, message_text, now_ts(), None)])
+        except sqlite3.Error:
+            pass  # Already logged by add_messages
+    
+    def add_messages(self, rows, progress=None):
+        """Save a batch of (chat_id, user_id, user_name, username, message_text, ts, tg_message_id)
+        rows in one transaction. ts is epoch seconds of when the message was sent; rows whose
+        (chat_id, tg_message_id) is already stored are skipped. `progress` is an optional
+        (source, chat_id, last_tg_message_id) import resume point saved in the same transaction.
+        Returns the number of new rows. Raises sqlite3.Error so callers can retry the batch."""
+        if not rows and progress is None:
+            return 0
+        with self._lock:
+            self._ensure_connection()
+            try:
+                cursor = self.conn.cursor()
+                rows = self._drop_known(cursor, rows)
+                if progress is not None:
+                    self._save_import_progress(cursor, progress, len(rows))
+                if not rows:
+                    self.conn.commit()
+                    return 0
+                self._upsert_users(cursor, rows)
+                encode = self.codec.encode
+                # Names are stored once in `users`; rows only keep them when there is no user_id
+                cursor.executemany('''
+                    INSERT INTO messages
+                        (chat_id, user_id, user_name, username, message_text, ts, tg_message_id, timestamp)
+                    VALUES (?1, ?2, CASE WHEN ?2 IS NULL THEN ?3 END, CASE WHEN ?2 IS NULL THEN ?4 END,
+                            ?5, ?6, ?7, datetime(?6, 'unixepoch'))
+                ''', [row[:4] + (encode(row[4]),) + row[5:] for row in rows])
+                last_id = cursor.execute("SELECT MAX(id) FROM messages").fetchone()[0]
+                self._index_messages(cursor, rows, last_id)
+                self._store_term_vectors(cursor, [
+                    (last_id - len(rows) + 1 + i, row[0], row[4]) for i, row in enumerate(rows)
+                ])
+                self._update_daily_stats(cursor, rows)
+                self._update_chat_state(cursor, rows, last_id)
+                self._mark_segments_dirty(cursor, rows)
+                self.conn.commit()
+                return len(rows)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to save batch of {len(rows)} messages: {e}")
+                if not self._reconnect_on(e):
+                    self.conn.rollback()
+                raise
+    
+    def _drop_known(self, cursor, rows):
+        """Rows whose Telegram message id is not stored yet (nor repeated within the batch)"""
+        ranges = {}
+        for row in rows:
+            if row[6] is not None:
+                low, high = ranges.get(row[0], (row[6], row[6]))
+                ranges[row[0]] = (min(low, row[6]), max(high, row[6]))
+        if not ranges:
+            return rows
+        seen = set()
+        for chat_id, (low, high) in ranges.items():
+            for (message_id,) in cursor.execute('''
+                SELECT tg_message_id FROM messages
+                WHERE chat_id = ? AND tg_message_id IS NOT NULL AND tg_message_id BETWEEN ? AND ?
+            ''', (chat_id, low, high)):
+                seen.add((chat_id, message_id))
+        fresh = []
+        for row in rows:
+            if row[6] is not None:
+                key = (row[0], row[6])
+                if key in seen:
+                    continue
+                seen.add(key)
+            fresh.append(row)
+        return fresh
+    
+    def _save_import_progress(self, cursor, progress, imported):
+        source, chat_id, last_tg_message_id = progress
+        cursor.execute('''
+            INSERT INTO import_progress (source, chat_id, last_tg_message_id, imported, updated_ts)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(source, chat_id) DO UPDATE SET
+                last_tg_message_id = MAX(last_tg_message_id, excluded.last_tg_message_id),
+                imported = imported + excluded.imported,
+                updated_ts = excluded.updated_ts
+        ''', (source, chat_id, last_tg_message_id, imported, now_ts()))
+    
+    def get_import_progress(self, source, chat_id):
+        """(last_tg_message_id, imported) of an earlier import of this source and chat, or (0, 0)"""
+        with self._lock:
+            self._ensure_connection()
+            row = self.conn.execute(
+                "SELECT last_tg_message_id, imported FROM import_progress WHERE source = ? AND chat_id = ?",
+                (source, chat_id)
+            ).fetchone()
+            return tuple(row) if row else (0, 0)
+    
+    def _upsert_users(self, cursor, rows):
+        """Record the latest display name/username of every sender in the batch"""
+        latest = {}
+        for chat_id, user_id, user_name, username, message_text, ts, _ in rows:
+            if user_id is not None and (user_id not in latest or ts >= latest[user_id][5]):
+                latest[user_id] = (user_id, user_name, username,
+                                   normalize_name(user_name), normalize_name(username), ts)
+        if not latest:
+            return
+        # Only touch the row (and its trigram entry) when a name actually changed, and never
+        # let older (imported) messages overwrite a newer name
+        cursor.executemany('''
+            INSERT INTO users (user_id, user_name, username, name_lower, username_lower, updated_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET
+                user_name = excluded.user_name,
+                username = excluded.username,
+                name_lower = excluded.name_lower,
+                username_lower = excluded.username_lower,
+                updated_ts = excluded.updated_ts
+            WHERE excluded.updated_ts >= COALESCE(users.updated_ts, 0)
+              AND (users.user_name IS NOT excluded.user_name OR users.username IS NOT excluded.username)
+        ''', list(latest.values()))
+    
+    def _update_daily_stats(self, cursor, rows):
+        """Fold a batch into daily_stats in the same transaction as the insert"""
+        buckets = {}
+        for chat_id, user_id, user_name, username, message_text, ts, _ in rows:
+            if user_id is None:
+                continue
+            key = (chat_id, day_key(ts), user_id)
+            count, first_ts, last_ts = buckets.get(key, (0, ts, ts))
+            buckets[key] = (count + 1, min(first_ts, ts), max(last_ts, ts))
+        if not buckets:
+            return
+        cursor.executemany('''
+            INSERT INTO daily_stats (chat_id, day, user_id, message_count, first_ts, last_ts)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(chat_id, day, user_id) DO UPDATE SET
+                message_count = message_count + excluded.message_count,
+                first_ts = MIN(first_ts, excluded.first_ts),
+                last_ts = MAX(last_ts, excluded.last_ts)
+        ''', [key + value for key, value in buckets.items()])
+
+    def _index_messages(self, cursor, rows, last_id):
+        """Add a just-inserted batch to messages_fts. Within one transaction AUTOINCREMENT
+        hands out consecutive ids, so the batch occupies the ids ending at last_id."""
+        if not self._message_fts_available():
+            return
+        first_id = last_id - len(rows) + 1
+        cursor.executemany(
+            "INSERT INTO messages_fts(rowid, body, chat) VALUES (?, ?, ?)",
+            [(first_id + i, row[4], chat_token(row[0])) for i, row in enumerate(rows) if row[4] is not None]
+        )
+    
+    def _store_term_vectors(self, cursor, messages):
+        """Analyze (message_id, chat_id, text) triples once and store their vectors,
+        folding their terms into each chat's vocabulary"""
+        if self.analyzer is None:
+            return
+        vectors = []
+        document_frequency = {}
+        for message_id, chat_id, text in messages:
+            vector, terms = self.analyzer.analyze(text or "")
+            vectors.append((message_id, vector))
+            chat_terms = document_frequency.setdefault(chat_id, Counter())
+            chat_terms.update(terms.keys())
+        cursor.executemany("INSERT OR REPLACE INTO message_terms (message_id, vector) VALUES (?, ?)", vectors)
+        cursor.executemany('''
+            INSERT INTO vocab (chat_id, term_id, term, df) VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id, term_id) DO UPDATE SET df = df + excluded.df
+        ''', [
+            (chat_id, term_id(term), term, df)
+            for chat_id, terms in document_frequency.items()
+            for term, df in terms.items()
+        ])
+    
+    def analyze_pending(self, limit=5000):
+        """Analyze up to `limit` messages that have no stored vector; returns how many"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self.conn.execute('''
+                    SELECT m.id, m.chat_id, m.message_text FROM messages m
+                    WHERE NOT EXISTS (SELECT 1 FROM message_terms t WHERE t.message_id = m.id)
+                    ORDER BY m.id LIMIT ?
+                ''', (limit,)).fetchall()
+                rows = self.codec.decode_rows(rows, 2)
+                self._store_term_vectors(self.conn.cursor(), rows)
+                self.conn.commit()
+                return len(rows)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to analyze messages: {e}")
+                if not self._reconnect_on(e):
+                    self.conn.rollback()
+                return 0
+    
+    def get_vocabulary(self, chat_id, limit=50):
+        """The chat's most widespread terms as (term, document frequency)"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                return self._fetchall(
+                    "SELECT term, df FROM vocab WHERE chat_id = ? ORDER BY df DESC LIMIT ?", (chat_id, limit)
+                )
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch vocabulary: {e}")
+                return []
+    
+    def _update_chat_state(self, cursor, rows, last_id):
+        """Advance each chat's high-water mark to the newest row id of this batch"""
+        chats = {}
+        for row in rows:
+            count, last_ts = chats.get(row[0], (0, row[5]))
+            chats[row[0]] = (count + 1, max(last_ts, row[5]))
+        cursor.executemany('''
+            INSERT INTO chat_state (chat_id, last_message_id, message_count, last_ts)
+            VALUES (?, ?, ?, ?)
+            ON CONFLICT(chat_id) DO UPDATE SET
+                last_message_id = excluded.last_message_id,
+                message_count = message_count + excluded.message_count,
+                last_ts = MAX(COALESCE(last_ts, 0), excluded.last_ts)
+        ''', [(chat_id, last_id, count, last_ts) for chat_id, (count, last_ts) in chats.items()])
+
+    def _mark_segments_dirty(self, cursor, rows):
+        """Late messages landing in an already summarized segment force it to be recomputed"""
+        cursor.executemany('''
+            UPDATE segments SET dirty = 1
+            WHERE chat_id = ? AND seg_start <= ?2 AND seg_end > ?2 AND dirty = 0
+        ''', {(row[0], row[5]) for row in rows})
+    
+    def get_chat_state(self, chat_id):
+        """(last_message_id, message_count, last_ts) for a chat, (0, 0, None) if it has
+        no messages, or None if the lookup failed"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT last_message_id, message_count, last_ts FROM chat_state WHERE chat_id = ?
+                ''', (chat_id,))
+                return rows[0] if rows else (0, 0, None)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch chat state: {e}")
+                return None
+
+    def get_active_chats(self, since_ts):
+        """Chat ids with a message at or after since_ts, most recently active first"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT chat_id FROM chat_state WHERE last_ts >= ? ORDER BY last_ts DESC
+                ''', (since_ts,))
+                return [row[0] for row in rows]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch active chats: {e}")
+                return []
+    
+    def get_recent_rows(self, chat_id, since_ts, limit, max_id=None):
+        """Newest `limit` messages at or after since_ts as (ts, message, tg_message_id),
+        oldest first. With max_id, only messages stored up to that id."""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT m.ts, m.tg_message_id, COALESCE(u.user_name, m.user_name), m.message_text,
+                           m.timestamp, COALESCE(u.username, m.username)
+                    FROM messages m LEFT JOIN users u ON u.user_id = m.user_id
+                    WHERE m.chat_id = ? AND m.ts >= ? AND m.id <= ?
+                    ORDER BY m.ts DESC LIMIT ?
+                ''', (chat_id, since_ts, MAX_ROWID if max_id is None else max_id, limit))
+                rows = self.codec.decode_rows(rows, 3)
+                return [(row[0], row[2:], row[1]) for row in reversed(rows)]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch recent messages: {e}")
+                return []
+    
+    def last_message_id(self):
+        """Id of the newest stored message (ids only grow), 0 for an empty table"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                row = self.conn.execute("SELECT MAX(id) FROM messages").fetchone()
+                return row[0] or 0
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to read the last message id: {e}")
+                return 0
+    
+    def get_rows_after(self, message_id):
+        """Messages stored after message_id as (id, chat_id, ts, message, tg_message_id),
+        in storage order"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT m.id, m.chat_id, m.ts, m.tg_message_id, COALESCE(u.user_name, m.user_name),
+                           m.message_text, m.timestamp, COALESCE(u.username, m.username)
+                    FROM messages m LEFT JOIN users u ON u.user_id = m.user_id
+                    WHERE m.id > ?
+                    ORDER BY m.id
+                ''', (message_id,))
+                rows = self.codec.decode_rows(rows, 5)
+                return [(row[0], row[1], row[2], row[4:], row[3]) for row in rows]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch new messages: {e}")
+                return []
+    
+    def _message_fts_available(self):
+        if self._has_message_fts is None:
+            row = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'"
+            ).fetchone()
+            self._has_message_fts = row is not None
+        return self._has_message_fts
+    
+    def search_messages(self, chat_id, match, start=0, end=None, limit=10):
+        """BM25-ranked (user_name, message_text, ts, username) hits of an FTS5 MATCH
+        expression (see search.match_query) with start <= ts < end, best first"""
+        with self._lock:
+            self._ensure_connection()
+            if not self._message_fts_available():
+                return []
+            try:
+                rows = self._fetchall('''
+                    SELECT COALESCE(u.user_name, m.user_name), m.message_text, m.ts,
+                           COALESCE(u.username, m.username)
+                    FROM messages_fts f
+                    JOIN messages m ON m.id = f.rowid
+                    LEFT JOIN users u ON u.user_id = m.user_id
+                    WHERE messages_fts MATCH ? AND m.chat_id = ? AND m.ts >= ? AND m.ts < ?
+                    ORDER BY bm25(messages_fts, 1.0, 0.0)
+                    LIMIT ?
+                ''', (match, chat_id, start, END_OF_TIME if end is None else end, limit))
+                return self.codec.decode_rows(rows, 1)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Search failed: {e}")
+                return []
+    
+    def _user_fts_available(self):
+        if self._has_user_fts is None:
+            row = self.conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users_fts'"
+            ).fetchone()
+            self._has_user_fts = row is not None
+        return self._has_user_fts
+    
+    def resolve_user_ids(self, chat_id, person_names, hours=None):
+        """Map search terms to user_ids of people who wrote in the chat today (or in the
+        last `hours` hours), per daily_stats: exact or prefix match on name/username, plus
+        substring match through the trigram index for terms of 3+ characters. Shorter
+        terms, which the trigram index cannot match, fall back to a LIKE scan of users.
+        Each term resolves to at most MAX_NAME_MATCHES users."""
+        start, end = window_bounds(hours)
+        members = ("SELECT DISTINCT user_id FROM daily_stats "
+                   "WHERE chat_id = ? AND day >= ? AND day <= ? AND last_ts >= ? AND first_ts < ?")
+        member_params = [chat_id, day_key(start), day_key(min(end - 1, now_ts())), start, end]
+        queries = []
+        params = []
+        for name in person_names:
+            term = normalize_name(name.lstrip('@'))
+            if not term:
+                continue
+            upper = term + '\U0010ffff'
+            clauses = [
+                "SELECT user_id FROM users WHERE name_lower >= ? AND name_lower < ?",
+                "SELECT user_id FROM users WHERE username_lower >= ? AND username_lower < ?",
+            ]
+            params.extend([term, upper, term, upper])
+            if len(term) >= 3 and self._user_fts_available():
+                clauses.append("SELECT rowid FROM users_fts WHERE users_fts MATCH ?")
+                params.append('"' + term.replace('"', '""') + '"')
+            else:
+                pattern = '%' + term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+                clauses.append(
+                    "SELECT user_id FROM users WHERE name_lower LIKE ? ESCAPE '\\' "
+                    "OR username_lower LIKE ? ESCAPE '\\'"
+                )
+                params.extend([pattern, pattern])
+            # Only people of this chat, so matches elsewhere cannot crowd them out of the limit
+            queries.append(
+                f"SELECT * FROM (SELECT user_id FROM ({' UNION '.join(clauses)}) "
+                f"WHERE user_id IN ({members}) LIMIT {MAX_NAME_MATCHES})"
+            )
+            params.extend(member_params)
+        if not queries:
+            return []
+        return [row[0] for row in self._fetchall(" UNION ".join(queries), params)]
+    
+    def get_messages_today(self, chat_id):
+        with self._lock:
+            self._ensure_connection()
+            try:
+                start, end = day_bounds()
+                return self._fetch_messages(self.message_select + '''
+                    WHERE m.chat_id = ? AND m.ts >= ? AND m.ts < ?
+                    ORDER BY m.ts
+                ''', (chat_id, start, end))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages: {e}")
+                return []
+    
+    def get_messages_last_hours(self, chat_id, hours):
+        with self._lock:
+            self._ensure_connection()
+            try:
+                return self._fetch_messages(self.message_select + '''
+                    WHERE m.chat_id = ? AND m.ts >= ?
+                    ORDER BY m.ts
+                ''', (chat_id, hours_ago_ts(hours)))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages: {e}")
+                return []
+    
+    def get_messages_between(self, chat_id, start, end):
+        """Messages with start <= ts < end (epoch seconds)"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                return self._fetch_messages(self.message_select + '''
+                    WHERE m.chat_id = ? AND m.ts >= ? AND m.ts < ?
+                    ORDER BY m.ts
+                ''', (chat_id, start, end))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages: {e}")
+                return []
+    
+    def get_messages_page(self, chat_id, start, end, after=None, limit=500):
+        """Up to `limit` messages with start <= ts < end that come after the (ts, id)
+        keyset `after`, in (ts, id) order, and the keyset to pass for the next page
+        (None once the window is exhausted). Each page is its own short read."""
+        after_ts, after_id = after if after is not None else (start, 0)
+        with self._lock:
+            self._ensure_connection()
+            try:
+                # Keys from idx_chat_ts alone, then the rows for just those ids
+                keys = self._fetchall('''
+                    SELECT ts, id FROM messages
+                    WHERE chat_id = ? AND ts >= ? AND ts < ? AND (ts > ? OR id > ?)
+                    ORDER BY ts, id
+                    LIMIT ?
+                ''', (chat_id, after_ts, end, after_ts, after_id, limit))
+                if not keys:
+                    return [], None
+                placeholders = ", ".join("?" * len(keys))
+                messages = self._fetch_messages(self.message_select + f'''
+                    WHERE m.id IN ({placeholders})
+                    ORDER BY m.ts, m.id
+                ''', [key[1] for key in keys])
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages: {e}")
+                return [], None
+        return messages, (tuple(keys[-1]) if len(keys) == limit else None)
+    
+    def count_messages(self, chat_id, hours=None):
+        """Messages sent today, or an upper bound for the last `hours` hours (whole days),
+        read from daily_stats without touching message rows"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                start, end = window_bounds(hours)
+                rows = self._fetchall('''
+                    SELECT COALESCE(SUM(message_count), 0) FROM daily_stats
+                    WHERE chat_id = ? AND day >= ? AND day <= ?
+                ''', (chat_id, day_key(start), day_key(min(end - 1, now_ts()))))
+                return rows[0][0]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to count messages: {e}")
+                return 0
+    
+    def count_messages_between(self, chat_id, start, end, limit=None):
+        """Messages with start <= ts < end, from the index alone; stops counting at `limit`"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT COUNT(*) FROM (
+                        SELECT 1 FROM messages
+                        WHERE chat_id = ? AND ts >= ? AND ts < ?
+                        LIMIT ?
+                    )
+                ''', (chat_id, start, end, -1 if limit is None else limit))
+                return rows[0][0]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to count messages: {e}")
+                return 0
+    
+    def get_segment_counts(self, chat_id, start, end, segment_seconds):
+        """{seg_start: message count} for non-empty segments in [start, end), from the index alone"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT (ts / ?4) * ?4 AS seg_start, COUNT(*)
+                    FROM messages
+                    WHERE chat_id = ?1 AND ts >= ?2 AND ts < ?3
+                    GROUP BY seg_start
+                ''', (chat_id, start, end, segment_seconds))
+                return dict(rows)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to count segment messages: {e}")
+                return {}
+    
+    def get_segments(self, chat_id, start, end):
+        """{seg_start: (message_count, representatives, dirty)} for stored segments in [start, end)"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT seg_start, message_count, representatives, dirty
+                    FROM segments
+                    WHERE chat_id = ? AND seg_start >= ? AND seg_start < ?
+                ''', (chat_id, start, end))
+                return {
+                    seg_start: (count, [tuple(m) for m in json.loads(reps)], bool(dirty))
+                    for seg_start, count, reps, dirty in rows
+                }
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch segments: {e}")
+                return {}
+    
+    def save_segment(self, chat_id, seg_start, seg_end, message_count, representatives):
+        """Store (or replace) the representative messages of a closed segment"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO segments
+                        (chat_id, seg_start, seg_end, message_count, representatives, dirty, computed_ts)
+                    VALUES (?, ?, ?, ?, ?, 0, ?)
+                ''', (chat_id, seg_start, seg_end, message_count,
+                      json.dumps(representatives, ensure_ascii=False), now_ts()))
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to save segment: {e}")
+                self._reconnect_on(e)
+    
+    def save_digest(self, chat_id, kind, summary, participants, message_count, chat_message_count):
+        """Store (or replace) a precomputed digest. chat_message_count is the chat's total
+        message count it was built at, used to judge staleness."""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO digests
+                        (chat_id, kind, summary, participants, message_count, chat_message_count, built_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?)
+                ''', (chat_id, kind, summary, json.dumps(participants, ensure_ascii=False),
+                      message_count, chat_message_count, now_ts()))
+                # Digests of past days are never served again
+                self.conn.execute(
+                    "DELETE FROM digests WHERE chat_id = ? AND kind LIKE 'day:%' AND kind < ?",
+                    (chat_id, f"day:{local_day().isoformat()}")
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to save digest: {e}")
+                self._reconnect_on(e)
+    
+    def get_digest(self, chat_id, kind):
+        """(summary, participants, message_count, chat_message_count, built_ts) or None"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT summary, participants, message_count, chat_message_count, built_ts
+                    FROM digests WHERE chat_id = ? AND kind = ?
+                ''', (chat_id, kind))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch digest: {e}")
+                return None
+        if not rows:
+            return None
+        summary, participants, message_count, chat_message_count, built_ts = rows[0]
+        return (summary, [tuple(p) for p in json.loads(participants)],
+                message_count, chat_message_count, built_ts)
+    
+    def get_oldest_ts(self, chat_id, before_ts):
+        """ts of the chat's oldest message before before_ts, or None"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall(
+                    "SELECT MIN(ts) FROM messages WHERE chat_id = ? AND ts < ?", (chat_id, before_ts)
+                )
+                return rows[0][0]
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch oldest message: {e}")
+                return None
+    
+    def get_archive_rows(self, chat_id, start, end):
+        """(id, ts, user_id, user_name, username, message_text) rows with start <= ts < end"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall('''
+                    SELECT m.id, m.ts, m.user_id, COALESCE(u.user_name, m.user_name),
+                           COALESCE(u.username, m.username), m.message_text
+                    FROM messages m LEFT JOIN users u ON u.user_id = m.user_id
+                    WHERE m.chat_id = ? AND m.ts >= ? AND m.ts < ?
+                    ORDER BY m.ts
+                ''', (chat_id, start, end))
+                return self.codec.decode_rows(rows, 5)
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages to archive: {e}")
+                return []
+    
+    def save_archive(self, chat_id, day, rows, summary, keep_payload=True):
+        """Store a day's archive, merging with what an interrupted earlier run stored.
+        The payload is zlib-compressed JSON of the archive rows (None when only the
+        summary is kept). Raises sqlite3.Error so the caller does not delete the rows."""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                existing = self.conn.execute(
+                    "SELECT message_count, payload FROM archives WHERE chat_id = ? AND day = ?",
+                    (chat_id, day)
+                ).fetchone()
+                merged = {row[0]: list(row) for row in rows}
+                count = len(merged)
+                if existing is not None:
+                    if existing[1] is not None:
+                        for row in json.loads(zlib.decompress(existing[1])):
+                            merged.setdefault(row[0], row)
+                        count = len(merged)
+                    else:
+                        count += existing[0]
+                ordered = sorted(merged.values(), key=lambda row: (row[1], row[0]))
+                payload = None
+                if keep_payload:
+                    payload = zlib.compress(json.dumps(ordered, ensure_ascii=False).encode("utf-8"), 6)
+                self.conn.execute('''
+                    INSERT OR REPLACE INTO archives
+                        (chat_id, day, message_count, first_ts, last_ts, summary, payload, archived_ts)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (chat_id, day, count, ordered[0][1], ordered[-1][1], summary, payload, now_ts()))
+                self.conn.commit()
+                return len(payload) if payload else 0
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to save archive: {e}")
+                if not self._reconnect_on(e):
+                    self.conn.rollback()
+                raise
+    
+    def delete_messages(self, ids, batch_size=500):
+        """Delete messages by id in small transactions so ingest can interleave.
+        Returns how many were deleted."""
+        deleted = 0
+        for i in range(0, len(ids), batch_size):
+            batch = ids[i:i + batch_size]
+            with self._lock:
+                self._ensure_connection()
+                try:
+                    placeholders = ",".join("?" * len(batch))
+                    if self._message_fts_available():
+                        # Contentless index: a delete has to repeat the indexed values
+                        indexed = self.conn.execute(
+                            f"SELECT id, chat_id, message_text FROM messages WHERE id IN ({placeholders})",
+                            batch
+                        ).fetchall()
+                        self.conn.executemany(
+                            "INSERT INTO messages_fts(messages_fts, rowid, body, chat) VALUES ('delete', ?, ?, ?)",
+                            [(message_id, text, chat_token(chat_id))
+                             for message_id, chat_id, text in self.codec.decode_rows(indexed, 2)
+                             if text is not None]
+                        )
+                    self.conn.execute(f"DELETE FROM message_terms WHERE message_id IN ({placeholders})", batch)
+                    cursor = self.conn.execute(f"DELETE FROM messages WHERE id IN ({placeholders})", batch)
+                    self.conn.commit()
+                    deleted += cursor.rowcount
+                except sqlite3.Error as e:
+                    logging.error(f"❌ Failed to delete archived messages: {e}")
+                    if not self._reconnect_on(e):
+                        self.conn.rollback()
+                    raise
+        return deleted
+    
+    def delete_segments_before(self, chat_id, before_ts):
+        """Drop stored segments that only cover archived time"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                self.conn.execute(
+                    "DELETE FROM segments WHERE chat_id = ? AND seg_end <= ?", (chat_id, before_ts)
+                )
+                self.conn.commit()
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to delete old segments: {e}")
+                self._reconnect_on(e)
+    
+    def get_archive(self, chat_id, day):
+        """(message_count, summary) of an archived day, or None"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall(
+                    "SELECT message_count, summary FROM archives WHERE chat_id = ? AND day = ?",
+                    (chat_id, day)
+                )
+                return rows[0] if rows else None
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch archive: {e}")
+                return None
+    
+    def get_archived_messages(self, chat_id, day):
+        """Messages of an archived day in the usual (user_name, message_text, timestamp, username) shape"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                rows = self._fetchall(
+                    "SELECT payload FROM archives WHERE chat_id = ? AND day = ?", (chat_id, day)
+                )
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch archive: {e}")
+                return []
+        if not rows or rows[0][0] is None:
+            return []
+        return [
+            (user_name, text, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts)), username)
+            for _, ts, _, user_name, username, text in json.loads(zlib.decompress(rows[0][0]))
+        ]
+    
+    def compact(self, max_pages=2000, step=200):
+        """Release up to max_pages free pages (incremental vacuum, in short steps) and run a
+        PASSIVE WAL checkpoint, which never waits on readers or blocks writers."""
+        result = {"freed_pages": 0, "checkpoint": None}
+        with self._lock:
+            self._ensure_connection()
+            auto_vacuum = self.conn.execute("PRAGMA auto_vacuum").fetchone()[0]
+        while auto_vacuum == 2 and result["freed_pages"] < max_pages:
+            with self._lock:
+                free = self.conn.execute("PRAGMA freelist_count").fetchone()[0]
+                if free == 0:
+                    break
+                pages = min(step, free, max_pages - result["freed_pages"])
+                self.conn.execute(f"PRAGMA incremental_vacuum({pages})").fetchall()
+                self.conn.commit()
+                result["freed_pages"] += pages
+        with self._lock:
+            try:
+                result["checkpoint"] = self.conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+            except sqlite3.Error as e:
+                logging.error(f"❌ WAL checkpoint failed: {e}")
+        return result
+    
+    def get_messages_by_person(self, chat_id, person_names, hours=None):
+        """Get messages from specific person(s) - matches name OR username (partial, case-insensitive)"""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                # This allows "Yisak" to match both username "YisakValhalla" AND first name "Yisak"
+                user_ids = self.resolve_user_ids(chat_id, person_names, hours)
+                if not user_ids:
+                    return []
+                
+                start, end = window_bounds(hours)
+                placeholders = ", ".join("?" * len(user_ids))
+                query = self.message_select + f'''
+                    WHERE m.chat_id = ? AND m.user_id IN ({placeholders}) AND m.ts >= ? AND m.ts < ?
+                    ORDER BY m.ts
+                '''
+                return self._fetch_messages(query, [chat_id, *user_ids, start, end])
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch messages by person: {e}")
+                return []
+    
+    def get_participants(self, chat_id, hours=None):
+        """Get list of all participants who sent messages today (or in the last `hours` hours)
+        with their usernames. Reads daily_stats, so cost depends on participants, not messages."""
+        with self._lock:
+            self._ensure_connection()
+            try:
+                start, end = window_bounds(hours)
+                first_day = day_key(start)
+                last_day = day_key(min(end - 1, now_ts()))
+                return self._fetchall('''
+                    SELECT COALESCE(u.user_name, 'Unknown') AS name, u.username
+                    FROM (
+                        SELECT DISTINCT user_id FROM daily_stats
+                        WHERE chat_id = ? AND day >= ? AND day <= ?
+                          AND last_ts >= ? AND first_ts < ?
+                    ) s LEFT JOIN users u ON u.user_id = s.user_id
+                    ORDER BY name
+                ''', (chat_id, first_day, last_day, start, end))
+            except sqlite3.Error as e:
+                logging.error(f"❌ Failed to fetch participants: {e}")
+                return []
+    
+    def close(self):
+        """Close database connection"""
+        if self.conn:
+            self.conn.close()
+            self.conn = None
+            logging.info("📁 Database connection closed")
@@ -0,0 +1,157 @@
+"""
+Precomputed /catchup digests.
+
+A JobQueue job summarizes every recently active chat in a parallel batch
+during the off-peak hours and stores the results in the `digests` table, so
+the morning /catchup rush is served from SQLite instead of all hitting the
+summarizer at once. A stored digest stays valid until enough new messages
+have arrived in the chat (or it gets too old); only then is it rebuilt.
+"""
+import asyncio
+import logging
+import time
+
+from summary_pool import SummarizerBusy
+from timeutils import hours_ago_ts, local_datetime, local_day, now_ts
+
+logger = logging.getLogger(__name__)
+
+def digest_kind(hours):
+    """digests.kind of a window: "day:YYYY-MM-DD" for today, "{hours}h" for a rolling window"""
+    return f"{hours}h" if hours else f"day:{local_day().isoformat()}"
+
+def parse_windows(text):
+    """DIGEST_WINDOWS ("day,24") as window hours, None standing for today"""
+    windows = []
+    for part in text.split(","):
+        part = part.strip().lower()
+        if part:
+            windows.append(None if part in ("day", "today") else int(part))
+    return tuple(windows)
+
+def parse_hours(text):
+    """DIGEST_OFFPEAK ("1-7", may wrap past midnight) as (start, end) local hours, or None for any time"""
+    if not text.strip():
+        return None
+    start, end = (int(part) for part in text.split("-"))
+    return start, end
+
+class DigestScheduler:
+    """Builds and serves stored digests for the configured windows of every active chat"""
+    def __init__(self, db, build, windows=(None, 24), refresh_messages=20, max_age=6 * 3600,
+                 concurrency=2, offpeak=None, owns=None):
+        self.db = db
+        self.build = build  # async (chat_id, hours) -> (summary, participants, count) or None
+        self.windows = windows
+        self.refresh_messages = refresh_messages
+        self.max_age = max_age
+        self.concurrency = concurrency
+        self.offpeak = offpeak
+        # chat_id -> bool; in multi-worker mode each worker only builds its own chats' digests
+        self.owns = owns
+        self.stats = {
+            "runs": 0,
+            "built": 0,
+            "still_fresh": 0,
+            "busy_skips": 0,
+            "served": 0,
+            "stale": 0,
+            "last_run_chats": 0,
+            "last_run_seconds": None,
+        }
+
+    def in_offpeak(self, ts=None):
+        if self.offpeak is None:
+            return True
+        hour = local_datetime(ts if ts is not None else now_ts()).hour
+        start, end = self.offpeak
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def _is_fresh(self, digest, state):
+        """A digest is served until refresh_messages new messages arrived or it is max_age old"""
+        _, _, _, chat_message_count, built_ts = digest
+        new_messages = state[1] - chat_message_count
+        return new_messages < self.refresh_messages and now_ts() - built_ts < self.max_age
+
+    async def lookup(self, chat_id, hours):
+        """Stored (summary, participants, message count) for a window, or None if there is no
+        fresh one"""
+        if hours not in self.windows:
+            return None
+        digest = await self.db.get_digest(chat_id, digest_kind(hours))
+        if digest is None:
+            return None
+        state = await self.db.get_chat_state(chat_id)
+        if state is None or not self._is_fresh(digest, state):
+            self.stats["stale"] += 1
+            return None
+        self.stats["served"] += 1
+        return digest[:3]
+
+    async def get(self, chat_id, hours):
+        """Fresh digest of a window, rebuilding and storing it first if needed"""
+        digest = await self.lookup(chat_id, hours)
+        if digest is None:
+            digest = await self._refresh(chat_id, hours)
+        return digest
+
+    async def _refresh(self, chat_id, hours):
+        # Read the count first: anything arriving while we summarize counts as new
+        state = await self.db.get_chat_state(chat_id)
+        if state is None:
+            return None
+        result = await self.build(chat_id, hours)
+        if result is None:
+            return None
+        summary, participants, message_count = result
+        await self.db.save_digest(
+            chat_id, digest_kind(hours), summary, participants, message_count, state[1]
+        )
+        self.stats["built"] += 1
+        return result
+
+    async def _refresh_chat(self, chat_id, limit):
+        async with limit:
+            for hours in self.windows:
+                digest = await self.db.get_digest(chat_id, digest_kind(hours))
+                state = await self.db.get_chat_state(chat_id)
+                if digest is not None and state is not None and self._is_fresh(digest, state):
+                    self.stats["still_fresh"] += 1
+                    continue
+                try:
+                    await self._refresh(chat_id, hours)
+                except SummarizerBusy:
+                    self.stats["busy_skips"] += 1
+                    return
+
+    async def active_chats(self):
+        """Chats with messages inside the longest configured window"""
+        hours = max([24] + [hours for hours in self.windows if hours])
+        chats = await self.db.get_active_chats(hours_ago_ts(hours))
+        if self.owns is not None:
+            chats = [chat_id for chat_id in chats if self.owns(chat_id)]
+        return chats
+
+    async def run(self, force=False):
+        """Refresh the stale digests of every active chat; outside off-peak hours only if forced"""
+        if not force and not self.in_offpeak():
+            return 0
+        start = time.perf_counter()
+        chats = await self.active_chats()
+        # The summarizer pool bounds real parallelism; this only keeps its queue short
+        limit = asyncio.Semaphore(self.concurrency)
+        built_before = self.stats["built"]
+        await asyncio.gather(*(self._refresh_chat(chat_id, limit) for chat_id in chats))
+        built = self.stats["built"] - built_before
+        self.stats["runs"] += 1
+        self.stats["last_run_chats"] = len(chats)
+        self.stats["last_run_seconds"] = round(time.perf_counter() - start, 3)
+        if built:
+            logger.info(f"🗞️ Precomputed {built} digests for {len(chats)} active chats "
+                        f"in {self.stats['last_run_seconds']}s")
+        return built
+
+    def get_stats(self):
+        return dict(self.stats)
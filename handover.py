@@ -0,0 +1,188 @@
+"""
+Handover between the running bot instance and its replacement on the same
+machine, so a deploy neither drops nor repeats updates.
+
+Only the instance holding the lease, an exclusive lock on HANDOVER_LOCK,
+takes updates from Telegram. A new instance first does everything slow:
+imports, opening the database, starting and warming the summarizer pool,
+loading the hot tier, getMe. Only then does it ask for the lease. If another
+instance holds it, the newcomer connects to the holder's unix socket
+(HANDOVER_LOCK + ".sock") and asks it to step down. The holder turns
+not-ready, stops polling (confirming the offset of every update it fetched),
+finishes the updates it has, sends its queued replies, flushes the ingest
+queue, closes its HTTP server and releases the lock. The newcomer then loads
+what was stored in the meantime into its hot tier and polls from where the
+holder stopped, so pending updates are kept rather than dropped.
+
+The kernel releases the lock of a process that dies, so after a crash the
+next instance starts at once. Instances on other machines do not see the
+lease; for those, Telegram still answers the second poller with Conflict.
+
+Startup phases are timed by `startup` and reported under "startup" in
+/health, as bot_startup_seconds in /metrics and in the log.
+"""
+import asyncio
+import contextlib
+import fcntl
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+REQUEST = b"handover\n"
+ACCEPTED = b"ok\n"
+
+class StartupClock:
+    """Seconds spent in each startup phase, from process start until ready"""
+    def __init__(self):
+        self.started = time.monotonic()
+        self._last = self.started
+        self.phases = {}
+        self.ready_after = None
+
+    def mark(self, phase):
+        """End `phase`: it took the time since the previous mark (or process start)"""
+        now = time.monotonic()
+        self.phases[phase] = round(now - self._last, 3)
+        self._last = now
+
+    def ready(self):
+        """Mark startup complete and log where the time went"""
+        self.ready_after = round(time.monotonic() - self.started, 3)
+        breakdown = ", ".join(f"{phase} {seconds:.2f}s" for phase, seconds in self.phases.items())
+        logger.info(f"⏱️ Ready {self.ready_after:.2f}s after start ({breakdown})")
+
+    def get_stats(self):
+        return {"phases": dict(self.phases), "ready_after": self.ready_after}
+
+startup = StartupClock()
+
+class Lease:
+    """
+    Exclusive lock file marking the instance that takes updates, plus the unix
+    socket on which its holder accepts a request to hand over.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.socket_path = path + ".sock"
+        self._fd = None
+        self._server = None
+        self._requested = False
+        self.stats = {
+            "held": False,
+            "waited_seconds": 0.0,
+            "took_over": False,
+            "handover_requested": False,
+        }
+
+    def _try_lock(self):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+    async def _ask_holder(self, timeout):
+        """Ask the holder to step down; False while its socket is not up yet"""
+        try:
+            reader, writer = await asyncio.wait_for(asyncio.open_unix_connection(self.socket_path), timeout)
+        except (OSError, asyncio.TimeoutError):
+            return False
+        try:
+            writer.write(REQUEST)
+            await writer.drain()
+            return await asyncio.wait_for(reader.readline(), timeout) == ACCEPTED
+        except (OSError, asyncio.TimeoutError):
+            return False
+        finally:
+            writer.close()
+
+    async def acquire(self, timeout=60.0):
+        """Take the lease, asking the current holder to hand it over. Blocks until
+        it is ours, warning every `timeout` seconds while the holder keeps it."""
+        start = time.monotonic()
+        if self._try_lock():
+            logger.info("🔒 Lease taken, no other instance running")
+        else:
+            logger.info("🤝 Another instance holds the lease, asking it to hand over...")
+            asked = False
+            warned = start
+            while not self._try_lock():
+                if not asked:
+                    asked = await self._ask_holder(timeout)
+                if time.monotonic() - warned > timeout:
+                    logger.warning(f"⚠️ Still waiting for the lease on {self.path} (holder: {self.holder()})")
+                    warned = time.monotonic()
+                await asyncio.sleep(0.05 if asked else 0.5)
+            self.stats["took_over"] = True
+            logger.info(f"🔒 Lease handed over after {time.monotonic() - start:.2f}s")
+        self.stats["held"] = True
+        self.stats["waited_seconds"] = round(time.monotonic() - start, 3)
+        return self
+
+    def holder(self):
+        """Pid written by the holder, if readable"""
+        try:
+            with open(self.path) as f:
+                return int(f.read().strip() or 0) or None
+        except (OSError, ValueError):
+            return None
+
+    async def serve(self, on_request):
+        """Accept handover requests on the lease socket; `on_request()` is called once,
+        on the event loop, after the requester was told its request was accepted"""
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)  # Left by a holder that died; we hold the lock now
+
+        async def handle(reader, writer):
+            try:
+                request = await asyncio.wait_for(reader.readline(), 5)
+                if request != REQUEST:
+                    return
+                writer.write(ACCEPTED)
+                await writer.drain()
+            except (OSError, asyncio.TimeoutError):
+                return
+            finally:
+                writer.close()
+            if not self._requested:
+                self._requested = True
+                self.stats["handover_requested"] = True
+                logger.info("🤝 Handover requested by a new instance, stepping down...")
+                on_request()
+
+        self._server = await asyncio.start_unix_server(handle, path=self.socket_path)
+
+    async def close_server(self):
+        """Stop taking handover requests; must run on the loop that serves them"""
+        if self._server is None:
+            return
+        server, self._server = self._server, None
+        server.close()
+        await server.wait_closed()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(self.socket_path)
+
+    def release(self):
+        """Free the lock for the next instance; safe off the event loop once
+        close_server() has run"""
+        if self._server is not None:
+            # The loop ended without close_server(): its server is gone with it
+            self._server = None
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(self.socket_path)
+        if self._fd is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+            os.close(self._fd)
+            self._fd = None
+            self.stats["held"] = False
+            logger.info("🔓 Lease released")
+
+    def get_stats(self):
+        return dict(self.stats)
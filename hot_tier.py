@@ -0,0 +1,168 @@
+import logging
+import time
+from collections import OrderedDict, deque
+
+from timeutils import hours_ago_ts
+
+logger = logging.getLogger(__name__)
+
+def format_timestamp(ts):
+    """Same text SQLite stores in messages.timestamp (datetime(ts, 'unixepoch'))"""
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(ts))
+
+class _ChatBuffer:
+    """Recent messages of one chat, oldest first, and the time from which the buffer is complete"""
+    __slots__ = ("entries", "covered_from", "ids")
+
+    def __init__(self, max_messages, covered_from):
+        self.entries = deque(maxlen=max_messages)  # (ts, message tuple, Telegram message id)
+        self.covered_from = covered_from
+        self.ids = set()  # Telegram message ids in entries, to skip redelivered messages
+
+    def extend(self, rows):
+        self.entries.extend(rows)
+        self.ids.update(message_id for _, _, message_id in rows if message_id is not None)
+
+class HotTier:
+    """
+    Bounded in-memory ring buffer of each chat's most recent messages.
+    It is filled on ingest (before the write-behind flush) and warmed from the
+    database at startup. Like ingest, it skips a Telegram message id the chat's
+    buffer already holds, so redelivered updates are not counted twice. Each buffer knows the time from which it holds every
+    message of the chat, so a window starting after that is served from memory
+    and only the older part of a longer window has to come from SQLite.
+    Total size is capped; the least recently active chats are dropped first.
+    """
+    def __init__(self, max_per_chat=2000, max_messages=200000):
+        self.max_per_chat = max_per_chat
+        self.max_messages = max_messages
+        self._chats = OrderedDict()
+        self._size = 0
+        # Chats with no buffer are complete from here unless they were evicted
+        self._complete_since = None
+        self._evicted = set()
+        self.last_id = 0
+        self.stats = {"hits": 0, "partial": 0, "misses": 0, "evictions": 0, "duplicates": 0}
+
+    def _buffer_for(self, chat_id, ts):
+        buffer = self._chats.get(chat_id)
+        if buffer is None:
+            if self._complete_since is not None and chat_id not in self._evicted:
+                covered_from = self._complete_since
+            else:
+                covered_from = ts
+            buffer = self._chats[chat_id] = _ChatBuffer(self.max_per_chat, covered_from)
+        self._chats.move_to_end(chat_id)
+        return buffer
+
+    def _append(self, buffer, ts, message, message_id=None):
+        entries = buffer.entries
+        if ts < buffer.covered_from:
+            return  # Older than what the buffer vouches for; SQLite serves that range
+        if message_id is not None and message_id in buffer.ids:
+            self.stats["duplicates"] += 1
+            return
+        if len(entries) == entries.maxlen:
+            # The ring drops its oldest entry: everything at that second may now be incomplete
+            oldest_ts, _, oldest_id = entries.popleft()
+            buffer.ids.discard(oldest_id)
+            buffer.covered_from = max(buffer.covered_from, oldest_ts + 1)
+            self._size -= 1
+            if ts < buffer.covered_from:
+                return
+        if entries and ts < entries[-1][0]:
+            # Late arrival: keep the buffer ordered by ts
+            index = len(entries)
+            while index > 0 and entries[index - 1][0] > ts:
+                index -= 1
+            entries.insert(index, (ts, message, message_id))
+        else:
+            entries.append((ts, message, message_id))
+        if message_id is not None:
+            buffer.ids.add(message_id)
+        self._size += 1
+
+    def _evict(self):
+        while self._size > self.max_messages and len(self._chats) > 1:
+            chat_id, buffer = self._chats.popitem(last=False)
+            self._size -= len(buffer.entries)
+            self._evicted.add(chat_id)
+            self.stats["evictions"] += 1
+
+    def put(self, chat_id, user_name, username, message_text, ts, message_id=None):
+        """Record a message as it is ingested; message_id is Telegram's, used to skip duplicates"""
+        buffer = self._buffer_for(chat_id, ts)
+        self._append(buffer, ts, (user_name, message_text, format_timestamp(ts), username), message_id)
+        self._evict()
+
+    def warm(self, db, hours, owns=None):
+        """Load the last `hours` hours of every active chat from a (sync) MessageDB.
+        With `owns`, only chats it accepts are loaded; the rest start cold."""
+        since = hours_ago_ts(hours)
+        self._complete_since = since
+        # Rows stored after this id are left to catch_up(), so none is loaded twice
+        self.last_id = db.last_message_id()
+        loaded = 0
+        for chat_id in db.get_active_chats(since):
+            if owns is not None and not owns(chat_id):
+                self._evicted.add(chat_id)
+                continue
+            if self._size >= self.max_messages:
+                # No room left: these chats start cold, like evicted ones
+                self._evicted.add(chat_id)
+                continue
+            rows = db.get_recent_rows(chat_id, since, self.max_per_chat, max_id=self.last_id)
+            buffer = _ChatBuffer(self.max_per_chat, since)
+            if len(rows) == self.max_per_chat:
+                # Truncated: complete only after the oldest loaded second
+                buffer.covered_from = rows[0][0] + 1
+            buffer.extend(rows)
+            self._chats[chat_id] = buffer
+            self._chats.move_to_end(chat_id, last=False)  # Most active chats were loaded first
+            self._size += len(rows)
+            loaded += len(rows)
+        self._evict()
+        logger.info(f"🔥 Hot tier warmed with {loaded} messages from {len(self._chats)} chats")
+
+    def catch_up(self, db, owns=None):
+        """Add what other processes stored since warm() (e.g. the instance this one
+        takes over from), before this process ingests anything itself"""
+        added = 0
+        for row_id, chat_id, ts, message, message_id in db.get_rows_after(self.last_id):
+            self.last_id = row_id
+            if owns is not None and not owns(chat_id):
+                continue
+            self._append(self._buffer_for(chat_id, ts), ts, message, message_id)
+            added += 1
+        self._evict()
+        if added:
+            logger.info(f"🔥 Hot tier caught up with {added} messages stored since warm-up")
+        return added
+
+    def split(self, chat_id, start, end):
+        """Messages of [start, end) held in memory and the time before which the
+        caller must still read SQLite (db_end <= start means nothing is needed)"""
+        buffer = self._chats.get(chat_id)
+        if buffer is None:
+            if self._complete_since is not None and chat_id not in self._evicted \
+                    and start >= self._complete_since:
+                self.stats["hits"] += 1
+                return [], start
+            self.stats["misses"] += 1
+            return [], end
+        self._chats.move_to_end(chat_id)
+        db_end = min(end, max(start, buffer.covered_from))
+        messages = [message for ts, message, _ in buffer.entries if db_end <= ts < end]
+        if db_end <= start:
+            self.stats["hits"] += 1
+        elif db_end < end:
+            self.stats["partial"] += 1
+        else:
+            self.stats["misses"] += 1
+        return messages, db_end
+
+    def get_stats(self):
+        snapshot = dict(self.stats)
+        snapshot["chats"] = len(self._chats)
+        snapshot["messages"] = self._size
+        return snapshot
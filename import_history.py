@@ -0,0 +1,218 @@
+"""
+Backfill messages.db from Telegram Desktop chat exports (result.json).
+
+    python import_history.py result.json [--db messages.db] [--chat-id -1001234567890]
+
+Works for a single-chat export and for a full account export (every chat in
+it is imported). The file is parsed as a stream, one message object at a
+time, so memory stays flat however big the export is. Rows go through
+MessageDB.add_messages in large batches; (chat_id, Telegram message id)
+dedupes against what the bot already stored, and every batch records how far
+it got so an interrupted import resumes where it stopped.
+
+The query indexes are dropped for the load and rebuilt once at the end
+(--keep-indexes to skip that when the bot is running on the same database).
+"""
+import argparse
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+from config import MESSAGE_CODEC
+from database import MessageDB
+
+logger = logging.getLogger(__name__)
+
+READ_SIZE = 1 << 20
+BATCH_SIZE = 20000
+# Header fields that precede each chat's "messages" array
+HEADER_RE = {
+    "name": re.compile(r'"name"\s*:\s*("(?:[^"\\]|\\.)*"|null)'),
+    "type": re.compile(r'"type"\s*:\s*"([^"]*)"'),
+    "id": re.compile(r'"id"\s*:\s*(-?\d+)'),
+}
+MESSAGES_RE = re.compile(r'"messages"\s*:\s*\[')
+SEPARATOR_RE = re.compile(r'[\s,]*')
+GROUP_TYPES = ("private_group",)
+SUPERGROUP_TYPES = ("private_supergroup", "public_supergroup", "private_channel", "public_channel")
+
+class ExportStream:
+    """Incremental reader over an export: chat headers and message objects, decoded one at a time"""
+    def __init__(self, path):
+        self.file = open(path, encoding="utf-8")
+        self.buffer = ""
+        self.pos = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self):
+        """Append the next chunk, dropping what has been consumed. False at end of file."""
+        if self.eof:
+            return False
+        chunk = self.file.read(READ_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        self.buffer = self.buffer[self.pos:] + chunk
+        self.pos = 0
+        return True
+
+    def next_chat(self):
+        """Header fields ({name, type, id}) of the next chat with a messages array, or None"""
+        while True:
+            match = MESSAGES_RE.search(self.buffer, self.pos)
+            if match:
+                header = {}
+                # The chat's own fields are the last ones before its messages array
+                segment = self.buffer[self.pos:match.start()]
+                for key, pattern in HEADER_RE.items():
+                    found = pattern.findall(segment)
+                    if found:
+                        header[key] = json.loads(found[-1]) if key == "name" else found[-1]
+                self.pos = match.end()
+                return header
+            # Keep a tail so a header split across chunks is still seen whole
+            keep = max(self.pos, len(self.buffer) - 4096)
+            self.pos = keep
+            if not self._fill():
+                return None
+
+    def messages(self):
+        """Yield the objects of the current messages array"""
+        while True:
+            self.pos = SEPARATOR_RE.match(self.buffer, self.pos).end()
+            if self.pos == len(self.buffer):
+                if not self._fill():
+                    raise ValueError("Export ended inside a messages array")
+                continue
+            if self.buffer[self.pos] == "]":
+                self.pos += 1
+                return
+            try:
+                obj, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                # Object cut off by the chunk boundary: read more and retry
+                if not self._fill():
+                    raise
+                continue
+            self.pos = end
+            yield obj
+
+    def close(self):
+        self.file.close()
+
+def bot_api_chat_id(header):
+    """Chat id as the Bot API (and so the bot) sees it"""
+    raw = int(header["id"])
+    chat_type = header.get("type", "")
+    if chat_type in SUPERGROUP_TYPES:
+        return int(f"-100{abs(raw)}")
+    if chat_type in GROUP_TYPES:
+        return -abs(raw)
+    return raw
+
+def message_text(message):
+    """Plain text of an export message ("text" is a string or a list of strings and entities)"""
+    text = message.get("text", "")
+    if isinstance(text, list):
+        text = "".join(part if isinstance(part, str) else part.get("text", "") for part in text)
+    return text
+
+def message_ts(message):
+    if "date_unixtime" in message:
+        return int(message["date_unixtime"])
+    return int(datetime.fromisoformat(message["date"]).timestamp())
+
+def sender_id(message):
+    """Numeric user id from "user123456"; None for channels and anonymous admins"""
+    from_id = message.get("from_id") or ""
+    return int(from_id[4:]) if from_id.startswith("user") and from_id[4:].isdigit() else None
+
+def to_row(chat_id, message):
+    """add_messages row for an export message, or None for service and non-text messages"""
+    if message.get("type") != "message":
+        return None
+    text = message_text(message)
+    # Commands are not stored by the bot either
+    if not text or text.startswith("/"):
+        return None
+    return (chat_id, sender_id(message), message.get("from") or "Unknown", None,
+            text, message_ts(message), message["id"])
+
+def import_chat(db, stream, source, chat_id, batch_size):
+    """Import one chat's messages, resuming after the last committed batch"""
+    resume_after, imported_before = db.get_import_progress(source, chat_id)
+    if resume_after:
+        logger.info(f"↩️ Chat {chat_id}: resuming after message {resume_after} ({imported_before} imported)")
+    batch = []
+    last_id = resume_after
+    imported = skipped = 0
+    for message in stream.messages():
+        if message.get("id", 0) <= resume_after:
+            continue
+        last_id = max(last_id, message.get("id", 0))
+        row = to_row(chat_id, message)
+        if row is None:
+            skipped += 1
+            continue
+        batch.append(row)
+        if len(batch) >= batch_size:
+            imported += db.add_messages(batch, progress=(source, chat_id, last_id))
+            batch = []
+    if batch or last_id > resume_after:
+        # Also records a trailing run of service messages, so a rerun skips past them
+        imported += db.add_messages(batch, progress=(source, chat_id, last_id))
+    return imported, skipped
+
+def run_import(path, db_path, chat_id=None, batch_size=BATCH_SIZE, keep_indexes=False):
+    db = MessageDB(db_path, message_codec=MESSAGE_CODEC or None)
+    source = os.path.abspath(path)
+    conn = db.conn
+    synchronous = conn.execute("PRAGMA synchronous").fetchone()[0]
+    # A crash mid-import is recovered by resuming, so durability of each batch can wait
+    conn.execute("PRAGMA synchronous = OFF")
+    conn.execute("PRAGMA cache_size = -262144")
+    if not keep_indexes:
+        db.drop_message_indexes()
+
+    stream = ExportStream(path)
+    start = time.perf_counter()
+    total = 0
+    try:
+        while True:
+            header = stream.next_chat()
+            if header is None:
+                break
+            target = chat_id if chat_id is not None else bot_api_chat_id(header)
+            imported, skipped = import_chat(db, stream, source, target, batch_size)
+            total += imported
+            logger.info(f"📥 {header.get('name') or target} ({target}): {imported} new messages, "
+                        f"{skipped} service/media messages skipped")
+    finally:
+        stream.close()
+        if not keep_indexes:
+            logger.info("🔧 Rebuilding indexes...")
+            db.create_message_indexes()
+        conn.execute(f"PRAGMA synchronous = {synchronous}")
+        db.close()
+
+    elapsed = time.perf_counter() - start
+    logger.info(f"✅ Imported {total} messages in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.0f}/s)")
+    return total
+
+def main():
+    logging.basicConfig(format='%(asctime)s - %(levelname)s - %(message)s', level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("export", help="path to result.json")
+    parser.add_argument("--db", default="messages.db")
+    parser.add_argument("--chat-id", type=int, help="store every message under this chat id")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--keep-indexes", action="store_true", help="do not drop indexes during the load")
+    args = parser.parse_args()
+    run_import(args.export, args.db, args.chat_id, args.batch_size, args.keep_indexes)
+
+if __name__ == "__main__":
+    main()
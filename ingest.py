@@ -0,0 +1,165 @@
+import logging
+import threading
+import time
+
+from metrics import DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+class IngestQueue:
+    """
+    Write-behind buffer in front of MessageDB.add_messages.
+    Messages are held in memory and written with a single executemany/commit
+    once batch_size messages are waiting or flush_interval seconds have passed.
+    At most max_pending messages are held: put() never writes in the caller, it
+    refuses (and counts) messages while the queue is full, so a stalled database
+    cannot block the event loop or grow memory without bound.
+    """
+    def __init__(self, db, batch_size=200, flush_interval=1.0, max_pending=10000):
+        self.db = db
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+
+        self._pending = []
+        self._cond = threading.Condition()
+        self._flush_lock = threading.RLock()
+        self._closed = False
+        self._thread = None
+
+        self.stats = {
+            "queued": 0,
+            "flushed": 0,
+            "batches": 0,
+            "failed_flushes": 0,
+            "dropped": 0,
+            "last_batch_size": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "max_depth": 0,
+        }
+
+    def start(self):
+        """Start the background flusher thread"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="ingest-flusher", daemon=True)
+            self._thread.start()
+            logger.info(f"📥 Ingest queue started (batch={self.batch_size}, interval={self.flush_interval}s)")
+        return self
+
+    def put(self, chat_id, user_id, user_name, username, message_text, ts=None, message_id=None):
+        """Queue a message. Returns True once it is guaranteed to be flushed, or False
+        if the queue is full and the message was dropped.
+        ts is when the message was sent (epoch seconds), not when it gets written;
+        message_id is Telegram's id, used to skip duplicates."""
+        if ts is None:
+            ts = int(time.time())
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Ingest queue is closed")
+            depth = len(self._pending)
+            if depth >= self.max_pending:
+                self._count_dropped(1)
+                return False
+            self._pending.append((chat_id, user_id, user_name, username, message_text, ts, message_id))
+            self.stats["queued"] += 1
+            depth += 1
+            if depth > self.stats["max_depth"]:
+                self.stats["max_depth"] = depth
+            if depth >= self.batch_size:
+                self._cond.notify()
+        return True
+
+    def _count_dropped(self, count):
+        """Record messages lost to a full queue; logs the first and then every 1000th"""
+        before = self.stats["dropped"]
+        self.stats["dropped"] += count
+        if before == 0 or before // 1000 != self.stats["dropped"] // 1000:
+            logger.warning(
+                f"⚠️ Ingest queue full ({self.max_pending} pending), "
+                f"{self.stats['dropped']} messages dropped so far"
+            )
+
+    def depth(self):
+        """Number of messages waiting to be written"""
+        with self._cond:
+            return len(self._pending)
+
+    def flush(self):
+        """Write everything pending in one transaction. Returns number of rows written."""
+        with self._flush_lock:
+            with self._cond:
+                batch = self._pending
+                self._pending = []
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self.db.add_messages(batch)
+            except Exception as e:
+                # Put the batch back in front so nothing acknowledged is lost, up to
+                # max_pending: beyond that the newest messages are dropped
+                with self._cond:
+                    pending = batch + self._pending
+                    if len(pending) > self.max_pending:
+                        self._count_dropped(len(pending) - self.max_pending)
+                        pending = pending[:self.max_pending]
+                    self._pending = pending
+                self.stats["failed_flushes"] += 1
+                logger.error(f"❌ Ingest flush of {len(batch)} messages failed, will retry: {e}")
+                return 0
+
+            elapsed = time.perf_counter() - start
+            DB_SECONDS.observe("add_messages", elapsed)
+            elapsed_ms = elapsed * 1000
+            self.stats["flushed"] += len(batch)
+            self.stats["batches"] += 1
+            self.stats["last_batch_size"] = len(batch)
+            self.stats["last_flush_ms"] = round(elapsed_ms, 2)
+            self.stats["max_flush_ms"] = round(max(self.stats["max_flush_ms"], elapsed_ms), 2)
+            logger.debug(f"💾 Flushed {len(batch)} messages in {elapsed_ms:.1f}ms")
+            return len(batch)
+
+    def _run(self):
+        """Flusher loop: wake on size threshold or interval"""
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.batch_size:
+                    self._cond.wait(self.flush_interval)
+                closed = self._closed
+            written = self.flush()
+            if closed:
+                return
+            if not written and self.depth():
+                # Back off after a failed flush instead of spinning
+                time.sleep(self.flush_interval)
+
+    def close(self, timeout=10.0):
+        """Stop accepting messages and drain everything that is still pending"""
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+        # Final synchronous drain in case the flusher failed or never started
+        for _ in range(3):
+            if not self.depth():
+                break
+            self.flush()
+
+        remaining = self.depth()
+        if remaining:
+            logger.error(f"❌ Ingest queue closed with {remaining} unsaved messages")
+        else:
+            logger.info(f"📥 Ingest queue drained ({self.stats['flushed']} messages written)")
+
+    def get_stats(self):
+        """Snapshot of flush latency and queue depth for health checks"""
+        snapshot = dict(self.stats)
+        snapshot["depth"] = self.depth()
+        return snapshot
@@ -1,58 +1,142 @@
-from flask import Flask, jsonify
-from threading import Thread
-from datetime import datetime
-import logging
-
-# Suppress Flask's default logging to reduce noise
-log = logging.getLogger('werkzeug')
-log.setLevel(logging.WARNING)
-
-app = Flask('')
-
-# Track bot status
-bot_status = {
-    "started_at": datetime.now().isoformat(),
-    "is_running": True,
-    "last_ping": None
-}
-
-@app.route('/')
-def home():
-    """Main endpoint - UptimeRobot should ping this"""
-    bot_status["last_ping"] = datetime.now().isoformat()
-    return "✅ Telegram Summarizer Bot is running!"
-
-@app.route('/health')
-def health():
-    """Health check endpoint for monitoring"""
-    bot_status["last_ping"] = datetime.now().isoformat()
-    return jsonify({
-        "status": "healthy",
-        "bot_running": bot_status["is_running"],
-        "started_at": bot_status["started_at"],
-        "last_ping": bot_status["last_ping"]
-    }), 200
-
-@app.route('/ping')
-def ping():
-    """Simple ping endpoint for UptimeRobot"""
-    bot_status["last_ping"] = datetime.now().isoformat()
-    return "pong", 200
-
-def run():
-    """Run Flask server"""
-    try:
-        app.run(host='0.0.0.0', port=8080, threaded=True)
-    except Exception as e:
-        logging.error(f"❌ Flask server error: {e}")
-
-def keep_alive():
-    """Start Flask server in a daemon thread"""
-    t = Thread(target=run, daemon=True)
-    t.start()
-    logging.info("🌐 Keep-alive server started on port 8080")
-    return t
-
-def set_bot_status(running: bool):
-    """Update bot status for health checks"""
-    bot_status["is_running"] = running
+from flask import Flask, Response, jsonify
+from werkzeug.serving import make_server
+from threading import Thread
+from datetime import datetime
+import logging
+
+import metrics
+from config import LIVENESS_MAX_STALL
+
+# Suppress Flask's default logging to reduce noise
+log = logging.getLogger('werkzeug')
+log.setLevel(logging.WARNING)
+
+app = Flask('')
+
+# Track bot status
+bot_status = {
+    "started_at": datetime.now().isoformat(),
+    "is_running": True,
+    "last_ping": None,
+    # "starting" until updates are taken, "ready", then "stopping" on shutdown or handover
+    "readiness": "starting"
+}
+
+# Extra sections for /health, e.g. ingest queue depth and flush latency
+health_providers = {}
+
+HOME_TEXT = "✅ Telegram Summarizer Bot is running!"
+
+def mark_ping():
+    bot_status["last_ping"] = datetime.now().isoformat()
+
+def health_payload():
+    """Body of /health (also served by the webhook server)"""
+    payload = {
+        "status": "healthy",
+        "bot_running": bot_status["is_running"],
+        "started_at": bot_status["started_at"],
+        "last_ping": bot_status["last_ping"],
+        "readiness": bot_status["readiness"]
+    }
+    for name, provider in health_providers.items():
+        try:
+            payload[name] = provider()
+        except Exception as e:
+            payload[name] = {"error": str(e)}
+            continue
+        # A section can mark the whole process degraded (e.g. a worker down in multi-worker mode)
+        if isinstance(payload[name], dict) and payload[name].get("degraded"):
+            payload["status"] = "degraded"
+    return payload
+
+def readiness_payload():
+    """Body and status code of /ready: 200 only while this instance takes updates"""
+    ready = bot_status["readiness"] == "ready"
+    return {"ready": ready, "state": bot_status["readiness"]}, 200 if ready else 503
+
+def liveness_payload():
+    """Body and status code of /live: 503 once the event loop has stalled (restart me)"""
+    stalled = metrics.loop_stalled_for()
+    alive = stalled is None or stalled < LIVENESS_MAX_STALL
+    return {"alive": alive, "loop_stalled_seconds": None if stalled is None else round(stalled, 3)}, \
+        200 if alive else 503
+
+@app.route('/')
+def home():
+    """Main endpoint - UptimeRobot should ping this"""
+    mark_ping()
+    return HOME_TEXT
+
+@app.route('/health')
+def health():
+    """Health check endpoint for monitoring"""
+    mark_ping()
+    return jsonify(health_payload()), 200
+
+@app.route('/ready')
+def ready():
+    """Readiness probe: whether this instance is the one taking updates"""
+    body, status = readiness_payload()
+    return jsonify(body), status
+
+@app.route('/live')
+def live():
+    """Liveness probe: whether the process still makes progress"""
+    body, status = liveness_payload()
+    return jsonify(body), status
+
+@app.route('/metrics')
+def metrics_endpoint():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+@app.route('/ping')
+def ping():
+    """Simple ping endpoint for UptimeRobot"""
+    mark_ping()
+    return "pong", 200
+
+# The running server, so a handover can free the port before the next instance binds it
+_server = None
+
+def run(server):
+    """Run Flask server"""
+    try:
+        server.serve_forever(poll_interval=0.1)
+    except Exception as e:
+        logging.error(f"❌ Flask server error: {e}")
+
+def keep_alive(port=8080):
+    """Start Flask server in a daemon thread (polling mode; webhook mode serves these routes itself)"""
+    global _server
+    try:
+        _server = make_server('0.0.0.0', port, app, threaded=True)
+    except (OSError, SystemExit) as e:
+        # werkzeug exits instead of raising when the port is taken
+        logging.error(f"❌ Flask server error: cannot listen on port {port} ({e})")
+        return None
+    t = Thread(target=run, args=(_server,), daemon=True)
+    t.start()
+    logging.info(f"🌐 Keep-alive server started on port {port}")
+    return t
+
+def stop_keep_alive():
+    """Stop the Flask server and close its port"""
+    global _server
+    if _server is not None:
+        _server.shutdown()
+        _server.server_close()
+        _server = None
+
+def set_bot_status(running: bool):
+    """Update bot status for health checks"""
+    bot_status["is_running"] = running
+
+def set_readiness(state):
+    """"starting", "ready" or "stopping", as reported by /ready"""
+    bot_status["readiness"] = state
+
+def register_health_provider(name, provider):
+    """Add a callable whose result is reported under `name` in /health"""
+    health_providers[name] = provider
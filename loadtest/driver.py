@@ -0,0 +1,410 @@
+"""
+End-to-end load test: the real bot.py against the fake Bot API.
+
+    python loadtest/driver.py [--chats 2000] [--rate 200] [--duration 60]
+                              [--command-share 0.02] [--mode polling|webhook]
+                              [--history 100000] [--out loadtest-results.json]
+
+The driver starts the fake API (loadtest/fake_api.py) in-process and launches
+bot.py as a subprocess in a scratch directory. The bot gets its own
+messages.db there, optionally seeded with --history generated messages so
+commands summarize real windows. Once the bot has finished post_init, the
+driver replays about --rate updates per second (Poisson arrivals) across
+--chats synthetic group chats for --duration seconds. Chat and user activity
+is Zipf-like, from benchmarks/synthetic.py. A --command-share of the updates
+are commands, split by --command-mix; the rest are plain messages.
+
+Reported as a table and as JSON:
+- update-to-reply latency percentiles per command, from the update being
+  queued at the fake API until the sendMessage replying to it arrives
+- commands with no reply within --drain seconds after the run, and replies
+  that were the "busy" text of a shed request. Identical replies still
+  queued for a chat are sent once (outbound "coalesced"), so a few
+  unanswered commands are expected under bursts
+- ingest lag: how long after being queued a plain message was written. It is
+  read from the bot's bot_ingest_messages_total counter every
+  --sample-interval; the ingest queue writes in arrival order
+- the bot's handler errors, outbound queue counters and event loop lag, read
+  from its /metrics and /health (summed over the workers with WORKERS=N)
+- sendMessage calls the fake failed on purpose (--flood-rate, --error-rate)
+
+Bot settings are varied through the environment as usual, e.g.
+CONCURRENT_UPDATES=16 python loadtest/driver.py ...
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import secrets
+import signal
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, timedelta
+
+import aiohttp
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+from database import MessageDB
+from fake_api import FakeBotAPI
+from synthetic import ChatGenerator, TOPICS
+
+BUSY_PREFIX = "⏳ I'm busy"
+# Live message ids start here so they never collide with the seeded history
+LIVE_MESSAGE_ID = 10_000_000
+METRIC_LINE = re.compile(r"^([a-zA-Z_:][\w:]*)(\{[^}]*\})?\s+(\S+)$")
+
+def percentiles(values):
+    """Summary in milliseconds of a list of seconds"""
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(len(values) * q))]
+    return {
+        "count": len(values),
+        "p50_ms": round(statistics.median(values) * 1000, 1),
+        "p90_ms": round(pick(0.90) * 1000, 1),
+        "p99_ms": round(pick(0.99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1),
+    }
+
+def parse_metrics(text):
+    """Prometheus text format -> {series: value}, series being name{labels}"""
+    series = {}
+    for line in text.splitlines():
+        match = METRIC_LINE.match(line)
+        if match:
+            series[match.group(1) + (match.group(2) or "")] = float(match.group(3))
+    return series
+
+def metric_values(metrics, name):
+    """Values of every series of `name` (one per worker in multi-worker mode)"""
+    return [value for series, value in metrics.items() if series.split("{", 1)[0] == name]
+
+def merge_health(health, name):
+    """The `name` section of /health; in multi-worker mode the workers' sections combined
+    (maximum for latencies and high-water marks, sum for everything else)"""
+    if name in health:
+        return health[name]
+    per_worker = (health.get("workers") or {}).get("per_worker", {})
+    merged = {}
+    for worker in per_worker.values():
+        for key, value in ((worker.get("health") or {}).get(name) or {}).items():
+            if not isinstance(value, (int, float)) or isinstance(value, bool):
+                continue
+            if key.endswith("_ms") or key.startswith("max"):
+                merged[key] = max(merged.get(key, value), value)
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+def parse_mix(text):
+    """"catchup=4,who=2" -> ([commands], [weights])"""
+    mix = dict(part.split("=") for part in text.split(",") if part)
+    return list(mix), [float(weight) for weight in mix.values()]
+
+def seed_history(path, rows, generator_args):
+    """Write `rows` messages of the last day to the bot's database before it starts"""
+    db = MessageDB(path)
+    generator = ChatGenerator(days=1, **{**generator_args, "seed": generator_args["seed"] + 1})
+    for batch in generator.batches(rows):
+        db.add_messages(batch)
+    db.close()
+
+class LoadDriver:
+    """Runs one load test; see the module docstring"""
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.commands, self.command_weights = parse_mix(args.command_mix)
+        self.api = FakeBotAPI(
+            latency=args.api_latency_ms / 1000,
+            flood_rate=args.flood_rate,
+            error_rate=args.error_rate,
+            seed=args.seed,
+            on_reply=self.on_reply
+        )
+        self.workdir = args.workdir or tempfile.mkdtemp(prefix="summarizer-loadtest-")
+        self.bot_url = f"http://127.0.0.1:{args.bot_port}"
+        self.process = None
+        self.session = None
+        self.pending = {}  # (chat_id, message_id) -> (command, queued_at)
+        self.latencies = defaultdict(list)
+        self.plain_queued_at = []  # Queue time of each plain message, in order
+        self.ingest_lags = []
+        self.ingest_seen = 0
+        self.max_ingest_depth = 0
+        self.counts = defaultdict(int)
+        self.startup_seconds = None
+
+    def on_reply(self, chat_id, reply_to, text):
+        entry = self.pending.pop((chat_id, reply_to), None)
+        if entry is None:
+            self.counts["unsolicited_replies"] += 1
+            return
+        command, queued_at = entry
+        if text.startswith(BUSY_PREFIX):
+            self.counts["busy_replies"] += 1
+        self.latencies[command].append(time.monotonic() - queued_at)
+
+    def command_text(self, user):
+        command = self.rng.choices(self.commands, weights=self.command_weights)[0]
+        if command == "catchup":
+            return command, self.rng.choice(("/catchup", "/catchup 6", "/catchup about deploy"))
+        if command == "person":
+            return command, f"/person User{user}"
+        if command == "search":
+            return command, f"/search {self.rng.choice(list(TOPICS))}"
+        if command == "day":
+            return command, f"/day {date.today() - timedelta(days=1)}"
+        return command, f"/{command}"
+
+    async def launch_bot(self):
+        args = self.args
+        os.makedirs(self.workdir, exist_ok=True)
+        db_path = os.path.join(self.workdir, "messages.db")
+        if args.history and not os.path.exists(db_path):
+            print(f"seeding {args.history} messages into {db_path}...", file=sys.stderr)
+            seed_history(db_path, args.history, self.generator_args())
+        env = {
+            **os.environ,
+            "TELEGRAM_TOKEN": os.environ.get("LOADTEST_TOKEN", "123456:loadtest"),
+            "TELEGRAM_BASE_URL": f"http://127.0.0.1:{args.api_port}/bot",
+            "BOT_MODE": args.mode,
+            "PORT": str(args.bot_port),
+            # Multi-worker mode (WORKERS=N in the environment): keep worker ports clear of the fake API
+            "WORKER_BASE_PORT": str(args.bot_port + 100),
+        }
+        if args.mode == "webhook":
+            env["WEBHOOK_URL"] = self.bot_url
+            env["WEBHOOK_SECRET"] = secrets.token_hex(16)
+        log = open(os.path.join(self.workdir, "bot.log"), "ab")
+        started = time.monotonic()
+        self.process = await asyncio.create_subprocess_exec(
+            sys.executable, os.path.join(ROOT, "bot.py"), cwd=self.workdir, env=env, stdout=log, stderr=log
+        )
+        log.close()
+        print(f"bot started (pid {self.process.pid}), logging to {self.workdir}/bot.log", file=sys.stderr)
+
+        deadline = started + args.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.returncode is not None:
+                raise RuntimeError(f"bot exited with {self.process.returncode}, see {self.workdir}/bot.log")
+            if self.api.ready.is_set() and await self.fetch("/ready") is not None:
+                self.startup_seconds = round(time.monotonic() - started, 2)
+                print(f"bot ready after {self.startup_seconds}s", file=sys.stderr)
+                return
+            await asyncio.sleep(0.2)
+        raise RuntimeError(f"bot not ready after {args.startup_timeout}s, see {self.workdir}/bot.log")
+
+    async def stop_bot(self):
+        if self.process is None or self.process.returncode is not None:
+            return
+        self.process.send_signal(signal.SIGINT)
+        try:
+            await asyncio.wait_for(self.process.wait(), 30)
+        except asyncio.TimeoutError:
+            self.process.kill()
+            await self.process.wait()
+
+    async def fetch(self, path):
+        """Body of a GET to the bot's HTTP server, or None if it is not answering"""
+        try:
+            async with self.session.get(self.bot_url + path, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status == 200:
+                    return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        return None
+
+    def generator_args(self):
+        return {"chats": self.args.chats, "users": self.args.users, "seed": self.args.seed}
+
+    async def replay(self):
+        """Queue updates at Poisson-distributed times for --duration seconds"""
+        args = self.args
+        total = int(args.rate * args.duration)
+        next_ids = defaultdict(lambda: LIVE_MESSAGE_ID)
+        start = time.monotonic()
+        due = start
+        last_report = start
+        for chat_id, user_id, user_name, username, text, _, _ in ChatGenerator(**self.generator_args()).rows(total):
+            due += self.rng.expovariate(args.rate)
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            message_id = next_ids[chat_id]
+            next_ids[chat_id] += 1
+            message = {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "supergroup", "title": f"Load test {chat_id}"},
+                "from": {"id": user_id, "is_bot": False, "first_name": user_name, "username": username},
+            }
+            now = time.monotonic()
+            if self.rng.random() < args.command_share:
+                command, text = self.command_text(user_id - 1000)
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+                self.pending[(chat_id, message_id)] = (command, now)
+                self.counts["commands"] += 1
+            else:
+                self.plain_queued_at.append(now)
+                self.counts["messages"] += 1
+            message["text"] = text
+            self.api.push_update({"message": message})
+            if now - last_report >= 5:
+                last_report = now
+                print(f"  {now - start:.0f}s: {self.api.stats['updates']} updates, "
+                      f"{self.api.stats['sent']} replies, {len(self.pending)} awaiting reply, "
+                      f"ingest {self.ingest_seen}/{len(self.plain_queued_at)}", file=sys.stderr)
+        self.counts["replay_seconds"] = round(time.monotonic() - start, 1)
+
+    async def sample_ingest(self):
+        """Turn growth of the bot's ingest counter into per-message write lag"""
+        while True:
+            body = await self.fetch("/metrics")
+            if body is not None:
+                metrics = parse_metrics(body)
+                now = time.monotonic()
+                written = min(int(sum(metric_values(metrics, "bot_ingest_messages_total"))),
+                              len(self.plain_queued_at))
+                for queued_at in self.plain_queued_at[self.ingest_seen:written]:
+                    self.ingest_lags.append(now - queued_at)
+                self.ingest_seen = max(self.ingest_seen, written)
+                self.max_ingest_depth = max(
+                    self.max_ingest_depth, int(sum(metric_values(metrics, "bot_ingest_queue_depth")))
+                )
+            await asyncio.sleep(self.args.sample_interval)
+
+    async def drain(self):
+        """Wait for outstanding replies and writes, up to --drain seconds"""
+        deadline = time.monotonic() + self.args.drain
+        while time.monotonic() < deadline:
+            if not self.pending and self.ingest_seen >= len(self.plain_queued_at):
+                return
+            await asyncio.sleep(0.5)
+
+    async def run(self):
+        await self.api.start(port=self.args.api_port)
+        self.session = aiohttp.ClientSession()
+        sampler = None
+        try:
+            await self.launch_bot()
+            sampler = asyncio.get_running_loop().create_task(self.sample_ingest())
+            print(f"replaying {self.args.rate}/s for {self.args.duration}s across {self.args.chats} chats...",
+                  file=sys.stderr)
+            await self.replay()
+            await self.drain()
+            sampler.cancel()
+            metrics = parse_metrics(await self.fetch("/metrics") or "")
+            health = json.loads(await self.fetch("/health") or "{}")
+            return self.report(metrics, health)
+        finally:
+            if sampler is not None:
+                sampler.cancel()
+            await self.stop_bot()
+            await self.session.close()
+            await self.api.close()
+
+    def report(self, metrics, health):
+        args = self.args
+        all_latencies = [value for values in self.latencies.values() for value in values]
+        commands = self.counts["commands"]
+        handler_errors = {
+            series: value for series, value in metrics.items() if series.startswith("bot_handler_errors_total")
+        }
+        outbound = merge_health(health, "outbound")
+        ingest = merge_health(health, "ingest")
+        return {
+            "settings": {key: value for key, value in vars(args).items() if key != "out"},
+            "workdir": self.workdir,
+            "startup_seconds": self.startup_seconds,
+            "startup_phases": health.get("startup", {}).get("phases"),
+            "replay_seconds": self.counts["replay_seconds"],
+            "updates": self.api.stats["updates"],
+            "achieved_rate": round(self.api.stats["updates"] / max(self.counts["replay_seconds"], 1e-9), 1),
+            "reply_latency": {"all": percentiles(all_latencies)} | {
+                command: percentiles(values) for command, values in sorted(self.latencies.items())
+            },
+            "commands": commands,
+            "unanswered": len(self.pending),
+            "unanswered_rate": round(len(self.pending) / commands, 4) if commands else 0.0,
+            "busy_replies": self.counts["busy_replies"],
+            "unsolicited_replies": self.counts["unsolicited_replies"],
+            "ingest": {
+                "messages": self.counts["messages"],
+                "written": self.ingest_seen,
+                "lag": percentiles(self.ingest_lags),
+                "max_queue_depth": max(self.max_ingest_depth, ingest.get("max_depth", 0)),
+                "failed_flushes": ingest.get("failed_flushes"),
+            },
+            "errors": {
+                "handler_errors": sum(handler_errors.values()),
+                "handler_errors_by_series": handler_errors,
+                "api_flood_429": self.api.stats["flood_429"],
+                "api_error_500": self.api.stats["error_500"],
+                "webhook_delivery_errors": self.api.stats["webhook_errors"],
+                "outbound_failed": outbound.get("failed"),
+                "outbound_dropped": outbound.get("dropped"),
+            },
+            "outbound": outbound,
+            "event_loop_lag_max_seconds": max(metric_values(metrics, "bot_event_loop_lag_max_seconds"), default=None),
+            "api_calls": dict(self.api.calls),
+        }
+
+def print_report(report):
+    print(f"\n{report['updates']} updates in {report['replay_seconds']}s "
+          f"({report['achieved_rate']}/s), bot ready after {report['startup_seconds']}s")
+    print(f"{'reply latency':24} {'count':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(report["reply_latency"].items()) + [("ingest lag", report["ingest"]["lag"])]
+    for name, summary in rows:
+        if summary["count"]:
+            print(f"{name:24} {summary['count']:>7} {summary['p50_ms']:>9} {summary['p90_ms']:>9} "
+                  f"{summary['p99_ms']:>9} {summary['max_ms']:>9}")
+    ingest = report["ingest"]
+    print(f"unanswered commands: {report['unanswered']}/{report['commands']} ({report['unanswered_rate']:.1%}), "
+          f"busy replies: {report['busy_replies']}")
+    print(f"ingest: {ingest['written']}/{ingest['messages']} written, max queue depth {ingest['max_queue_depth']}")
+    errors = report["errors"]
+    print(f"errors: handlers {errors['handler_errors']:.0f}, outbound failed {errors['outbound_failed']}, "
+          f"injected 429/500 {errors['api_flood_429']}/{errors['api_error_500']}, "
+          f"webhook delivery {errors['webhook_delivery_errors']}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--mode", choices=("polling", "webhook"), default="polling")
+    parser.add_argument("--chats", type=int, default=2000)
+    parser.add_argument("--users", type=int, default=50, help="members per chat")
+    parser.add_argument("--rate", type=float, default=200, help="updates per second, all chats together")
+    parser.add_argument("--duration", type=float, default=60, help="seconds of replay")
+    parser.add_argument("--command-share", type=float, default=0.02)
+    parser.add_argument("--command-mix", default="catchup=4,who=2,person=2,search=1,day=1")
+    parser.add_argument("--history", type=int, default=0, help="messages to seed the database with")
+    parser.add_argument("--drain", type=float, default=30, help="seconds to wait for replies after the run")
+    parser.add_argument("--sample-interval", type=float, default=0.25)
+    parser.add_argument("--api-latency-ms", type=float, default=0.0)
+    parser.add_argument("--flood-rate", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--api-port", type=int, default=8099)
+    parser.add_argument("--bot-port", type=int, default=8098)
+    parser.add_argument("--startup-timeout", type=float, default=120)
+    parser.add_argument("--workdir", help="bot working directory (default: a new temporary one)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="loadtest-results.json")
+    args = parser.parse_args()
+
+    report = asyncio.run(LoadDriver(args).run())
+    print_report(report)
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.out}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
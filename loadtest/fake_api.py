@@ -0,0 +1,255 @@
+"""
+Local stand-in for the Telegram Bot API, for load tests without a real token
+or real groups.
+
+Point the bot at it with TELEGRAM_BASE_URL=http://127.0.0.1:8099/bot. It
+implements what the bot uses: getMe, getUpdates (long polling with offsets),
+setWebhook / deleteWebhook (with a webhook set, updates are POSTed to the
+bot instead, with the secret header and at most max_connections in flight),
+setMyCommands and sendMessage. Any other method answers ok/true.
+
+Updates are queued with push_update(), in-process as loadtest/driver.py does,
+or POSTed as JSON (one update or a list) to /control/updates when it runs on
+its own:
+
+    python loadtest/fake_api.py [--port 8099] [--latency-ms 50] [--flood-rate 0.01]
+
+GET /control/stats returns call counts. sendMessage can be slowed down and
+made to fail a share of calls with 429 (flood control, retry_after) or 500,
+to see how the bot's outbound queue copes.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from collections import Counter, defaultdict, deque
+from itertools import islice
+
+import aiohttp
+from aiohttp import web
+
+BOT_USER = {"id": 1000000001, "is_bot": True, "first_name": "Summarizer", "username": "summarizer_loadtest_bot"}
+# Parameters that PTB sends JSON-encoded inside form data
+JSON_PARAMS = ("reply_parameters", "allowed_updates", "commands", "reply_markup")
+
+def ok(result):
+    return web.json_response({"ok": True, "result": result})
+
+def error(status, description, **parameters):
+    body = {"ok": False, "error_code": status, "description": description}
+    if parameters:
+        body["parameters"] = parameters
+    return web.json_response(body, status=status)
+
+async def read_params(request):
+    """Method parameters from a JSON, urlencoded or multipart body"""
+    if request.content_type == "application/json":
+        return await request.json()
+    params = dict(await request.post())
+    for key in JSON_PARAMS:
+        if isinstance(params.get(key), str):
+            params[key] = json.loads(params[key])
+    return params
+
+class FakeBotAPI:
+    """The fake server; on_reply(chat_id, reply_to_message_id, text) is called for each sent message"""
+    def __init__(self, latency=0.0, flood_rate=0.0, error_rate=0.0, retry_after=1, seed=0, on_reply=None):
+        self.latency = latency
+        self.flood_rate = flood_rate
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.on_reply = on_reply
+        self.updates = deque()  # Not yet confirmed by a getUpdates offset
+        self.next_update_id = 1
+        self.new_update = asyncio.Event()
+        self.webhook = None  # (url, secret, semaphore limiting max_connections)
+        self.ready = asyncio.Event()  # Set by setMyCommands, the end of the bot's post_init
+        self.next_message_ids = defaultdict(lambda: 1)
+        self.calls = Counter()
+        self.stats = {
+            "updates": 0,
+            "delivered": 0,
+            "sent": 0,
+            "flood_429": 0,
+            "error_500": 0,
+            "webhook_errors": 0,
+        }
+        self._tasks = set()
+        self._runner = None
+        self._session = None
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/bot{token}/{method}", self.handle)
+        self.app.router.add_post("/control/updates", self.control_updates)
+        self.app.router.add_get("/control/stats", self.control_stats)
+        self.methods = {
+            "getMe": self.get_me,
+            "getUpdates": self.get_updates,
+            "setWebhook": self.set_webhook,
+            "deleteWebhook": self.delete_webhook,
+            "setMyCommands": self.set_my_commands,
+            "sendMessage": self.send_message,
+        }
+
+    async def start(self, host="127.0.0.1", port=8099):
+        self._runner = web.AppRunner(self.app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        self._session = aiohttp.ClientSession()
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        if self._session is not None:
+            await self._session.close()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    def push_update(self, update):
+        """Queue an update (without update_id) for the bot; returns its update_id"""
+        update = {"update_id": self.next_update_id, **update}
+        self.next_update_id += 1
+        self.stats["updates"] += 1
+        if self.webhook is not None:
+            self._spawn(self._deliver(update))
+        else:
+            self.updates.append(update)
+            self.new_update.set()
+        return update["update_id"]
+
+    def _spawn(self, coro):
+        task = asyncio.get_running_loop().create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _deliver(self, update, attempts=5):
+        """POST one update to the webhook like Telegram does, retrying while the bot is unreachable"""
+        url, secret, slots = self.webhook
+        headers = {"X-Telegram-Bot-Api-Secret-Token": secret} if secret else {}
+        async with slots:
+            for attempt in range(attempts):
+                try:
+                    async with self._session.post(url, json=update, headers=headers) as response:
+                        if response.status == 200:
+                            self.stats["delivered"] += 1
+                            return
+                except aiohttp.ClientError:
+                    pass
+                self.stats["webhook_errors"] += 1
+                await asyncio.sleep(0.5 * (attempt + 1))
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        handler = self.methods.get(method)
+        params = await read_params(request) if request.can_read_body else dict(request.query)
+        if handler is None:
+            return ok(True)
+        return await handler(params)
+
+    async def get_me(self, params):
+        return ok(BOT_USER)
+
+    async def get_updates(self, params):
+        offset = int(params.get("offset") or 0)
+        while self.updates and self.updates[0]["update_id"] < offset:
+            self.updates.popleft()
+            self.stats["delivered"] += 1
+        if not self.updates:
+            self.new_update.clear()
+            try:
+                await asyncio.wait_for(self.new_update.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        return ok(list(islice(self.updates, int(params.get("limit") or 100))))
+
+    async def set_webhook(self, params):
+        if params.get("drop_pending_updates") in (True, "true", "True"):
+            self.updates.clear()
+        slots = asyncio.Semaphore(int(params.get("max_connections") or 40))
+        self.webhook = (params["url"], params.get("secret_token"), slots)
+        while self.updates:
+            self._spawn(self._deliver(self.updates.popleft()))
+        return ok(True)
+
+    async def delete_webhook(self, params):
+        self.webhook = None
+        if params.get("drop_pending_updates") in (True, "true", "True"):
+            self.updates.clear()
+        return ok(True)
+
+    async def set_my_commands(self, params):
+        self.ready.set()
+        return ok(True)
+
+    async def send_message(self, params):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        roll = self.rng.random()
+        if roll < self.flood_rate:
+            self.stats["flood_429"] += 1
+            return error(429, f"Too Many Requests: retry after {self.retry_after}", retry_after=self.retry_after)
+        if roll < self.flood_rate + self.error_rate:
+            self.stats["error_500"] += 1
+            return error(500, "Internal Server Error")
+
+        chat_id = int(params["chat_id"])
+        reply_to = (params.get("reply_parameters") or {}).get("message_id")
+        message_id = self.next_message_ids[chat_id]
+        self.next_message_ids[chat_id] += 1
+        self.stats["sent"] += 1
+        if self.on_reply is not None:
+            self.on_reply(chat_id, int(reply_to) if reply_to is not None else None, params.get("text", ""))
+        return ok({
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "supergroup", "title": f"Chat {chat_id}"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        })
+
+    async def control_updates(self, request):
+        body = await request.json()
+        ids = [self.push_update(update) for update in (body if isinstance(body, list) else [body])]
+        return web.json_response({"update_ids": ids})
+
+    async def control_stats(self, request):
+        return web.json_response({
+            **self.stats,
+            "pending": len(self.updates),
+            "webhook": self.webhook[0] if self.webhook else None,
+            "calls": dict(self.calls),
+        })
+
+async def serve_forever(args):
+    def log_reply(chat_id, reply_to, text):
+        print(f"sendMessage chat={chat_id} reply_to={reply_to}: {text[:80]!r}", flush=True)
+
+    api = FakeBotAPI(
+        latency=args.latency_ms / 1000, flood_rate=args.flood_rate, error_rate=args.error_rate,
+        on_reply=log_reply
+    )
+    await api.start(args.host, args.port)
+    print(f"Fake Bot API on http://{args.host}:{args.port}/bot (TELEGRAM_BASE_URL)", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="delay of each sendMessage")
+    parser.add_argument("--flood-rate", type=float, default=0.0, help="share of sendMessage calls answered 429")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of sendMessage calls answered 500")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve_forever(args))
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Prometheus metrics, served as text by /metrics on the keep-alive (or webhook) server.
+
+Histograms and counters are kept in plain lists under one lock each, so an
+observation costs a bisect and a few increments; cheap enough for the ingest
+path. Values that already live elsewhere (ingest totals, file sizes) are read
+by callbacks when /metrics is scraped instead of being pushed.
+"""
+import asyncio
+import functools
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+logger = logging.getLogger(__name__)
+
+# Seconds; spans a cached reply (~1 ms) up to a summary hitting its timeout
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry = []
+
+def _labels(label, value):
+    if label is None:
+        return ""
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'{{{label}="{value}"}}'
+
+class Histogram:
+    """Latency histogram with one series per value of a single label"""
+    def __init__(self, name, help_text, label, buckets=BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._series = {}  # label value -> [count per bucket..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, value, seconds):
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(value)
+            if series is None:
+                series = self._series[value] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += seconds
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            snapshot = {value: list(series) for value, series in self._series.items()}
+        for value, series in sorted(snapshot.items(), key=lambda item: str(item[0])):
+            label = f'{self.label}="{value}",' if self.label is not None else ""
+            cumulative = 0
+            for bound, count in zip(self.buckets, series):
+                cumulative += count
+                lines.append(f'{self.name}_bucket{{{label}le="{bound}"}} {cumulative}')
+            cumulative += series[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label}le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{_labels(self.label, value)} {series[-1]:.6f}")
+            lines.append(f"{self.name}_count{_labels(self.label, value)} {cumulative}")
+        return lines
+
+class Counter:
+    """Monotonic counter, optionally with one label"""
+    def __init__(self, name, help_text, label=None):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def inc(self, value=None, amount=1):
+        with self._lock:
+            self._values[value] = self._values.get(value, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            snapshot = dict(self._values)
+        for value, total in sorted(snapshot.items(), key=lambda item: str(item[0])):
+            lines.append(f"{self.name}{_labels(self.label, value)} {total}")
+        return lines
+
+class Callback:
+    """Gauge or counter whose value is read from `read()` at scrape time.
+    read() returns a number, or a {label value: number} dict when `label` is set."""
+    def __init__(self, name, help_text, read, kind="gauge", label=None):
+        self.name = name
+        self.help_text = help_text
+        self.read = read
+        self.kind = kind
+        self.label = label
+        _registry.append(self)
+
+    def render(self):
+        try:
+            value = self.read()
+        except Exception as e:
+            logger.debug(f"Metric {self.name} unavailable: {e}")
+            return []
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.kind}"]
+        if self.label is None:
+            lines.append(f"{self.name} {value}")
+        else:
+            for label_value, number in sorted(value.items(), key=lambda item: str(item[0])):
+                lines.append(f"{self.name}{_labels(self.label, label_value)} {number}")
+        return lines
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in each update handler", "handler")
+HANDLER_ERRORS = Counter("bot_handler_errors_total", "Handler calls that raised", "handler")
+DB_SECONDS = Histogram("bot_db_query_seconds", "Time spent in each MessageDB method", "method")
+SUMMARY_STAGE_SECONDS = Histogram(
+    "bot_summarizer_stage_seconds", "Time spent in each summarizer stage (inside the worker)", "stage"
+)
+SUMMARY_SECONDS = Histogram(
+    "bot_summarizer_job_seconds", "Summarizer jobs end to end, including waiting for a worker", "method"
+)
+LOOP_LAG_SECONDS = Histogram(
+    "bot_event_loop_lag_seconds", "How late the event loop runs a timer",
+    None, buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+)
+
+class Remote:
+    """Metrics of other processes (the workers in multi-worker mode). read() returns
+    {label value: exposition text}; each series gets `label` added and is merged into
+    the family of the same name, so every family is declared once."""
+    def __init__(self, label, read):
+        self.label = label
+        self.read = read
+        _registry.append(self)
+
+    def render(self):
+        try:
+            texts = self.read()
+        except Exception as e:
+            logger.debug(f"Remote metrics unavailable: {e}")
+            return []
+        lines = []
+        for label_value, text in sorted(texts.items(), key=lambda item: str(item[0])):
+            label = _labels(self.label, label_value)[1:-1]
+            for line in text.splitlines():
+                if not line or line.startswith("#"):
+                    lines.append(line)
+                elif "{" in line:
+                    lines.append(line.replace("{", "{" + label + ",", 1))
+                else:
+                    name, value = line.split(" ", 1)
+                    lines.append(f"{name}{{{label}}} {value}")
+        return lines
+
+def timed(name):
+    """Decorator recording an async handler's duration (and errors) under `name`"""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+def register_database(db_path):
+    """File-size gauges of the SQLite database and its WAL"""
+    def sizes():
+        return {
+            part: os.path.getsize(path) if os.path.exists(path) else 0
+            for part, path in (("db", db_path), ("wal", db_path + "-wal"))
+        }
+    Callback("bot_db_file_bytes", "Size of the database file and its WAL", sizes, label="file")
+
+def register_ingest(ingest_queue):
+    """Ingest totals (rate() of messages_total is the ingest rate), queue depth and drops"""
+    Callback("bot_ingest_messages_total", "Messages written by the ingest queue",
+             lambda: ingest_queue.stats["flushed"], kind="counter")
+    Callback("bot_ingest_batches_total", "Ingest flushes", lambda: ingest_queue.stats["batches"], kind="counter")
+    Callback("bot_ingest_queue_depth", "Messages waiting to be written", ingest_queue.depth)
+    Callback("bot_ingest_dropped_total", "Messages dropped because the ingest queue was full",
+             lambda: ingest_queue.stats["dropped"], kind="counter")
+
+def register_startup(clock):
+    """Duration of each startup phase (see handover.StartupClock)"""
+    Callback("bot_startup_seconds", "Time spent in each startup phase", lambda: clock.phases, label="phase")
+
+_loop_lag = {"max": 0.0, "heartbeat": None}
+Callback("bot_event_loop_lag_max_seconds", "Largest event loop lag seen", lambda: f"{_loop_lag['max']:.6f}")
+
+async def monitor_loop_lag(interval=0.5):
+    """Record how much later than asked a sleep wakes up; run as a task on the bot's loop"""
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = max(0.0, time.perf_counter() - start - interval)
+        _loop_lag["max"] = max(_loop_lag["max"], lag)
+        _loop_lag["heartbeat"] = time.monotonic()
+        LOOP_LAG_SECONDS.observe(None, lag)
+
+def loop_stalled_for():
+    """Seconds since monitor_loop_lag last ran, None before it started"""
+    heartbeat = _loop_lag["heartbeat"]
+    return None if heartbeat is None else time.monotonic() - heartbeat
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    # Family name -> its HELP/TYPE lines and samples; a family may get samples from several metrics
+    families = {}
+    family = None
+    for metric in _registry:
+        for line in metric.render():
+            if line.startswith("# "):
+                name = line.split(" ", 3)[2]
+                family = families.setdefault(name, ([], []))
+                if len(family[0]) < 2:
+                    family[0].append(line)
+            elif line and family is not None:
+                family[1].append(line)
+    lines = []
+    for header, samples in families.values():
+        lines.extend(header)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,279 @@
+"""
+Outbound message scheduler.
+
+Every reply goes through one OutboundQueue instead of straight to the Bot
+API. Sends are paced by token buckets, one global (Telegram allows about 30
+messages per second per bot) and one per chat (about 20 per minute in a
+group), and chats take turns round-robin so a busy group cannot hold up
+everyone else. An identical reply already waiting for the same chat is sent
+once. A 429 puts the chat on hold for the retry_after Telegram asks for and
+the message is retried, never dropped. Connection errors are retried a few
+times; a timeout is not, since Telegram may already have posted the message,
+and neither is a request Telegram rejected (bad request, bot blocked).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+
+from telegram import ReplyParameters
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TimedOut
+
+logger = logging.getLogger(__name__)
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`"""
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, now):
+        """Seconds until a token is available (0 if one is)"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def full(self, now):
+        """Whether the bucket has refilled completely, i.e. behaves like a new one"""
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+class _Outgoing:
+    __slots__ = ("chat_id", "text", "parse_mode", "reply_to", "future", "queued_at", "attempts")
+
+    def __init__(self, chat_id, text, parse_mode, reply_to, future):
+        self.chat_id = chat_id
+        self.text = text
+        self.parse_mode = parse_mode
+        self.reply_to = reply_to
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+
+def _seconds(retry_after):
+    """RetryAfter.retry_after is an int, or a timedelta in newer library versions"""
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+def _consume_exception(future):
+    # Callers may not await delivery; failures are logged by the worker
+    if not future.cancelled():
+        future.exception()
+
+class OutboundQueue:
+    """Fair, rate-limited send queue in front of Bot.send_message"""
+    # Seconds between sweeps of per-chat state no longer needed
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, global_rate=30.0, chat_rate=20 / 60, chat_burst=3, max_pending=2000,
+                 max_in_flight=8, max_attempts=3):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_pending = max_pending
+        self.max_in_flight = max_in_flight
+        self.max_attempts = max_attempts
+        self.bot = None
+        self._queues = OrderedDict()  # chat_id -> deque of _Outgoing, in round-robin order
+        self._buckets = {}  # chat_id -> TokenBucket
+        self._held_until = {}  # chat_id -> monotonic time a 429 lifts
+        self._pruned_at = time.monotonic()
+        self._in_flight_chats = set()
+        self._waiting = {}  # coalescing key -> queued _Outgoing
+        self._pending = 0
+        self._wakeup = None
+        self._slots = None
+        self._task = None
+        self._sends = set()
+        self._waits = deque(maxlen=1000)
+        self.stats = {
+            "queued": 0,
+            "sent": 0,
+            "coalesced": 0,
+            "retry_after": 0,
+            "retries": 0,
+            "failed": 0,
+            "dropped": 0,
+            "max_wait_ms": 0.0,
+        }
+
+    def start(self, bot):
+        """Start the sender on the running event loop"""
+        self.bot = bot
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(self.max_in_flight)
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def close(self, timeout=10.0):
+        """Give queued messages up to `timeout` seconds to go out, then stop"""
+        if self._task is None:
+            return
+        deadline = time.monotonic() + timeout
+        while (self._pending or self._sends) and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        self._task.cancel()
+        for task in list(self._sends):
+            task.cancel()
+        self._task = None
+        if self._pending:
+            logger.warning(f"⚠️ {self._pending} outgoing messages not sent at shutdown")
+
+    def submit(self, chat_id, text, parse_mode=None, reply_to=None):
+        """Queue a message; returns a future for the sent Message (or None if it was dropped).
+        A reply identical to one still waiting for the chat shares that one's future."""
+        key = (chat_id, text, parse_mode)
+        waiting = self._waiting.get(key)
+        if waiting is not None:
+            self.stats["coalesced"] += 1
+            return waiting.future
+        if self._pending >= self.max_pending:
+            self.stats["dropped"] += 1
+            logger.warning(f"⚠️ Outbound queue full, dropping a message to chat {chat_id}")
+            return None
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_consume_exception)
+        item = _Outgoing(chat_id, text, parse_mode, reply_to, future)
+        self._queues.setdefault(chat_id, deque()).append(item)
+        self._waiting[key] = item
+        self._pending += 1
+        self.stats["queued"] += 1
+        self._wakeup.set()
+        return future
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _pick(self, now):
+        """(next item in round-robin order whose chat may send now, 0) or (None, seconds to wait)"""
+        wait = None
+        for chat_id in list(self._queues):
+            if chat_id in self._in_flight_chats:
+                continue  # One message at a time per chat keeps replies in order
+            delay = max(self._chat_bucket(chat_id).delay(now), self._held_until.get(chat_id, 0) - now)
+            if delay <= 0:
+                queue = self._queues.pop(chat_id)
+                item = queue.popleft()
+                if queue:
+                    self._queues[chat_id] = queue  # Back of the line
+                return item, 0.0
+            wait = delay if wait is None else min(wait, delay)
+        return None, wait
+
+    def _prune(self, now):
+        """Forget buckets of idle chats that refilled completely and holds that have lifted,
+        so per-chat state does not grow with every chat the bot ever replied to"""
+        self._pruned_at = now
+        for chat_id, until in list(self._held_until.items()):
+            if until <= now:
+                del self._held_until[chat_id]
+        for chat_id, bucket in list(self._buckets.items()):
+            if chat_id not in self._queues and chat_id not in self._in_flight_chats and bucket.full(now):
+                del self._buckets[chat_id]
+
+    async def _run(self):
+        while True:
+            await self._slots.acquire()
+            item = None
+            while item is None:
+                self._wakeup.clear()
+                now = time.monotonic()
+                if now - self._pruned_at >= self.PRUNE_INTERVAL:
+                    self._prune(now)
+                item, wait = self._pick(now)
+                if item is None:
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), wait)
+                    except asyncio.TimeoutError:
+                        pass
+            global_delay = self.global_bucket.delay(time.monotonic())
+            if global_delay > 0:
+                await asyncio.sleep(global_delay)
+            now = time.monotonic()
+            self.global_bucket.take(now)
+            self._chat_bucket(item.chat_id).take(now)
+            self._in_flight_chats.add(item.chat_id)
+            task = asyncio.get_running_loop().create_task(self._send(item))
+            self._sends.add(task)
+            task.add_done_callback(self._sends.discard)
+
+    async def _send(self, item):
+        key = (item.chat_id, item.text, item.parse_mode)
+        if self._waiting.get(key) is item:
+            del self._waiting[key]  # From here on an identical reply is a new message
+        retry = None
+        try:
+            item.attempts += 1
+            reply = None
+            if item.reply_to is not None:
+                reply = ReplyParameters(item.reply_to, allow_sending_without_reply=True)
+            message = await self.bot.send_message(
+                item.chat_id, item.text, parse_mode=item.parse_mode, reply_parameters=reply
+            )
+        except RetryAfter as e:
+            self.stats["retry_after"] += 1
+            retry = _seconds(e.retry_after)
+            logger.warning(f"⏳ Telegram asked to wait {retry:.0f}s before sending to chat {item.chat_id}")
+        except (BadRequest, Forbidden, TimedOut) as e:
+            # Caught before NetworkError, which BadRequest and TimedOut subclass: the
+            # request was rejected, or it may have gone through and a retry would post it twice
+            self._fail(item, e)
+        except NetworkError as e:
+            if item.attempts < self.max_attempts:
+                retry = 1.0 * item.attempts
+            else:
+                self._fail(item, e)
+        except Exception as e:
+            # Unexpected response or error: not worth retrying
+            self._fail(item, e)
+        else:
+            wait_ms = (time.monotonic() - item.queued_at) * 1000
+            self._waits.append(wait_ms)
+            self.stats["max_wait_ms"] = max(self.stats["max_wait_ms"], round(wait_ms, 1))
+            self.stats["sent"] += 1
+            self._pending -= 1
+            if not item.future.done():
+                item.future.set_result(message)
+        finally:
+            self._in_flight_chats.discard(item.chat_id)
+            if retry is not None:
+                self.stats["retries"] += 1
+                self._held_until[item.chat_id] = time.monotonic() + retry
+                # Back to the head of its chat's queue: order within the chat is kept
+                self._queues.setdefault(item.chat_id, deque()).appendleft(item)
+            self._slots.release()
+            self._wakeup.set()
+
+    def _fail(self, item, error):
+        self.stats["failed"] += 1
+        self._pending -= 1
+        logger.error(f"❌ Failed to send message to chat {item.chat_id}: {error}")
+        if not item.future.done():
+            item.future.set_exception(error)
+
+    def get_stats(self):
+        waits = sorted(self._waits)
+        stats = dict(self.stats)
+        stats["pending"] = self._pending
+        stats["chats_waiting"] = len(self._queues)
+        stats["chats_tracked"] = len(self._buckets)
+        if waits:
+            stats["wait_p50_ms"] = round(waits[len(waits) // 2], 1)
+            stats["wait_p95_ms"] = round(waits[int(len(waits) * 0.95)], 1)
+        return stats
@@ -0,0 +1,125 @@
+"""
+Retention and compaction for messages.db.
+
+Messages older than RETENTION_DAYS are rolled up per chat and local day into
+an `archives` row holding the day's summary and, in "archive" mode, the
+zlib-compressed messages themselves ("drop" mode keeps only the summary).
+Rows are then deleted in small transactions, and every run ends with an
+incremental vacuum and a PASSIVE WAL checkpoint, so the job never holds the
+write lock for long and ingest keeps flushing in between.
+
+Existing databases were created without incremental auto-vacuum; switch one
+over once, with the bot stopped:
+
+    python retention.py --convert [messages.db]
+"""
+import argparse
+import logging
+import sqlite3
+from datetime import timedelta
+
+from database import day_key
+from timeutils import day_bounds, local_day, now_ts
+
+logger = logging.getLogger(__name__)
+
+MODES = ("archive", "drop")
+
+class RetentionJob:
+    """Archives old days chat by chat, a bounded number of days per run"""
+    def __init__(self, db, pool, retention_days=0, mode="archive", days_per_run=50,
+                 batch_size=500, vacuum_pages=2000):
+        if mode not in MODES:
+            raise ValueError(f"Unknown retention mode {mode!r}, expected one of {MODES}")
+        self.db = db
+        self.pool = pool
+        self.retention_days = retention_days
+        self.mode = mode
+        self.days_per_run = days_per_run
+        self.batch_size = batch_size
+        self.vacuum_pages = vacuum_pages
+        self.stats = {
+            "runs": 0,
+            "days_archived": 0,
+            "messages_deleted": 0,
+            "archive_bytes": 0,
+            "freed_pages": 0,
+            "last_run_seconds": None,
+        }
+
+    def cutoff_ts(self):
+        """Start of the oldest local day that is still kept"""
+        return day_bounds(local_day() - timedelta(days=self.retention_days))[0]
+
+    async def run(self):
+        """One pass: archive up to days_per_run old days, then compact"""
+        loop_start = now_ts()
+        archived = 0
+        if self.retention_days > 0:
+            cutoff = self.cutoff_ts()
+            for chat_id in await self.db.get_active_chats(0):
+                while archived < self.days_per_run:
+                    oldest = await self.db.get_oldest_ts(chat_id, cutoff)
+                    if oldest is None:
+                        break
+                    await self._archive_day(chat_id, local_day(oldest))
+                    archived += 1
+                if archived >= self.days_per_run:
+                    break
+                await self.db.delete_segments_before(chat_id, cutoff)
+
+        result = await self.db.compact(self.vacuum_pages)
+        self.stats["freed_pages"] += result["freed_pages"]
+        self.stats["runs"] += 1
+        self.stats["last_run_seconds"] = now_ts() - loop_start
+        if archived or result["freed_pages"]:
+            logger.info(
+                f"🧹 Retention archived {archived} chat-days, freed {result['freed_pages']} pages, "
+                f"checkpoint {result['checkpoint']}"
+            )
+        return archived
+
+    async def _archive_day(self, chat_id, day):
+        start, end = day_bounds(day)
+        rows = await self.db.get_archive_rows(chat_id, start, end)
+        if not rows:
+            return
+        messages = [(user_name, text, None, username) for _, _, _, user_name, username, text in rows]
+        summary = await self.pool.summarize(messages)
+        size = await self.db.save_archive(chat_id, day_key(start), rows, summary, self.mode == "archive")
+
+        ids = [row[0] for row in rows]
+        # One small transaction per await, so queued ingest flushes get the writer in between
+        for i in range(0, len(ids), self.batch_size):
+            self.stats["messages_deleted"] += await self.db.delete_messages(ids[i:i + self.batch_size])
+        self.stats["days_archived"] += 1
+        self.stats["archive_bytes"] += size
+
+    def get_stats(self):
+        return dict(self.stats)
+
+def convert(db_path):
+    """Switch an existing database to incremental auto-vacuum (rewrites the file)"""
+    conn = sqlite3.connect(db_path)
+    try:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            print(f"{db_path} already uses incremental auto-vacuum")
+            return
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+        conn.execute("VACUUM")
+        print(f"{db_path} converted to incremental auto-vacuum")
+    finally:
+        conn.close()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("db_path", nargs="?", default="messages.db")
+    parser.add_argument("--convert", action="store_true", help="enable incremental auto-vacuum (full VACUUM)")
+    args = parser.parse_args()
+    if args.convert:
+        convert(args.db_path)
+    else:
+        parser.print_help()
+
+if __name__ == "__main__":
+    main()
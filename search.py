@@ -0,0 +1,35 @@
+import re
+
+# Words as FTS5's unicode61 tokenizer sees them
+WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+def chat_token(chat_id):
+    """Indexed token identifying a chat in messages_fts ('-' would split the token)"""
+    return f"c{chat_id}".replace("-", "n")
+
+def query_terms(text):
+    """Lowercased search words from user input"""
+    return [word.lower() for word in WORD_RE.findall(text)]
+
+def match_query(chat_id, terms):
+    """FTS5 MATCH expression: every term (as a prefix) in the body of a message of the
+    given chat. The terms are scoped to body, or "c" would also match the chat token."""
+    words = " ".join(f'"{term}"*' for term in terms)
+    return f"chat : {chat_token(chat_id)} AND body : ({words})"
+
+def make_snippet(text, terms, width=90):
+    """About `width` characters of text around the first term, with matching words marked.
+    Returned as (before, match, after) so the caller can escape and format each part."""
+    lowered = text.lower()
+    first = None
+    for match in WORD_RE.finditer(lowered):
+        if any(match.group().startswith(term) for term in terms):
+            first = match
+            break
+    if first is None:
+        return (text[:width] + ("…" if len(text) > width else ""), "", "")
+    start = max(0, first.start() - width // 3)
+    end = min(len(text), first.end() + width - width // 3)
+    before = ("…" if start > 0 else "") + text[start:first.start()]
+    after = text[first.end():end] + ("…" if end < len(text) else "")
+    return before, text[first.start():first.end()], after
@@ -0,0 +1,88 @@
+import logging
+
+from timeutils import now_ts
+
+logger = logging.getLogger(__name__)
+
+class SegmentSummaries:
+    """
+    Rolling per-chat summaries of fixed time segments (e.g. 30 minutes).
+    Once a segment has closed it is reduced to its most representative
+    messages and stored next to `messages`. A long window is then summarized
+    from those stored representatives plus the raw messages of the partial
+    first segment and the still-open last one, so its cost barely grows with
+    the window length. Segments are rebuilt lazily when late messages arrive.
+    `fetch(chat_id, start, end)` reads the raw head and tail (e.g. through the
+    hot tier); by default they come from the database.
+    """
+    def __init__(self, db, pool, segment_seconds=1800, min_segments=4, fetch=None):
+        self.db = db
+        self.pool = pool
+        self.fetch = fetch or db.get_messages_between
+        self.segment_seconds = segment_seconds
+        self.min_segments = min_segments
+        self.stats = {"segments_built": 0, "segments_reused": 0}
+
+    @staticmethod
+    def representative_count(message_count):
+        """How many messages a segment keeps"""
+        return max(2, min(10, message_count // 5))
+
+    def enabled_for(self, start, end):
+        """Only windows spanning several closed segments benefit from the stored ones"""
+        if self.segment_seconds <= 0:
+            return False
+        closed_end = min(end, (now_ts() // self.segment_seconds) * self.segment_seconds)
+        first = -(-start // self.segment_seconds) * self.segment_seconds
+        return closed_end - first >= self.segment_seconds * self.min_segments
+
+    async def collect(self, chat_id, start, end):
+        """Messages to summarize for [start, end) and the real message count,
+        or None if the window is too short for stored segments to help"""
+        if not self.enabled_for(start, end):
+            return None
+
+        seg = self.segment_seconds
+        now = now_ts()
+        end = min(end, now + 1)
+        first = -(-start // seg) * seg
+        closed_end = (now // seg) * seg
+
+        counts = await self.db.get_segment_counts(chat_id, first, closed_end, seg)
+        stored = await self.db.get_segments(chat_id, first, closed_end)
+        head = await self.fetch(chat_id, start, first)
+        tail = await self.fetch(chat_id, closed_end, end)
+
+        messages = list(head)
+        total = len(head) + len(tail)
+        for seg_start in sorted(counts):
+            count = counts[seg_start]
+            entry = stored.get(seg_start)
+            # Rebuild if never built, marked dirty by a late insert, or the row count moved
+            if entry is None or entry[2] or entry[0] != count:
+                representatives = await self._build(chat_id, seg_start, seg_start + seg)
+            else:
+                representatives = entry[1]
+                self.stats["segments_reused"] += 1
+            messages.extend(representatives)
+            total += count
+        messages.extend(tail)
+        return messages, total
+
+    async def _build(self, chat_id, seg_start, seg_end):
+        """Reduce one closed segment to its representatives and store them"""
+        segment_messages = await self.db.get_messages_between(chat_id, seg_start, seg_end)
+        if not segment_messages:
+            return []
+        representatives = await self.pool.select_representatives(
+            segment_messages, self.representative_count(len(segment_messages))
+        )
+        # Term vectors (a fifth column) are bytes and are not kept with the representatives
+        await self.db.save_segment(
+            chat_id, seg_start, seg_end, len(segment_messages), [list(m[:4]) for m in representatives]
+        )
+        self.stats["segments_built"] += 1
+        return [tuple(m) for m in representatives]
+
+    def get_stats(self):
+        return dict(self.stats)
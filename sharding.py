@@ -0,0 +1,488 @@
+"""
+Multi-worker mode (WORKERS > 1): one dispatcher process in front of N bot
+worker processes, so handlers, ingest and summarization use N cores.
+
+The dispatcher is the only process that gets updates from Telegram. It
+long-polls getUpdates (BOT_MODE=polling) or takes Telegram's webhook posts
+(BOT_MODE=webhook), and routes each update by its chat_id to one worker.
+Workers are ordinary bot.py processes in webhook mode on localhost ports
+WORKER_BASE_PORT + index, with no webhook registered. They run the usual
+handlers, ingest queue, summarizer pool and outbound queue (with their
+share of the global send rate), and serve their own /health and /metrics.
+A chat always goes to the same worker, each worker's updates are forwarded
+one at a time in arrival order, and workers run with CONCURRENT_UPDATES=1,
+so per-chat ordering is kept. Parallelism comes from the N workers.
+
+Chats are assigned by rendezvous hashing: every chat ranks the workers by a
+hash of (chat_id, worker index) and belongs to the first. Starting with a
+different WORKERS only moves the chats whose first choice changed, about
+1/N of them.
+
+When a worker exits, the dispatcher starts it again. Its chats stay
+assigned to it, because moving them would split a chat's in-memory state
+and history between processes. Their updates wait in its queue, up to
+WORKER_QUEUE_MAX, and are delivered in order once the new process answers
+/health. An update whose delivery failed midway is sent again. Ingest skips
+a (chat_id, tg_message_id) it already has, so the message is stored once.
+Beyond WORKER_QUEUE_MAX the oldest held updates are dropped: they are lost,
+counted as "dropped" in /health and bot_worker_dropped_updates_total, and
+logged.
+
+SHARD_DB=1 gives each worker its own database, messages-shard<i>.db next to
+DB_PATH. The worker count the shards were created with is recorded in
+shards.json. Starting sharded storage with a different WORKERS, or on an
+existing database that holds messages, is refused: either would separate
+chats from their history. With shared storage (the default), the workers
+write one WAL database and only worker 0 runs maintenance.
+
+The dispatcher's /health reports every worker, and turns "degraded" while
+one is down. Its /metrics merges the workers' metrics under a worker label.
+
+A new dispatcher takes over from a running one through the handover lease
+(see handover.py). Its workers need the same ports, so they start only after
+the old dispatcher has stopped its own. Until then updates wait at Telegram:
+the old dispatcher confirms only what its workers took.
+
+    WORKERS=4 python bot.py        (bot.py hands over to this module)
+"""
+import asyncio
+import json
+import logging
+import os
+import secrets
+import signal
+import sqlite3
+import sys
+import time
+from collections import deque
+from hashlib import blake2b
+
+# Before the other imports, so the startup clock covers them
+from handover import Lease, startup
+
+import aiohttp
+from aiohttp import web
+from telegram import Update
+
+import metrics
+import webhook
+from config import (
+    TELEGRAM_TOKEN, TELEGRAM_BASE_URL, BOT_MODE, PORT, WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_SECRET,
+    WEBHOOK_MAX_CONNECTIONS, DB_PATH, WORKERS, SHARD_DB, WORKER_BASE_PORT, WORKER_QUEUE_MAX,
+    HANDOVER_LOCK, HANDOVER_TIMEOUT
+)
+from keep_alive import keep_alive, register_health_provider, set_bot_status, set_readiness, stop_keep_alive
+
+logger = logging.getLogger(__name__)
+
+BOT_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot.py")
+# How often cached worker /health and /metrics are refreshed
+POLL_INTERVAL = 2.0
+
+def owner(chat_id, count):
+    """Index of the worker that owns `chat_id`: the one ranked first by hashing (chat_id, index)"""
+    key = str(chat_id).encode()
+    return max(range(count), key=lambda index: blake2b(b"%d:%s" % (index, key), digest_size=8).digest())
+
+def shard_path(db_path, index):
+    """Database file of worker `index` with SHARD_DB"""
+    root, ext = os.path.splitext(db_path)
+    return f"{root}-shard{index}{ext or '.db'}"
+
+def update_chat_id(update):
+    """Chat an update belongs to, the sender for chat-less ones (e.g. inline queries), or None"""
+    for value in update.values():
+        if isinstance(value, dict):
+            chat = value.get("chat") or (value.get("message") or {}).get("chat")
+            if chat:
+                return chat.get("id")
+            sender = value.get("from") or value.get("user")
+            if sender:
+                return sender.get("id")
+    return None
+
+def has_messages(db_path):
+    """True if the database file exists and holds at least one message"""
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return conn.execute("SELECT EXISTS(SELECT 1 FROM messages)").fetchone()[0] == 1
+    except sqlite3.Error:
+        return False
+    finally:
+        conn.close()
+
+def check_layout(db_path, count):
+    """Record the shard count on first start; False if the shards on disk do not fit `count`"""
+    layout_path = os.path.join(os.path.dirname(os.path.abspath(db_path)), "shards.json")
+    if os.path.exists(layout_path):
+        with open(layout_path) as f:
+            created_for = json.load(f)["workers"]
+        if created_for != count:
+            logger.error(
+                f"❌ Shard databases were created for {created_for} workers; with WORKERS={count} "
+                f"chats would be routed away from their history. Start with WORKERS={created_for}."
+            )
+            return False
+        return True
+    if has_messages(db_path):
+        logger.error(
+            f"❌ {db_path} already holds messages that no shard would see. "
+            "Run the workers on the shared database (SHARD_DB=0) instead."
+        )
+        return False
+    with open(layout_path, "w") as f:
+        json.dump({"workers": count}, f)
+    return True
+
+class ApiError(Exception):
+    """Bot API call answered with ok=false"""
+    def __init__(self, code, description, retry_after=None):
+        super().__init__(f"{code}: {description}")
+        self.code = code
+        self.retry_after = retry_after
+
+class Worker:
+    """One bot.py worker process and the updates waiting for it"""
+    def __init__(self, index, port, env):
+        self.index = index
+        self.port = port
+        self.url = f"http://127.0.0.1:{port}"
+        self.env = env
+        self.process = None
+        self.queue = deque()  # (chat_id, update) in arrival order
+        self.ready = asyncio.Event()  # Set while the process is up and answering
+        self.wakeup = asyncio.Event()
+        self.health = None  # Last /health of the worker
+        self.metrics_text = ""
+        self.stats = {"forwarded": 0, "retries": 0, "rejected": 0, "dropped": 0, "restarts": 0}
+
+    @property
+    def up(self):
+        return self.ready.is_set()
+
+    def get_stats(self):
+        return {
+            "pid": self.process.pid if self.process else None,
+            "port": self.port,
+            "up": self.up,
+            "queued": len(self.queue),
+            **self.stats,
+            "health": self.health,
+        }
+
+class Dispatcher:
+    """Routes updates to the workers and keeps the workers running"""
+    def __init__(self, count, base_port, shard_db=False, max_queue=10000):
+        self.count = count
+        self.shard_db = shard_db
+        self.max_queue = max_queue
+        # Workers only take updates from the dispatcher
+        self.secret = secrets.token_hex(16)
+        self.workers = [Worker(index, base_port + index, self._worker_env(index, base_port + index))
+                        for index in range(count)]
+        self.session = None
+        self.stopping = False
+        self.offset = None  # Next getUpdates offset; everything before it was fetched
+        self.lease = Lease(HANDOVER_LOCK)
+        self.stats = {"updates": 0, "poll_errors": 0, "dropped": 0}
+
+        metrics.Callback("bot_dispatched_updates_total", "Updates routed to workers",
+                         lambda: self.stats["updates"], kind="counter")
+        metrics.Callback("bot_worker_up", "1 while the worker is up",
+                         lambda: {w.index: int(w.up) for w in self.workers}, label="worker")
+        metrics.Callback("bot_worker_queue_depth", "Updates waiting for the worker",
+                         lambda: {w.index: len(w.queue) for w in self.workers}, label="worker")
+        metrics.Callback("bot_worker_restarts_total", "Times the worker was restarted",
+                         lambda: {w.index: w.stats["restarts"] for w in self.workers}, kind="counter", label="worker")
+        metrics.Callback("bot_worker_dropped_updates_total", "Updates dropped from a full worker queue",
+                         lambda: {w.index: w.stats["dropped"] for w in self.workers}, kind="counter", label="worker")
+        metrics.Remote("worker", lambda: {w.index: w.metrics_text for w in self.workers if w.metrics_text})
+
+    def _worker_env(self, index, port):
+        env = dict(
+            os.environ,
+            WORKER_INDEX=str(index),
+            WORKERS=str(self.count),
+            BOT_MODE="webhook",
+            PORT=str(port),
+            WEBHOOK_URL="",
+            WEBHOOK_SECRET=self.secret,
+            # One update at a time, or a worker could reorder a chat's updates
+            CONCURRENT_UPDATES="1",
+        )
+        if self.shard_db:
+            env["DB_PATH"] = shard_path(DB_PATH, index)
+        return env
+
+    def submit(self, update):
+        """Queue an update for the worker that owns its chat"""
+        chat_id = update_chat_id(update)
+        worker = self.workers[owner(chat_id or 0, self.count)]
+        if len(worker.queue) >= self.max_queue:
+            dropped_chat, _ = worker.queue.popleft()
+            worker.stats["dropped"] += 1
+            self.stats["dropped"] += 1
+            if worker.stats["dropped"] % 1000 == 1:
+                logger.warning(
+                    f"⚠️ Worker {worker.index} queue full, dropping its oldest updates "
+                    f"(chat {dropped_chat}, {worker.stats['dropped']} dropped so far)"
+                )
+        worker.queue.append((chat_id, update))
+        worker.wakeup.set()
+        self.stats["updates"] += 1
+
+    async def feed(self, data):
+        """webhook.build_app feed for the dispatcher's own webhook"""
+        if not isinstance(data, dict) or "update_id" not in data:
+            raise ValueError("not an update")
+        self.submit(data)
+
+    async def _forward(self, worker):
+        """Deliver a worker's queue in order, one update at a time"""
+        url = worker.url + WEBHOOK_PATH
+        headers = {webhook.SECRET_HEADER: self.secret}
+        while True:
+            await worker.ready.wait()
+            if not worker.queue:
+                worker.wakeup.clear()
+                await worker.wakeup.wait()
+                continue
+            item = worker.queue[0]
+            try:
+                async with self.session.post(url, json=item[1], headers=headers) as response:
+                    status = response.status
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                status = None
+            if status in (200, 400):
+                # 400: the worker could not parse it, sending it again will not help
+                if worker.queue and worker.queue[0] is item:
+                    worker.queue.popleft()
+                worker.stats["forwarded" if status == 200 else "rejected"] += 1
+            else:
+                worker.stats["retries"] += 1
+                await asyncio.sleep(0.5)
+
+    async def _fetch(self, worker, path):
+        try:
+            async with self.session.get(worker.url + path, timeout=aiohttp.ClientTimeout(total=5)) as response:
+                if response.status == 200:
+                    return await response.text()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            pass
+        return None
+
+    async def _supervise(self, worker):
+        """Run the worker, starting it again with backoff whenever it exits"""
+        backoff = 1
+        while not self.stopping:
+            started = time.monotonic()
+            # Own session: a Ctrl-C reaches only the dispatcher, which stops workers after draining
+            worker.process = await asyncio.create_subprocess_exec(
+                sys.executable, BOT_SCRIPT, env=worker.env, start_new_session=True
+            )
+            logger.info(f"👷 Worker {worker.index} started (pid {worker.process.pid}, port {worker.port})")
+            exited = asyncio.ensure_future(worker.process.wait())
+            while not exited.done():
+                if await self._fetch(worker, "/health") is not None:
+                    worker.ready.set()
+                    logger.info(f"✅ Worker {worker.index} ready, {len(worker.queue)} updates waiting")
+                    break
+                await asyncio.wait([exited], timeout=0.2)
+            await exited
+            worker.ready.clear()
+            if self.stopping:
+                return
+            worker.stats["restarts"] += 1
+            if time.monotonic() - started > 60:
+                backoff = 1
+            logger.warning(
+                f"⚠️ Worker {worker.index} exited with {worker.process.returncode}, "
+                f"restarting in {backoff}s; its chats' updates are held until then"
+            )
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 30)
+
+    async def _poll_workers(self):
+        """Refresh the cached /health and /metrics of every worker"""
+        while True:
+            for worker in self.workers:
+                if not worker.up:
+                    continue
+                body = await self._fetch(worker, "/health")
+                worker.health = json.loads(body) if body else None
+                worker.metrics_text = await self._fetch(worker, "/metrics") or ""
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def get_stats(self):
+        up = sum(worker.up for worker in self.workers)
+        return {
+            "workers": self.count,
+            "up": up,
+            "degraded": up < self.count,
+            "shard_db": self.shard_db,
+            **self.stats,
+            "per_worker": {worker.index: worker.get_stats() for worker in self.workers},
+        }
+
+    async def api(self, method, **params):
+        """Call a Bot API method and return its result"""
+        url = f"{TELEGRAM_BASE_URL or 'https://api.telegram.org/bot'}{TELEGRAM_TOKEN}/{method}"
+        params = {key: value for key, value in params.items() if value is not None}
+        timeout = aiohttp.ClientTimeout(total=params.get("timeout", 0) + 30)
+        async with self.session.post(url, json=params, timeout=timeout) as response:
+            body = await response.json(content_type=None)
+        if not body.get("ok"):
+            retry_after = (body.get("parameters") or {}).get("retry_after")
+            raise ApiError(body.get("error_code"), body.get("description"), retry_after)
+        return body["result"]
+
+    async def poll(self):
+        """Long-poll getUpdates, confirming each batch by asking for the next offset"""
+        failures = 0
+        while True:
+            try:
+                updates = await self.api(
+                    "getUpdates", offset=self.offset, timeout=30, allowed_updates=Update.ALL_TYPES
+                )
+            except (ApiError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                self.stats["poll_errors"] += 1
+                failures += 1
+                delay = getattr(e, "retry_after", None) or min(30, 2 ** failures)
+                if getattr(e, "code", None) == 409:
+                    logger.warning("⚠️ Conflict: another instance is polling, retrying")
+                else:
+                    logger.warning(f"⚠️ getUpdates failed ({e}), retrying in {delay}s")
+                await asyncio.sleep(delay)
+                continue
+            failures = 0
+            for update in updates:
+                self.offset = update["update_id"] + 1
+                self.submit(update)
+
+    async def _confirm(self):
+        """After polling stopped: confirm every update the workers took, so the next
+        instance starts at the first one still queued here instead of fetching them again"""
+        queued = [update["update_id"] for worker in self.workers for _, update in worker.queue]
+        offset = min(queued) if queued else self.offset
+        if offset is None:
+            return
+        try:
+            await self.api("getUpdates", offset=offset, timeout=0, limit=1)
+        except (ApiError, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            logger.warning(f"⚠️ Could not confirm the last updates ({e}), the next instance may get them again")
+
+    async def _drain(self, timeout=10):
+        """Give the workers that are up a moment to take what is queued for them"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and any(w.up and w.queue for w in self.workers):
+            await asyncio.sleep(0.1)
+
+    async def _stop_workers(self, timeout=30):
+        self.stopping = True
+        running = [w.process for w in self.workers if w.process and w.process.returncode is None]
+        for process in running:
+            process.send_signal(signal.SIGTERM)
+        for process in running:
+            try:
+                await asyncio.wait_for(process.wait(), timeout)
+            except asyncio.TimeoutError:
+                process.kill()
+
+    async def run(self):
+        """Start the workers and the update source, and run until SIGINT/SIGTERM"""
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, stop.set)
+
+        def step_down():
+            set_readiness("stopping")
+            stop.set()
+
+        # Workers bind fixed ports, so they start once the old instance stopped its own
+        await self.lease.acquire(HANDOVER_TIMEOUT)
+        startup.mark("handover")
+        await self.lease.serve(step_down)
+
+        runner = None
+        poller = None
+        tasks = []
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
+            self.session = session
+            for worker in self.workers:
+                tasks.append(loop.create_task(self._supervise(worker)))
+                tasks.append(loop.create_task(self._forward(worker)))
+            tasks.append(loop.create_task(self._poll_workers()))
+            try:
+                if BOT_MODE == "webhook":
+                    register_health_provider("webhook", lambda: dict(webhook.stats))
+                    runner = web.AppRunner(
+                        webhook.build_app(self.feed, WEBHOOK_PATH, WEBHOOK_SECRET or None), access_log=None
+                    )
+                    await runner.setup()
+                    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+                    logger.info(f"🌐 Dispatcher listening on port {PORT}, updates at {WEBHOOK_PATH}")
+                    if WEBHOOK_URL:
+                        await self.api(
+                            "setWebhook",
+                            url=WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+                            secret_token=WEBHOOK_SECRET or None,
+                            allowed_updates=Update.ALL_TYPES,
+                            max_connections=WEBHOOK_MAX_CONNECTIONS
+                        )
+                        logger.info("🔗 Webhook registered")
+                else:
+                    keep_alive(PORT)
+                    await self.api("deleteWebhook")
+                    logger.info("🔄 Cleared webhooks")
+                    poller = loop.create_task(self.poll())
+                    tasks.append(poller)
+                logger.info(f"🚀 Dispatching to {self.count} workers")
+                set_readiness("ready")
+                startup.ready()
+                await stop.wait()
+            finally:
+                logger.info("🛑 Stopping dispatcher...")
+                set_readiness("stopping")
+                if runner is not None:
+                    await runner.cleanup()
+                if poller is not None:
+                    poller.cancel()  # No new updates
+                    await asyncio.gather(poller, return_exceptions=True)
+                await self._drain()
+                if poller is not None:
+                    await self._confirm()
+                await self._stop_workers()
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+                await self.lease.close_server()
+                stop_keep_alive()
+                self.lease.release()
+
+def main():
+    logging.basicConfig(
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        level=logging.INFO
+    )
+    if WORKERS < 2:
+        logger.error("❌ Multi-worker mode needs WORKERS of 2 or more")
+        sys.exit(1)
+    if SHARD_DB and not check_layout(DB_PATH, WORKERS):
+        sys.exit(1)
+    dispatcher = Dispatcher(WORKERS, WORKER_BASE_PORT, shard_db=SHARD_DB, max_queue=WORKER_QUEUE_MAX)
+    register_health_provider("workers", dispatcher.get_stats)
+    register_health_provider("handover", dispatcher.lease.get_stats)
+    register_health_provider("startup", startup.get_stats)
+    metrics.register_startup(startup)
+    startup.mark("imports")
+    set_bot_status(True)
+    try:
+        asyncio.run(dispatcher.run())
+    finally:
+        set_bot_status(False)
+
+if __name__ == "__main__":
+    main()
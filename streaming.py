@@ -0,0 +1,50 @@
+import logging
+
+logger = logging.getLogger(__name__)
+
+class ChunkedSummarizer:
+    """
+    Map-reduce summarization over a stream of message batches.
+    Each fixed-size chunk is reduced to its most representative messages in the
+    summary pool (map); those partial results are folded again whenever they
+    outgrow one chunk, and the final set is summarized once (reduce). Only one
+    chunk plus the partial results is ever held, so peak memory stays flat no
+    matter how long the window is.
+    """
+    def __init__(self, pool, chunk_size=2000, keep_per_chunk=40):
+        self.pool = pool
+        self.chunk_size = chunk_size
+        self.keep_per_chunk = keep_per_chunk
+        self.stats = {"streams": 0, "chunks": 0, "folds": 0}
+
+    async def _map(self, chunk):
+        return list(await self.pool.select_representatives(chunk, self.keep_per_chunk))
+
+    async def summarize(self, batches):
+        """Consume an async iterator of message batches: (summary, message count), or None if empty"""
+        self.stats["streams"] += 1
+        partials = []
+        chunk = []
+        total = 0
+        async for batch in batches:
+            total += len(batch)
+            chunk.extend(batch)
+            while len(chunk) >= self.chunk_size:
+                partials.extend(await self._map(chunk[:self.chunk_size]))
+                del chunk[:self.chunk_size]
+                self.stats["chunks"] += 1
+                if len(partials) >= self.chunk_size:
+                    partials = await self._map(partials)
+                    self.stats["folds"] += 1
+
+        if not total:
+            return None
+        if chunk:
+            # The last, partial chunk goes into the reduce step as-is
+            partials.extend(chunk)
+            self.stats["chunks"] += 1
+        logger.info(f"🧩 Reducing {len(partials)} partial messages from {total} messages")
+        return await self.pool.summarize(partials), total
+
+    def get_stats(self):
+        return dict(self.stats)
@@ -1,143 +1,231 @@
-from sumy.parsers.plaintext import PlaintextParser
-from sumy.nlp.tokenizers import Tokenizer
-from sumy.summarizers.luhn import LuhnSummarizer
-import logging
-
-logger = logging.getLogger(__name__)
-
-class Summarizer:
-    def __init__(self):
-        self.summarizer = LuhnSummarizer()
-    
-    def summarize(self, messages_list):
-        """
-        Optimized for large message volumes (up to 500+ messages)
-        messages_list: List of tuples (user_name, message_text, timestamp, [username])
-        """
-        if not messages_list or len(messages_list) == 0:
-            return "No messages to summarize!"
-        
-        num_messages = len(messages_list)
-        
-        # For very few messages, just show them nicely
-        if num_messages <= 5:
-            return self._format_few_messages(messages_list)
-        
-        # For large volumes (100+ messages), sample intelligently
-        if num_messages > 100:
-            messages_to_process = self._sample_messages(messages_list)
-            logger.info(f"📊 Sampled {len(messages_to_process)} from {num_messages} messages")
-        else:
-            messages_to_process = messages_list
-        
-        # Group consecutive messages by same user
-        grouped_text = self._group_by_user(messages_to_process)
-        
-        # Limit total text length for performance
-        if len(grouped_text) > 12000:
-            grouped_text = grouped_text[:12000]
-        
-        # Calculate summary length based on volume
-        num_sentences = self._get_sentence_count(num_messages)
-        
-        try:
-            parser = PlaintextParser.from_string(grouped_text, Tokenizer("english"))
-            summary_sentences = self.summarizer(parser.document, num_sentences)
-            
-            summary_parts = [str(sentence) for sentence in summary_sentences]
-            
-            if not summary_parts:
-                return self._fallback_summary(messages_list)
-            
-            return " ".join(summary_parts)
-        
-        except Exception as e:
-            logger.error(f"❌ Summarization error: {e}")
-            return self._fallback_summary(messages_list)
-    
-    def _format_few_messages(self, messages_list):
-        """Format a small number of messages nicely"""
-        result = []
-        for msg in messages_list:
-            name = msg[0]
-            text = msg[1]
-            username = msg[3] if len(msg) > 3 and msg[3] else None
-            
-            display_name = f"{name} (@{username})" if username else name
-            result.append(f"• *{display_name}*: {text}")
-        return "\n".join(result)
-    
-    def _sample_messages(self, messages_list):
-        """Intelligently sample messages for large volumes"""
-        num = len(messages_list)
-        chunk_size = max(10, num // 10)
-        
-        first_chunk = messages_list[:chunk_size]
-        last_chunk = messages_list[-chunk_size:]
-        
-        middle = messages_list[chunk_size:-chunk_size]
-        step = max(1, len(middle) // 80)
-        middle_sample = middle[::step]
-        
-        return first_chunk + middle_sample + last_chunk
-    
-    def _group_by_user(self, messages_list):
-        """Group messages and format with speaker attribution"""
-        formatted_parts = []
-        current_user = None
-        current_messages = []
-        
-        for msg in messages_list:
-            user_name = msg[0]
-            message_text = msg[1][:200]  # Truncate long messages
-            
-            if user_name == current_user:
-                current_messages.append(message_text)
-            else:
-                if current_user and current_messages:
-                    combined = " ".join(current_messages)
-                    formatted_parts.append(f"{current_user} said: {combined}.")
-                current_user = user_name
-                current_messages = [message_text]
-        
-        # Don't forget the last group
-        if current_user and current_messages:
-            combined = " ".join(current_messages)
-            formatted_parts.append(f"{current_user} said: {combined}.")
-        
-        return " ".join(formatted_parts)
-    
-    def _get_sentence_count(self, num_messages):
-        """Determine summary length based on message count"""
-        if num_messages < 20:
-            return 3
-        elif num_messages < 50:
-            return 4
-        elif num_messages < 100:
-            return 5
-        else:
-            return 8
-    
-    def _fallback_summary(self, messages_list):
-        """Fallback method: Extract key messages"""
-        num = len(messages_list)
-        
-        if num <= 10:
-            selected = messages_list
-        else:
-            # Get first 3, middle 3, last 3
-            first = messages_list[:3]
-            middle_idx = num // 2
-            middle = messages_list[middle_idx-1:middle_idx+2]
-            last = messages_list[-3:]
-            selected = first + middle + last
-        
-        result = []
-        for msg in selected:
-            name = msg[0]
-            text = msg[1]
-            if len(text) > 80:
-                text = text[:80] + "..."
-            result.append(f"• {name}: {text}")
-        
-        return "\n".join(result)
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+BACKENDS = ("luhn", "tfidf")
+
+class Summarizer:
+    def __init__(self, backend="luhn"):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown summarizer backend {backend!r}, expected one of {BACKENDS}")
+        self.backend = backend
+        self.tokenizer = None
+        self.summarizer = None
+        self.vector_engine = None
+        # Seconds per stage since the last take_timings(), reported as metrics by the pool
+        self.timings = {}
+    
+    def _get_vector_engine(self):
+        """TF-IDF engine, imported on first use so NumPy only loads when needed"""
+        if self.vector_engine is None:
+            from tfidf_summarizer import TfidfSummarizer
+            self.vector_engine = TfidfSummarizer()
+        return self.vector_engine
+    
+    def _get_tokenizer(self):
+        """Built once and reused; creating it loads the NLTK punkt model from disk"""
+        if self.tokenizer is None:
+            from sumy.nlp.tokenizers import Tokenizer
+            self.tokenizer = Tokenizer("english")
+        return self.tokenizer
+
+    def _get_summarizer(self):
+        """Luhn summarizer, imported on first use so sumy/NLTK load during warm-up, not at import"""
+        if self.summarizer is None:
+            from sumy.summarizers.luhn import LuhnSummarizer
+            self.summarizer = LuhnSummarizer()
+        return self.summarizer
+    
+    def _mark(self, stage, start):
+        """Add the time since `start` to a stage; returns now, the start of the next stage"""
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - start
+        return now
+    
+    def take_timings(self):
+        """Stage durations recorded since the last call (including the TF-IDF engine's)"""
+        timings = self.timings
+        self.timings = {}
+        if self.vector_engine is not None and self.vector_engine.timings:
+            timings.update(self.vector_engine.timings)
+            self.vector_engine.timings = {}
+        return timings
+    
+    def warm_up(self):
+        """Run a tiny summary so lazy NLTK/sumy loading happens before the first real request"""
+        sample = [("Warmup", f"Warm up message number {i}. It has two sentences.", None) for i in range(8)]
+        self.summarize(sample)
+        self.take_timings()
+    
+    def summarize(self, messages_list, focus=None):
+        """
+        Optimized for large message volumes (up to 500+ messages)
+        messages_list: List of tuples (user_name, message_text, timestamp, [username])
+        focus: optional search terms; the tfidf backend boosts sentences containing them
+        """
+        if not messages_list or len(messages_list) == 0:
+            return "No messages to summarize!"
+        
+        num_messages = len(messages_list)
+        
+        # For very few messages, just show them nicely
+        if num_messages <= 5:
+            return self._format_few_messages(messages_list)
+        
+        if self.backend == "tfidf":
+            return self._summarize_vectorized(messages_list, focus)
+        
+        start = time.perf_counter()
+        # For large volumes (100+ messages), sample intelligently
+        if num_messages > 100:
+            messages_to_process = self._sample_messages(messages_list)
+            logger.info(f"📊 Sampled {len(messages_to_process)} from {num_messages} messages")
+        else:
+            messages_to_process = messages_list
+        
+        start = self._mark("luhn.sample", start)
+        
+        # Group consecutive messages by same user
+        grouped_text = self._group_by_user(messages_to_process)
+        
+        # Limit total text length for performance
+        if len(grouped_text) > 12000:
+            grouped_text = grouped_text[:12000]
+        
+        # Calculate summary length based on volume
+        num_sentences = self._get_sentence_count(num_messages)
+        
+        start = self._mark("luhn.group", start)
+        
+        try:
+            from sumy.parsers.plaintext import PlaintextParser
+            parser = PlaintextParser.from_string(grouped_text, self._get_tokenizer())
+            start = self._mark("luhn.parse", start)
+            summary_sentences = self._get_summarizer()(parser.document, num_sentences)
+            self._mark("luhn.rank", start)
+            
+            summary_parts = [str(sentence) for sentence in summary_sentences]
+            
+            if not summary_parts:
+                return self._fallback_summary(messages_list)
+            
+            return " ".join(summary_parts)
+        
+        except Exception as e:
+            logger.error(f"❌ Summarization error: {e}")
+            return self._fallback_summary(messages_list)
+    
+    def select_representatives(self, messages_list, k):
+        """The k messages that best represent a slice of chat, in chat order.
+        Used to store pre-summarized time segments that can be merged later.
+        Always ranked by the TF-IDF engine, whatever the backend: Luhn picks
+        sentences, not messages. Without NumPy the picks are evenly spaced."""
+        if len(messages_list) <= k:
+            return list(messages_list)
+        try:
+            chosen = self._get_vector_engine().select_messages(messages_list, k)
+        except Exception as e:
+            logger.error(f"❌ Representative selection error: {e}")
+            chosen = []
+        if not chosen:
+            step = len(messages_list) / k
+            chosen = [int(i * step) for i in range(k)]
+        return [messages_list[i] for i in chosen]
+    
+    def _summarize_vectorized(self, messages_list, focus=None):
+        """TF-IDF backend: scores every message, no sampling or truncation"""
+        num_sentences = self._get_sentence_count(len(messages_list))
+        try:
+            summary = self._get_vector_engine().summarize(messages_list, num_sentences, focus)
+            return summary or self._fallback_summary(messages_list)
+        except Exception as e:
+            logger.error(f"❌ Vectorized summarization error: {e}")
+            return self._fallback_summary(messages_list)
+    
+    def _format_few_messages(self, messages_list):
+        """Format a small number of messages nicely"""
+        result = []
+        for msg in messages_list:
+            name = msg[0]
+            text = msg[1]
+            username = msg[3] if len(msg) > 3 and msg[3] else None
+            
+            display_name = f"{name} (@{username})" if username else name
+            result.append(f"• *{display_name}*: {text}")
+        return "\n".join(result)
+    
+    def _sample_messages(self, messages_list):
+        """Intelligently sample messages for large volumes"""
+        num = len(messages_list)
+        chunk_size = max(10, num // 10)
+        
+        first_chunk = messages_list[:chunk_size]
+        last_chunk = messages_list[-chunk_size:]
+        
+        middle = messages_list[chunk_size:-chunk_size]
+        step = max(1, len(middle) // 80)
+        middle_sample = middle[::step]
+        
+        return first_chunk + middle_sample + last_chunk
+    
+    def _group_by_user(self, messages_list):
+        """Group messages and format with speaker attribution"""
+        formatted_parts = []
+        current_user = None
+        current_messages = []
+        
+        for msg in messages_list:
+            user_name = msg[0]
+            message_text = msg[1][:200]  # Truncate long messages
+            
+            if user_name == current_user:
+                current_messages.append(message_text)
+            else:
+                if current_user and current_messages:
+                    combined = " ".join(current_messages)
+                    formatted_parts.append(f"{current_user} said: {combined}.")
+                current_user = user_name
+                current_messages = [message_text]
+        
+        # Don't forget the last group
+        if current_user and current_messages:
+            combined = " ".join(current_messages)
+            formatted_parts.append(f"{current_user} said: {combined}.")
+        
+        return " ".join(formatted_parts)
+    
+    def _get_sentence_count(self, num_messages):
+        """Determine summary length based on message count"""
+        if num_messages < 20:
+            return 3
+        elif num_messages < 50:
+            return 4
+        elif num_messages < 100:
+            return 5
+        else:
+            return 8
+    
+    def _fallback_summary(self, messages_list):
+        """Fallback method: Extract key messages"""
+        num = len(messages_list)
+        
+        if num <= 10:
+            selected = messages_list
+        else:
+            # Get first 3, middle 3, last 3
+            first = messages_list[:3]
+            middle_idx = num // 2
+            middle = messages_list[middle_idx-1:middle_idx+2]
+            last = messages_list[-3:]
+            selected = first + middle + last
+        
+        result = []
+        for msg in selected:
+            name = msg[0]
+            text = msg[1]
+            if len(text) > 80:
+                text = text[:80] + "..."
+            result.append(f"• {name}: {text}")
+        
+        return "\n".join(result)
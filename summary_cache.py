@@ -0,0 +1,107 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+class SummaryCache:
+    """
+    LRU cache of finished summaries keyed by (chat_id, command, window, persons).
+    An entry is only valid for the chat's high-water message id it was built
+    from, so any new message in the chat invalidates it. Concurrent requests for
+    the same key and high-water mark share a single computation.
+    """
+    def __init__(self, max_bytes=8 * 1024 * 1024, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # key -> (high_water, value, size, compute_seconds, created_at)
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._bytes = 0
+        self.stats = {
+            "hits": 0,
+            "misses": 0,
+            "shared": 0,
+            "evictions": 0,
+            "saved_seconds": 0.0,
+        }
+
+    @staticmethod
+    def _size_of(value):
+        """Rough memory cost of a cached value"""
+        return len(repr(value)) + 200
+
+    def _lookup(self, key, high_water):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        entry_high_water, value, size, cost, created_at = entry
+        if entry_high_water != high_water or time.monotonic() - created_at > self.ttl:
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        self.stats["saved_seconds"] += cost
+        return entry
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _store(self, key, high_water, value, cost):
+        size = self._size_of(value)
+        if size > self.max_bytes:
+            return
+        self._remove(key)
+        self._entries[key] = (high_water, value, size, cost, time.monotonic())
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    async def get_or_compute(self, key, high_water, compute):
+        """Return the cached value for key at this high-water mark, or await compute() once.
+        high_water=None skips the cache entirely."""
+        if high_water is None:
+            return await compute()
+
+        entry = self._lookup(key, high_water)
+        if entry is not None:
+            return entry[1]
+
+        flight_key = (key, high_water)
+        future = self._in_flight.get(flight_key)
+        if future is not None:
+            self.stats["shared"] += 1
+            return await asyncio.shield(future)
+
+        self.stats["misses"] += 1
+        future = asyncio.get_running_loop().create_future()
+        # Avoid "exception never retrieved" warnings when nobody else was waiting
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._in_flight[flight_key] = future
+        start = time.perf_counter()
+        try:
+            value = await compute()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            del self._in_flight[flight_key]
+
+        self._store(key, high_water, value, time.perf_counter() - start)
+        future.set_result(value)
+        return value
+
+    def get_stats(self):
+        """Hit rate and time saved, for /health"""
+        lookups = self.stats["hits"] + self.stats["misses"] + self.stats["shared"]
+        snapshot = dict(self.stats)
+        snapshot["saved_seconds"] = round(snapshot["saved_seconds"], 3)
+        snapshot["hit_rate"] = round((self.stats["hits"] + self.stats["shared"]) / lookups, 3) if lookups else 0.0
+        snapshot["entries"] = len(self._entries)
+        snapshot["bytes"] = self._bytes
+        return snapshot
@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import tracing
+from metrics import SUMMARY_SECONDS, SUMMARY_STAGE_SECONDS
+from summarizer import Summarizer
+
+logger = logging.getLogger(__name__)
+
+# One warm Summarizer per worker process, built by the pool initializer
+_worker_summarizer = None
+
+def _init_worker(backend):
+    """Pool initializer: load tokenizer, stemmer and summarizer once per process"""
+    global _worker_summarizer
+    _worker_summarizer = Summarizer(backend)
+    _worker_summarizer.warm_up()
+
+def _ping():
+    return True
+
+def _run_job(method, args):
+    """Call a Summarizer method inside a worker; returns (result, stage timings)"""
+    return _call_local(_worker_summarizer, method, args)
+
+def _call_local(summarizer, method, args):
+    result = getattr(summarizer, method)(*args)
+    return result, summarizer.take_timings()
+
+class SummarizerBusy(Exception):
+    """Raised when the pool already has as many jobs as it is allowed to queue"""
+
+class SummaryPool:
+    """
+    Runs Summarizer.summarize in worker processes so Luhn/NLTK work never
+    blocks the event loop and summaries for different chats use all cores.
+    With workers=0 summaries run in a thread in this process instead.
+    """
+    def __init__(self, workers=2, timeout=20.0, max_pending=8, backend="luhn"):
+        self.workers = workers
+        self.backend = backend
+        self.timeout = timeout
+        self.max_pending = max_pending
+        # Used for the inline mode and for timeouts/crashes
+        self.local = Summarizer(backend)
+        self._executor = None
+        self._warming = []
+        self._in_flight = 0
+        self.stats = {
+            "completed": 0,
+            "timeouts": 0,
+            "rejected": 0,
+            "errors": 0,
+            "last_ms": 0.0,
+        }
+
+    def start(self):
+        """Fork the workers and warm them up before any request arrives"""
+        if self.workers <= 0:
+            self.local.warm_up()
+            logger.info("🧠 Summarizer running inline (SUMMARY_WORKERS=0)")
+            return self
+        self.local.warm_up()
+        # forkserver, not fork: this process already runs threads (ingest, database),
+        # and forking those can copy a held lock. Each worker loads sumy/NLTK in
+        # _init_worker; like any spawned process it also imports the main module as
+        # __mp_main__ (its __main__ guard keeps it from starting the bot).
+        context = multiprocessing.get_context("forkserver")
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=context,
+            initializer=_init_worker,
+            initargs=(self.backend,),
+        )
+        self._warming = [self._executor.submit(_ping) for _ in range(self.workers)]
+        logger.info(f"🧠 Summarizer pool started with {self.workers} workers ({self.backend})")
+        return self
+
+    def wait_ready(self, timeout=60.0):
+        """Block until every worker has warmed up (or `timeout` passed); True if they all did"""
+        if self._executor is None:
+            return True
+        done, pending = wait(self._warming, timeout)
+        return not pending and all(future.exception() is None for future in done)
+
+    def _job_done(self, future):
+        self._in_flight -= 1
+
+    async def summarize(self, messages_list, focus=None):
+        """Summarize off the event loop. Raises SummarizerBusy when saturated,
+        falls back to the quick extractive summary on timeout."""
+        return await self._run(
+            "summarize", (messages_list, focus),
+            lambda: self.local._fallback_summary(messages_list)
+        )
+
+    async def select_representatives(self, messages_list, k):
+        """Pick the k messages that best represent a slice of chat, off the event loop"""
+        return await self._run(
+            "select_representatives", (messages_list, k),
+            lambda: list(messages_list[::max(1, len(messages_list) // k)][:k])
+        )
+
+    async def _run(self, method, args, fallback):
+        """Run a Summarizer method in a worker; `fallback()` answers on timeout or failure"""
+        if self._in_flight >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise SummarizerBusy()
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        executor = self._executor
+        self._in_flight += 1
+        try:
+            if executor is None:
+                future = loop.run_in_executor(None, _call_local, self.local, method, args)
+            else:
+                future = loop.run_in_executor(executor, _run_job, method, args)
+        except BrokenProcessPool:
+            self._in_flight -= 1
+            return await self._recover(executor, fallback)
+        # In-flight counts jobs still occupying a worker, even after we stop waiting
+        future.add_done_callback(self._job_done)
+
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future), self.timeout)
+        except asyncio.TimeoutError:
+            self.stats["timeouts"] += 1
+            logger.warning(f"⏱️ {method} on {len(args[0])} messages timed out after {self.timeout}s")
+            return fallback()
+        except BrokenProcessPool:
+            return await self._recover(executor, fallback)
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.error(f"❌ Summary worker error: {e}")
+            return fallback()
+
+        result, timings = result
+        elapsed = time.perf_counter() - start
+        for stage, seconds in timings.items():
+            SUMMARY_STAGE_SECONDS.observe(stage, seconds)
+            tracing.record(stage, seconds)
+        SUMMARY_SECONDS.observe(method, elapsed)
+        tracing.record(f"summarizer.{method}", elapsed)
+        self.stats["completed"] += 1
+        self.stats["last_ms"] = round(elapsed * 1000, 1)
+        return result
+
+    async def _recover(self, broken, fallback):
+        """A worker died: rebuild the pool off the event loop and answer this request
+        with the fallback. Jobs sent meanwhile run inline."""
+        self.stats["errors"] += 1
+        # Only the first job to see the broken pool restarts it
+        if broken is not None and self._executor is broken:
+            logger.error("❌ Summarizer pool broken, restarting workers")
+            self._executor = None
+            broken.shutdown(wait=False, cancel_futures=True)
+            await asyncio.get_running_loop().run_in_executor(None, self.start)
+        return fallback()
+
+    def get_stats(self):
+        snapshot = dict(self.stats)
+        snapshot["in_flight"] = self._in_flight
+        snapshot["workers"] = self.workers
+        return snapshot
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,123 @@
+"""
+Behavior checks for the storage path: ingest queue, hot tier, paging, search
+queries, name lookup.
+
+    python -m pytest tests
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import MessageDB
+from hot_tier import HotTier
+from ingest import IngestQueue
+from search import match_query
+from timeutils import now_ts
+
+def make_db(tmp_path):
+    return MessageDB(str(tmp_path / "messages.db"))
+
+def test_ingest_flushes_in_batches_and_drains_on_close(tmp_path):
+    db = make_db(tmp_path)
+    queue = IngestQueue(db, batch_size=2, flush_interval=60)
+    for i in range(5):
+        assert queue.put(-100, 1, "Ann", "ann", f"message {i}", 1700000000 + i, i + 1)
+    assert queue.flush() == 5
+    queue.put(-100, 1, "Ann", "ann", "last one", 1700000010, 6)
+    queue.put(-100, 1, "Ann", "ann", "last one", 1700000010, 6)  # Redelivered
+    queue.close()
+    assert queue.depth() == 0
+    assert len(db.get_messages_between(-100, 0, 1800000000)) == 6
+    db.close()
+
+class FailingDB:
+    """add_messages always fails; `during` runs first, like puts arriving mid-flush"""
+    def __init__(self, during=None):
+        self.calls = 0
+        self.during = during
+
+    def add_messages(self, rows):
+        self.calls += 1
+        if self.during is not None:
+            self.during()
+        raise RuntimeError("database is locked")
+
+def test_ingest_put_refuses_when_full_instead_of_flushing():
+    db = FailingDB()
+    queue = IngestQueue(db, batch_size=100, flush_interval=60, max_pending=3)
+    accepted = [queue.put(-100, 1, "Ann", "ann", f"message {i}", 1700000000, i) for i in range(5)]
+    assert accepted == [True, True, True, False, False]
+    assert db.calls == 0
+    assert queue.get_stats()["dropped"] == 2
+
+def test_ingest_failed_flush_requeues_at_most_max_pending():
+    db = FailingDB(during=lambda: queue.put(-100, 2, "Bob", "bob", "arrived mid-flush", 1700000001, 99))
+    queue = IngestQueue(db, batch_size=100, flush_interval=60, max_pending=3)
+    for i in range(3):
+        queue.put(-100, 1, "Ann", "ann", f"message {i}", 1700000000, i)
+    assert queue.flush() == 0
+    stats = queue.get_stats()
+    assert stats["depth"] == 3
+    assert stats["failed_flushes"] == 1
+    assert stats["dropped"] == 1
+
+def test_search_terms_match_only_message_bodies(tmp_path):
+    db = make_db(tmp_path)
+    if not db._message_fts_available():
+        pytest.skip("SQLite built without FTS5")
+    db.add_messages([
+        (-100123, 1, "Ann", "ann", "deploy went fine", 1700000000, 1),
+        (-100123, 2, "Bob", "bob", "coffee anyone?", 1700000001, 2),
+        (-100123, 1, "Ann", "ann", "lunch at noon", 1700000002, 3),
+    ])
+    for term, expected in (("c", ["coffee anyone?"]), ("cn", []), ("cn100123", []),
+                           ("lunch", ["lunch at noon"])):
+        hits = db.search_messages(-100123, match_query(-100123, [term]))
+        assert [text for _, text, _, _ in hits] == expected, term
+    db.close()
+
+def test_short_person_name_resolves_within_the_chat(tmp_path):
+    db = make_db(tmp_path)
+    now = now_ts()
+    # Many namesakes elsewhere must not crowd out the one in this chat
+    db.add_messages([(-200, 100 + i, f"Al{i}", None, "elsewhere", now - 60, i + 1) for i in range(60)])
+    db.add_messages([
+        (-100, 1, "Sal", "sal_x", "hello", now - 30, 1),
+        (-100, 2, "Bob", "bobby", "hi", now - 20, 2),
+    ])
+    assert db.resolve_user_ids(-100, ["al"], hours=1) == [1]
+    assert db.resolve_user_ids(-100, ["ob"], hours=1) == [2]
+    assert db.resolve_user_ids(-100, ["@bo"], hours=1) == [2]
+    assert [m[1] for m in db.get_messages_by_person(-100, ["al"], hours=1)] == ["hello"]
+    db.close()
+
+def test_message_pages_cover_the_window_once_across_equal_timestamps(tmp_path):
+    db = make_db(tmp_path)
+    # Seven messages per second, so pages of 10 split runs of equal timestamps
+    db.add_messages([(-100, 1, "Ann", "ann", f"message {i}", 1700000000 + i // 7, i + 1) for i in range(95)])
+    texts = []
+    after = None
+    while True:
+        page, after = db.get_messages_page(-100, 1700000001, 1700000013, after, limit=10)
+        texts.extend(text for _, text, _, _ in page)
+        if after is None:
+            break
+    assert texts == [f"message {i}" for i in range(7, 91)]
+    db.close()
+
+def test_hot_tier_skips_redelivered_messages(tmp_path):
+    db = make_db(tmp_path)
+    now = now_ts()
+    db.add_messages([(-100, 1, "Ann", "ann", f"message {i}", now - 100 + i, i + 1) for i in range(3)])
+    tier = HotTier()
+    tier.warm(db, 1)
+    tier.put(-100, "Ann", "ann", "message 2", now - 98, 3)  # Already loaded by warm()
+    tier.put(-100, "Ann", "ann", "message 3", now - 90, 4)
+    tier.put(-100, "Ann", "ann", "message 3", now - 90, 4)  # Redelivered
+    messages, db_end = tier.split(-100, now - 3600, now + 1)
+    assert db_end <= now - 3600
+    assert [text for _, text, _, _ in messages] == [f"message {i}" for i in range(4)]
+    db.close()
@@ -0,0 +1,179 @@
+import logging
+import time
+from array import array
+
+import numpy as np
+
+from analysis import STOP_WORDS, TOKEN_RE, Analyzer, split_sentences, unpack_vector
+
+logger = logging.getLogger(__name__)
+
+# Sentences shorter than this many content words are down-weighted
+MIN_USEFUL_TERMS = 4
+# Candidates considered by the redundancy-aware selection
+CANDIDATE_POOL = 60
+# Max cosine similarity allowed between two picked sentences
+REDUNDANCY_LIMIT = 0.6
+# Extra weight for sentences containing a focus term (e.g. /catchup about X)
+FOCUS_BOOST = 1.0
+
+class TfidfSummarizer:
+    """
+    Extractive summarizer that scores every sentence of every message.
+    Sentences become rows of a sparse TF-IDF matrix (kept as COO arrays);
+    each is scored by cosine similarity to the chat's centroid, then the top
+    sentences are picked while skipping near-duplicates.
+    Cost is linear in the number of tokens, so no sampling or truncation is needed.
+    """
+    def __init__(self):
+        self.analyzer = Analyzer()
+        self.timings = {}  # Seconds per stage, collected by Summarizer.take_timings
+
+    def _mark(self, stage, start):
+        now = time.perf_counter()
+        self.timings[stage] = self.timings.get(stage, 0.0) + now - start
+        return now
+
+    def split_units(self, messages_list):
+        """(speaker, sentence) units in chat order, and how many units each message has"""
+        units = []
+        sizes = []
+        for msg in messages_list:
+            sentences = split_sentences(msg[1])
+            units.extend((msg[0], sentence) for sentence in sentences)
+            sizes.append(len(sentences))
+        return units, sizes
+
+    def message_vectors(self, messages_list):
+        """Packed term vector of each message: the one stored at ingest (fifth column)
+        when there is one, otherwise analyzed now the same way"""
+        for msg in messages_list:
+            vector = msg[4] if len(msg) > 4 else None
+            if vector is None:
+                vector, _ = self.analyzer.analyze(msg[1])
+            yield vector
+
+    def build_matrix(self, messages_list, sizes=None):
+        """Sparse term counts as (rows, cols, counts, vocab_size). Rows are sentences
+        (given each message's sentence count in `sizes`) or, without sizes, whole messages."""
+        ids = array("I")
+        sentences = array("H")
+        counts = array("H")
+        lengths = []
+        for vector in self.message_vectors(messages_list):
+            term_ids, sentence_index, term_counts = unpack_vector(vector)
+            ids.extend(term_ids)
+            sentences.extend(sentence_index)
+            counts.extend(term_counts)
+            lengths.append(len(term_ids))
+        if not ids:
+            return self.matrix_from_pairs([], [], [], 0)
+
+        lengths = np.asarray(lengths, dtype=np.int64)
+        if sizes is None:
+            rows = np.repeat(np.arange(len(messages_list), dtype=np.int64), lengths)
+        else:
+            offsets = np.concatenate(([0], np.cumsum(sizes)[:-1])).astype(np.int64)
+            rows = np.repeat(offsets, lengths) + np.frombuffer(sentences, dtype=np.uint16)
+        # Hashed term ids -> dense 0..vocab_size-1
+        terms, cols = np.unique(np.frombuffer(ids, dtype=np.uint32), return_inverse=True)
+        return self.matrix_from_pairs(rows, cols, np.frombuffer(counts, dtype=np.uint16), terms.size)
+
+    def matrix_from_pairs(self, rows, cols, counts, vocab_size):
+        """Collapse repeated (row, term) pairs into unique entries, summing their counts"""
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        counts = np.asarray(counts, dtype=np.float64)
+        if rows.size == 0:
+            return rows, cols, counts, vocab_size
+        keys, inverse = np.unique(rows * vocab_size + cols, return_inverse=True)
+        summed = np.bincount(inverse, weights=counts, minlength=keys.size)
+        return keys // vocab_size, keys % vocab_size, summed, vocab_size
+
+    def score(self, rows, cols, counts, num_rows, vocab_size):
+        """Centroid cosine score per row, plus the normalized TF-IDF weights"""
+        if rows.size == 0:
+            return np.zeros(num_rows), counts
+        df = np.bincount(cols, minlength=vocab_size)
+        idf = np.log((1 + num_rows) / (1 + df)) + 1.0
+        weights = np.log1p(counts) * idf[cols]
+
+        norms = np.sqrt(np.bincount(rows, weights=weights * weights, minlength=num_rows))
+        norms[norms == 0] = 1.0
+        weights = weights / norms[rows]
+
+        centroid = np.bincount(cols, weights=weights, minlength=vocab_size) / num_rows
+        scores = np.bincount(rows, weights=weights * centroid[cols], minlength=num_rows)
+
+        # Very short sentences ("ok thanks") should not win on a single shared word
+        term_counts = np.bincount(rows, minlength=num_rows)
+        scores *= np.minimum(1.0, term_counts / MIN_USEFUL_TERMS)
+        return scores, weights
+
+    def select(self, scores, rows, cols, weights, num_sentences):
+        """Greedy top-k by score, skipping sentences too similar to ones already picked"""
+        order = np.argsort(-scores, kind="stable")[:CANDIDATE_POOL]
+        order = order[scores[order] > 0]
+        if order.size == 0:
+            return []
+
+        # Dense vectors for the candidates only, over the terms they use
+        mask = np.isin(rows, order)
+        cand_rows, cand_cols, cand_weights = rows[mask], cols[mask], weights[mask]
+        terms, term_index = np.unique(cand_cols, return_inverse=True)
+        position = {row: i for i, row in enumerate(order.tolist())}
+        dense = np.zeros((order.size, terms.size))
+        dense[[position[r] for r in cand_rows.tolist()], term_index] = cand_weights
+
+        picked = []
+        for i in range(order.size):
+            if picked and np.max(dense[picked] @ dense[i]) > REDUNDANCY_LIMIT:
+                continue
+            picked.append(i)
+            if len(picked) >= num_sentences:
+                break
+        # Very repetitive chats: top up with the best remaining candidates
+        for i in range(order.size):
+            if len(picked) >= num_sentences:
+                break
+            if i not in picked:
+                picked.append(i)
+        return sorted(int(order[i]) for i in picked)
+
+    def focus_mask(self, units, focus):
+        """1.0 for sentences containing a word that starts with one of the focus terms"""
+        findall = TOKEN_RE.findall
+        prefixes = tuple(focus)
+        return np.fromiter(
+            (any(token.startswith(prefixes) for token in findall(sentence.lower())) for _, sentence in units),
+            dtype=np.float64, count=len(units)
+        )
+
+    def summarize(self, messages_list, num_sentences, focus=None):
+        """Top sentences of the whole window, in chat order, with speaker attribution.
+        Sentences matching any `focus` term are boosted."""
+        start = time.perf_counter()
+        units, sizes = self.split_units(messages_list)
+        if not units:
+            return ""
+        start = self._mark("tfidf.units", start)
+        rows, cols, counts, vocab_size = self.build_matrix(messages_list, sizes)
+        start = self._mark("tfidf.matrix", start)
+        scores, weights = self.score(rows, cols, counts, len(units), vocab_size)
+        if focus:
+            scores *= 1.0 + FOCUS_BOOST * self.focus_mask(units, focus)
+        start = self._mark("tfidf.score", start)
+        chosen = self.select(scores, rows, cols, weights, num_sentences)
+        self._mark("tfidf.select", start)
+        return " ".join(f"{units[i][0]} said: {units[i][1]}" for i in chosen)
+
+    def select_messages(self, messages_list, k):
+        """Indices of the k most central, non-redundant whole messages, in chat order"""
+        start = time.perf_counter()
+        rows, cols, counts, vocab_size = self.build_matrix(messages_list)
+        start = self._mark("tfidf.matrix", start)
+        scores, weights = self.score(rows, cols, counts, len(messages_list), vocab_size)
+        start = self._mark("tfidf.score", start)
+        chosen = self.select(scores, rows, cols, weights, k)
+        self._mark("tfidf.select", start)
+        return chosen
@@ -0,0 +1,55 @@
+import time
+from datetime import datetime, time as clock_time, timedelta
+from zoneinfo import ZoneInfo
+
+from config import BOT_TIMEZONE
+
+_zone = ZoneInfo(BOT_TIMEZONE) if BOT_TIMEZONE else None
+
+def _localize(naive):
+    """Attach the bot's timezone to a naive wall-clock datetime (DST aware)"""
+    if _zone is not None:
+        return naive.replace(tzinfo=_zone)
+    return naive.astimezone()
+
+def now_ts():
+    """Current time as integer epoch seconds (UTC)"""
+    return int(time.time())
+
+def local_datetime(ts):
+    """Epoch seconds as an aware datetime in the bot's timezone"""
+    if _zone is not None:
+        return datetime.fromtimestamp(ts, _zone)
+    return datetime.fromtimestamp(ts).astimezone()
+
+def local_day(ts=None):
+    """The local calendar day containing epoch `ts` (default: now)"""
+    return local_datetime(time.time() if ts is None else ts).date()
+
+def day_bounds(day=None):
+    """[start, end) epoch seconds of a local calendar day (default: today)"""
+    if day is None:
+        day = local_day()
+    next_day = day + timedelta(days=1)
+    start = _localize(datetime(day.year, day.month, day.day))
+    end = _localize(datetime(next_day.year, next_day.month, next_day.day))
+    return int(start.timestamp()), int(end.timestamp())
+
+def hours_ago_ts(hours):
+    """Epoch seconds `hours` hours before now"""
+    return int(time.time() - hours * 3600)
+
+# Open upper bound for "last N hours" windows
+END_OF_TIME = 2 ** 62
+
+def window_bounds(hours=None):
+    """[start, end) epoch seconds of the last `hours` hours, or of today if hours is None"""
+    if hours:
+        return hours_ago_ts(hours), END_OF_TIME
+    return day_bounds()
+
+def local_time(text):
+    """'HH:MM' as a timezone-aware time of day in the bot's timezone (for scheduled jobs)"""
+    hour, minute = (int(part) for part in text.split(":"))
+    zone = _zone if _zone is not None else datetime.now().astimezone().tzinfo
+    return clock_time(hour, minute, tzinfo=zone)
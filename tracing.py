@@ -0,0 +1,149 @@
+"""
+Per-request stage timings for heavy commands (/catchup, /person).
+
+A handler wrapped with @traced gets a Trace in a context variable; the async
+DB wrappers, the summarizer pool (including the stage timings measured in
+the worker) and the reply send add spans to it while it is active, and do
+nothing otherwise. The reply send is followed without waiting for it, so a
+rate-limited reply does not hold the handler; the trace is logged once the
+send is done. Traces slower than the threshold are written as one JSON
+object per line, with the window's message count, so slow stages can be
+compared across chat sizes. Admins can get the breakdown under the reply.
+"""
+import contextvars
+import functools
+import json
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+# JSON lines of slow traces; its own logger so it can be routed to a file
+trace_logger = logging.getLogger("trace")
+
+_current = contextvars.ContextVar("trace", default=None)
+_settings = {"slow_ms": 2000.0}
+
+def configure(slow_ms=2000.0, log_path=None):
+    """Slow-trace threshold, and optionally a file that gets only the JSON lines"""
+    _settings["slow_ms"] = slow_ms
+    if log_path:
+        handler = logging.FileHandler(log_path, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        trace_logger.addHandler(handler)
+        trace_logger.propagate = False
+
+class Trace:
+    """Spans of one command, as (name, seconds) in the order they finished"""
+    def __init__(self, command, chat_id):
+        self.command = command
+        self.chat_id = chat_id
+        self.started_at = time.time()
+        self.started = time.perf_counter()
+        self.spans = []
+        self.attrs = {}
+        self.pending = 0
+        self.closed = False
+
+    def add(self, name, seconds):
+        self.spans.append((name, seconds))
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def totals(self):
+        """name -> (total seconds, calls), slowest first"""
+        totals = defaultdict(lambda: [0.0, 0])
+        for name, seconds in self.spans:
+            totals[name][0] += seconds
+            totals[name][1] += 1
+        return dict(sorted(totals.items(), key=lambda item: item[1][0], reverse=True))
+
+    def footer(self, limit=6):
+        """One-line breakdown for the debug footer (inside a Markdown code span)"""
+        parts = [f"total {self.elapsed() * 1000:.0f}ms"]
+        for name, (seconds, calls) in list(self.totals().items())[:limit]:
+            parts.append(f"{name} {seconds * 1000:.0f}ms" + (f" x{calls}" if calls > 1 else ""))
+        for key, value in self.attrs.items():
+            parts.append(f"{key}={value}")
+        return "`" + " | ".join(parts) + "`"
+
+    def as_record(self):
+        return {
+            "trace": self.command,
+            "chat_id": self.chat_id,
+            "started_at": round(self.started_at, 3),
+            "total_ms": round(self.elapsed() * 1000, 1),
+            **self.attrs,
+            "stages": {
+                name: {"ms": round(seconds * 1000, 1), "calls": calls}
+                for name, (seconds, calls) in self.totals().items()
+            },
+        }
+
+def current():
+    """Active Trace of this task, or None"""
+    return _current.get()
+
+def record(name, seconds):
+    """Add a finished span to the active trace, if any"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(name, seconds)
+
+def annotate(**attrs):
+    """Attach values (e.g. the window's message count) to the active trace"""
+    trace = _current.get()
+    if trace is not None:
+        trace.attrs.update(attrs)
+
+def follow(future, name):
+    """Time `future` as a span of the active trace without awaiting it; the trace
+    is logged only after it completes"""
+    trace = _current.get()
+    if trace is None:
+        return
+    start = time.perf_counter()
+    trace.pending += 1
+
+    def done(_):
+        trace.add(name, time.perf_counter() - start)
+        trace.pending -= 1
+        if trace.closed and not trace.pending:
+            _log_if_slow(trace)
+    future.add_done_callback(done)
+
+def _log_if_slow(trace):
+    if trace.elapsed() * 1000 >= _settings["slow_ms"]:
+        trace_logger.warning(json.dumps(trace.as_record(), ensure_ascii=False))
+
+@contextmanager
+def span(name):
+    """Time a block as a span of the active trace"""
+    if _current.get() is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+def traced(command):
+    """Decorator for an async (update, context) handler: trace it, log it if slow"""
+    def decorate(func):
+        @functools.wraps(func)
+        async def wrapper(update, context):
+            chat = update.effective_chat
+            trace = Trace(command, chat.id if chat else None)
+            token = _current.set(trace)
+            try:
+                return await func(update, context)
+            finally:
+                _current.reset(token)
+                trace.closed = True
+                if not trace.pending:
+                    _log_if_slow(trace)
+        return wrapper
+    return decorate
@@ -0,0 +1,125 @@
+"""
+Webhook mode (BOT_MODE=webhook).
+
+One aiohttp server on the bot's event loop receives Telegram updates and
+also answers the keep-alive routes (/, /health, /ready, /live, /ping,
+/metrics), replacing both long polling and the Flask thread. Updates are
+handed to the Application's update queue as soon as they arrive; with a
+secret token configured, posts without the matching
+X-Telegram-Bot-Api-Secret-Token header are refused.
+
+Recorded updates can be replayed against a local instance:
+
+    curl -X POST http://localhost:8080/telegram \\
+         -H "Content-Type: application/json" \\
+         -H "X-Telegram-Bot-Api-Secret-Token: $WEBHOOK_SECRET" \\
+         --data @update.json
+"""
+import asyncio
+import hmac
+import logging
+import signal
+import time
+
+from aiohttp import web
+from telegram import Update
+
+import metrics
+from keep_alive import (
+    HOME_TEXT, health_payload, liveness_payload, mark_ping, readiness_payload, register_health_provider
+)
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+stats = {
+    "updates": 0,
+    "rejected": 0,
+    "invalid": 0,
+    "last_update_at": None,
+}
+
+def application_feed(application):
+    """Feed for build_app that hands updates to a python-telegram-bot Application"""
+    async def feed(data):
+        if not isinstance(data, dict) or "update_id" not in data:
+            raise ValueError("not an update")
+        await application.update_queue.put(Update.de_json(data, application.bot))
+    return feed
+
+def build_app(feed, path, secret=None):
+    """aiohttp app: POST `path` passes each update's JSON to `feed`, plus the keep-alive routes.
+    feed raises ValueError, TypeError or KeyError for an update it cannot take."""
+    async def receive(request):
+        if secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), secret):
+            stats["rejected"] += 1
+            return web.Response(status=403)
+        try:
+            await feed(await request.json())
+        except (ValueError, TypeError, KeyError):
+            stats["invalid"] += 1
+            return web.Response(status=400)
+        stats["updates"] += 1
+        stats["last_update_at"] = time.time()
+        return web.Response()
+
+    async def home(request):
+        mark_ping()
+        return web.Response(text=HOME_TEXT)
+
+    async def health(request):
+        mark_ping()
+        return web.json_response(health_payload())
+
+    async def ready(request):
+        body, status = readiness_payload()
+        return web.json_response(body, status=status)
+
+    async def live(request):
+        body, status = liveness_payload()
+        return web.json_response(body, status=status)
+
+    async def metrics_endpoint(request):
+        return web.Response(body=metrics.render().encode("utf-8"), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+    async def ping(request):
+        mark_ping()
+        return web.Response(text="pong")
+
+    app = web.Application()
+    app.router.add_post(path, receive)
+    app.router.add_get("/", home)
+    app.router.add_get("/health", health)
+    app.router.add_get("/ready", ready)
+    app.router.add_get("/live", live)
+    app.router.add_get("/ping", ping)
+    app.router.add_get("/metrics", metrics_endpoint)
+    return app
+
+async def serve(application, port, path, secret=None, host="0.0.0.0", stop=None):
+    """Run the application behind the webhook server until SIGINT/SIGTERM or until `stop` is set"""
+    register_health_provider("webhook", lambda: dict(stats))
+    runner = web.AppRunner(build_app(application_feed(application), path, secret), access_log=None)
+    await runner.setup()
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signum, stop.set)
+
+    # Same lifecycle as run_polling: initialize, post_init, start ... stop, post_stop, shutdown
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"🌐 Webhook server listening on port {port}, updates at {path}")
+        try:
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+    if application.post_shutdown:
+        await application.post_shutdown(application)